@@ -0,0 +1,75 @@
+from django.conf import settings
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLogBuffer:
+    """
+    Process-wide buffer of access-log events.
+
+    Events are flushed as one `create_access_logs_task` (a single broker
+    round trip and a single bulk INSERT) once `batch_size` events are
+    buffered or the oldest one is `flush_seconds` old.
+    """
+
+    def __init__(self, batch_size=200, flush_seconds=2.0):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._entries = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, entry):
+        """
+        Queues one log entry: a dict with `profile_id`, `log_message`,
+        `is_recognized`, an ISO `timestamp` and, for stream visits,
+        `camera_id`, `last_seen`, `frame_count`, `best_score` and a
+        base64 JPEG `snapshot`.
+        """
+        self._ensure_flusher()
+        with self._lock:
+            self._entries.append(entry)
+            full = len(self._entries) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        from .tasks import create_access_logs_task
+
+        with self._lock:
+            entries, self._entries = self._entries, []
+        if entries:
+            create_access_logs_task.delay(entries)
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_periodically, name='access-log-flusher', daemon=True)
+                    self._flusher.start()
+                    atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing access logs failed.")
+
+
+_buffer = None
+
+
+def get_access_log_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = AccessLogBuffer(
+            batch_size=settings.FACE_ACCESS_LOG_BATCH_SIZE,
+            flush_seconds=settings.FACE_ACCESS_LOG_FLUSH_SECONDS,
+        )
+    return _buffer
@@ -1,13 +1,21 @@
 from django.contrib import admin
 
-from .models import FaceLibrary, FaceProfile, AccessLog
+from .models import FaceLibrary, FaceProfile, FaceEmbedding, AccessLog, AccessLogRollup, EnrollmentJob
+
+class FaceEmbeddingInline(admin.TabularInline):
+    model = FaceEmbedding
+    fields = ('model_name', 'face_index', 'dim', 'norm', 'created_at')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
 
 @admin.register(FaceProfile)
 class FaceProfileAdmin(admin.ModelAdmin):
     list_display = ('name', 'library', 'is_registered', 'face_id')
     list_filter = ('library', 'is_registered')
     search_fields = ('name', 'face_id')
-    readonly_fields = ('face_id', 'is_registered', 'face_embedding')
+    readonly_fields = ('face_id', 'is_registered')
+    inlines = [FaceEmbeddingInline]
 
 @admin.register(FaceLibrary)
 class FaceLibraryAdmin(admin.ModelAdmin):
@@ -15,10 +23,24 @@ class FaceLibraryAdmin(admin.ModelAdmin):
 
 @admin.register(AccessLog)
 class AccessLogAdmin(admin.ModelAdmin):
-    list_display = ('timestamp', 'profile_name', 'is_recognized', 'log_message')
-    list_filter = ('is_recognized', 'timestamp')
+    list_display = ('timestamp', 'last_seen', 'profile_name', 'camera_id', 'frame_count', 'is_recognized', 'log_message')
+    list_filter = ('is_recognized', 'camera_id', 'timestamp')
     search_fields = ('profile__name', 'log_message')
+    list_select_related = ('profile',)
+    show_full_result_count = False
 
     def profile_name(self, obj):
         return obj.profile.name if obj.profile else "Stranger"
     profile_name.short_description = 'الشخص'
+
+@admin.register(AccessLogRollup)
+class AccessLogRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'hour', 'profile', 'is_recognized', 'visits', 'frames')
+    list_filter = ('day', 'is_recognized')
+    list_select_related = ('profile',)
+
+@admin.register(EnrollmentJob)
+class EnrollmentJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'library', 'status', 'total', 'processed', 'registered', 'failed', 'created_at')
+    list_filter = ('status', 'library')
+    readonly_fields = ('status', 'total', 'processed', 'registered', 'failed', 'error', 'finished_at')
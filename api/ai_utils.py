@@ -1,67 +1,344 @@
 from django.conf import settings
-import insightface
-from insightface.app import FaceAnalysis
 import numpy as np
 import cv2
+import logging
 import os
+import redis
+import resource
+import threading
+import time
 
-app = FaceAnalysis(
-    name='buffalo_l',
-    providers=['CUDAExecutionProvider', 'CPUExecutionProvider']
-)
-app.prepare(ctx_id=0, det_size=(640, 640))
+from .embedding_cache import get_embedding_cache
 
-print(f"✅ InsightFace initialized on: {app.det_model.providers}")
+logger = logging.getLogger(__name__)
+
+# InsightFace (and onnxruntime behind it) is imported and its models loaded
+# on first use only, so management commands, migrations, admin requests
+# and beat never pay for them.
+_app = None
+_app_lock = threading.Lock()
+_model_info = {'loaded': False}
+
+# Redis key naming the tier every process serves. Re-embedding runs set it
+# when they switch, and sync_model_tier_task pins it the first time a
+# worker starts; FACE_MODEL_TIER applies only while it is missing.
+ACTIVE_TIER_KEY = 'face_model:active_tier'
+_tier = {'name': None, 'checked': 0.0, 'pinned': False}
+
+
+def active_model_tier():
+    """
+    The tier this process serves. Re-read from Redis every
+    FACE_MODEL_TIER_REFRESH_SECONDS so processes that get no gallery
+    deltas (Celery workers) follow a switch too.
+    """
+    stale = time.monotonic() - _tier['checked'] >= settings.FACE_MODEL_TIER_REFRESH_SECONDS
+    if _tier['name'] is None or (stale and not _tier['pinned']):
+        use_model_tier(read_active_tier())
+    return _tier['name']
+
+
+def read_active_tier():
+    from .gallery import get_redis
+
+    try:
+        tier = get_redis().get(ACTIVE_TIER_KEY)
+    except redis.RedisError:
+        return _tier['name'] or settings.FACE_MODEL_TIER
+    tier = tier.decode() if tier else None
+    return tier if tier in settings.FACE_MODEL_TIERS else settings.FACE_MODEL_TIER
+
+
+def use_model_tier(tier):
+    """
+    Makes `tier` the one this process serves; the previous tier's model is
+    dropped and the new one is loaded on the next `get_app()`. Returns True
+    if the tier changed.
+    """
+    global _app
+    with _app_lock:
+        _tier['checked'] = time.monotonic()
+        previous = _tier['name']
+        if tier == previous or _tier['pinned']:
+            return False
+        _tier['name'] = tier
+        if previous is None:
+            return False
+        _app = None
+        _model_info.clear()
+        _model_info['loaded'] = False
+    logger.info("Model tier switched from %s to %s.", previous, tier, extra={'tier': tier})
+    return True
+
+
+def current_embedding_model():
+    """
+    The embedding model tag of the tier this process serves; the gallery
+    and new embeddings use this tag. The stub model has its own tag, so its
+    embeddings never mix with a real model's.
+    """
+    if settings.FACE_MODEL_STUB:
+        return 'stub'
+    return settings.FACE_MODEL_TIERS[active_model_tier()]['EMBEDDING_MODEL']
+
+
+def get_app():
+    """
+    The process-wide FaceAnalysis for the active model tier, loaded on first
+    call with only the modules in FACE_MODEL_MODULES.
+    """
+    global _app
+    tier = active_model_tier()
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                started = time.perf_counter()
+                rss_before = _max_rss_mb()
+                if settings.FACE_MODEL_STUB:
+                    from .stub_model import StubFaceApp
+                    app = StubFaceApp(faces=settings.FACE_MODEL_STUB_FACES)
+                else:
+                    app = load_face_app(tier)
+                _model_info.update({
+                    'loaded': True,
+                    'tier': tier,
+                    'model': 'stub' if settings.FACE_MODEL_STUB else settings.FACE_MODEL_TIERS[tier]['EMBEDDING_MODEL'],
+                    'modules': sorted(app.models),
+                    'providers': app.det_model.session.get_providers(),
+                    'det_size': list(settings.FACE_MODEL_TIERS[tier]['DET_SIZE']),
+                    'load_seconds': round(time.perf_counter() - started, 2),
+                    'max_rss_mb_before': rss_before,
+                    'max_rss_mb_after': _max_rss_mb(),
+                })
+                logger.info(
+                    "InsightFace %s %s initialized on %s in %.1f s (peak RSS %s -> %s MB).",
+                    _model_info['model'], _model_info['modules'], _model_info['providers'],
+                    _model_info['load_seconds'], rss_before, _model_info['max_rss_mb_after'],
+                    extra={'model_info': dict(_model_info)},
+                )
+                _app = app
+    return _app
+
+
+def install_app(app, tier=None):
+    """
+    Makes `app` this process's model and pins the tier so no switch replaces
+    it; used by benchmarks and load tests to run on api.stub_model.
+    """
+    global _app
+    with _app_lock:
+        _app = app
+        _tier.update(name=tier or _tier['name'] or settings.FACE_MODEL_TIER, pinned=True)
+        _model_info.clear()
+        _model_info.update({'loaded': True, 'tier': _tier['name'], 'model': type(app).__name__})
+
+
+def load_face_app(tier_name):
+    """
+    Builds a FaceAnalysis for one entry of FACE_MODEL_TIERS, swapping in the
+    INT8 recognition model for quantized tiers.
+    """
+    from insightface.app import FaceAnalysis
+    from insightface import model_zoo
+
+    tier = settings.FACE_MODEL_TIERS[tier_name]
+    app = FaceAnalysis(
+        name=tier['PACK'],
+        allowed_modules=settings.FACE_MODEL_MODULES,
+        providers=settings.FACE_MODEL_PROVIDERS,
+    )
+    if tier['QUANTIZED']:
+        app.models['recognition'] = model_zoo.get_model(
+            quantize_model(app.models['recognition'].model_file),
+            providers=settings.FACE_MODEL_PROVIDERS,
+        )
+    app.prepare(ctx_id=settings.FACE_MODEL_CTX_ID, det_size=tuple(tier['DET_SIZE']))
+    return app
+
+
+def quantize_model(model_file):
+    """
+    Returns the path of an INT8 (dynamic, weight-only) copy of an ONNX
+    model, creating it on first use. The copy lives outside the pack's
+    directory so FaceAnalysis does not pick it up as a second model.
+    """
+    pack_dir = os.path.dirname(model_file)
+    quantized_dir = os.path.join(os.path.dirname(pack_dir), f"{os.path.basename(pack_dir)}_int8")
+    quantized_file = os.path.join(quantized_dir, os.path.basename(model_file))
+    if os.path.exists(quantized_file):
+        return quantized_file
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(quantized_dir, exist_ok=True)
+    tmp_file = f"{quantized_file}.tmp"
+    quantize_dynamic(model_file, tmp_file, weight_type=QuantType.QInt8)
+    os.replace(tmp_file, quantized_file)
+    logger.info("Quantized %s to INT8 at %s.", model_file, quantized_file)
+    return quantized_file
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def get_model_info():
+    """
+    Which model this process loaded, how long it took and what it cost in
+    memory; {'loaded': False} until the first inference.
+    """
+    return dict(_model_info)
 
 
 def get_face_embedding(image_path):
     try:
         full_image_path = os.path.join(settings.MEDIA_ROOT, image_path)
-        image = cv2.imread(full_image_path)
-        
-        if image is None:
-            print(f"ERROR: Cannot read image {image_path}")
-            return None
-        
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        faces = app.get(image_rgb)
-        if len(faces) == 0:
-            print(f"ERROR: No face found in {image_path}")
+        with open(full_image_path, 'rb') as f:
+            data = f.read()
+
+        # Same bytes and same model give the same faces: check the
+        # content-addressed cache before decoding or running the model.
+        cache = get_embedding_cache()
+        key = cache.key(data) if cache else None
+        model_name = current_embedding_model()
+        cached = None
+        if cache:
+            # A broken cache (full disk, permissions, corrupt entry) must
+            # never fail the embedding: fall through to the model.
+            try:
+                cached = cache.get(key, model_name)
+            except Exception:
+                logger.exception("Reading the embedding cache failed.")
+        if cached is not None:
+            embeddings = cached[0]
+        else:
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                logger.error("Cannot read image %s.", image_path)
+                return None
+
+            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+            faces = get_app().get(image_rgb)
+            embeddings = [face.embedding for face in faces]
+            if cache:
+                try:
+                    cache.put(
+                        key, model_name, embeddings,
+                        [face.bbox for face in faces], [face.det_score for face in faces],
+                    )
+                except Exception:
+                    logger.exception("Writing the embedding cache failed.")
+
+        if len(embeddings) == 0:
+            logger.warning("No face found in %s.", image_path)
             return None
-        all_embeddings = [face.embedding.tolist() for face in faces]
-        print(f"INFO: Found {len(all_embeddings)} face(s) and extracted their embeddings.")
+        all_embeddings = [np.asarray(embedding).tolist() for embedding in embeddings]
+        logger.info("Found %d face(s) in %s.", len(all_embeddings), image_path, extra={'faces': len(all_embeddings)})
         return all_embeddings
 
-    except Exception as e:
-        print(f"AI Processing Error for {image_path}: {e}")
+    except Exception:
+        logger.exception("Embedding %s failed.", image_path)
         return None
 
 
+def detect_faces(image, max_num=0, app=None):
+    """
+    Runs only the detector; the returned faces carry bbox, kps and det_score
+    but no embedding.
+    """
+    from insightface.app.common import Face
+
+    bboxes, kpss = (app or get_app()).det_model.detect(image, max_num=max_num, metric='default')
+    return [
+        Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+        for i in range(bboxes.shape[0])
+    ]
+
+
+def embed_faces(image, faces):
+    """
+    Fills `face.embedding` for the given faces with one batched run of the
+    recognition model.
+    """
+    return embed_face_batch([(image, face) for face in faces])
+
+
+def embed_face_batch(items, app=None):
+    """
+    Like `embed_faces`, for (image, face) pairs that may come from different
+    frames, so faces from several cameras share one model run. Faces without
+    landmarks cannot be aligned; they are skipped and keep no embedding.
+    """
+    items = [(image, face) for image, face in items if face.kps is not None]
+    if not items:
+        return []
+
+    from insightface.utils import face_align
+
+    recognizer = (app or get_app()).models['recognition']
+    crops = [
+        face_align.norm_crop(image, landmark=face.kps, image_size=recognizer.input_size[0])
+        for image, face in items
+    ]
+    faces = [face for _, face in items]
+    for face, embedding in zip(faces, recognizer.get_feat(crops)):
+        face.embedding = embedding.flatten()
+    return faces
+
+
+def normalize_rows(embeddings):
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix = matrix.reshape(-1, matrix.shape[-1])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def match_embeddings(query_embeddings, known_matrix, thresholds, top_k=1):
+    """
+    Batched cosine matcher.
+
+    Args:
+        query_embeddings: (M, D) raw embeddings of the faces in one frame.
+        known_matrix: (N, D) gallery rows, already L2-normalized float32.
+        thresholds: scalar or (N,) per-row minimum similarity.
+        top_k (int): Number of candidates returned per query.
+
+    Returns:
+        (indices, scores): two (M, k) arrays sorted by descending score, with
+        the index set to -1 wherever the score does not beat the threshold.
+    """
+    queries = normalize_rows(query_embeddings)
+    scores = queries @ known_matrix.T
+
+    k = min(top_k, known_matrix.shape[0])
+    if k < known_matrix.shape[0]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), (scores.shape[0], k))
+    top_scores = np.take_along_axis(scores, candidates, axis=1)
+
+    order = np.argsort(-top_scores, axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    limits = np.broadcast_to(np.asarray(thresholds, dtype=np.float32), (known_matrix.shape[0],))
+    accepted = top_scores > limits[candidates]
+    return np.where(accepted, candidates, -1), top_scores
+
+
 def recognize_face(unknown_embedding, known_embeddings, tolerance=0.5):
-    if not known_embeddings or unknown_embedding is None:
+    if known_embeddings is None or len(known_embeddings) == 0 or unknown_embedding is None:
         return -1
 
     try:
-        unknown_emb = np.array(unknown_embedding)
-        known_embs = np.array(known_embeddings)
-        
-        similarities = np.dot(known_embs, unknown_emb) / (
-            np.linalg.norm(known_embs, axis=1) * np.linalg.norm(unknown_emb)
+        indices, _ = match_embeddings(
+            [unknown_embedding], normalize_rows(known_embeddings), tolerance
         )
-        
-        max_similarity_idx = np.argmax(similarities)
-        max_similarity = similarities[max_similarity_idx]
-        
-        if max_similarity > tolerance:
-            return int(max_similarity_idx)
-        
-        return -1
+        return int(indices[0, 0])
 
-    except Exception as e:
-        print(f"Recognition Error: {e}")
+    except Exception:
+        logger.exception("Recognition failed.")
         return -1
-
-
-def get_app():
-    return app
\ No newline at end of file
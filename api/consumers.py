@@ -1,5 +1,8 @@
-from django.apps import apps
-from django.db import connection
+from django.conf import settings
+from urllib.parse import parse_qs
+import asyncio
+import logging
+import time
 import json
 import base64
 import numpy as np
@@ -7,14 +10,31 @@ import cv2
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 
-from .tasks import create_access_log_task 
-from .ai_utils import recognize_face, get_app
+from .access_logs import get_access_log_buffer
+from .ai_utils import get_app
+from .gallery import apply_gallery_delta, get_gallery, get_gallery_shards
+from .inference import get_inference_service
+from .ingest import ALL_CAMERAS_GROUP, camera_group
+from .metrics import STREAM_FRAMES, timed
+from .pipeline import FramePipeline, annotate_frame
+from .presence import PresenceTracker
+from .protocol import KIND_FRAME, KIND_RESULT, ProtocolError, decode_message, encode_message
 
-KNOWN_FACES_DATA = {
-    'embeddings': [],
-    'names': [],
-    'profiles': []
-}
+# annotated: the server draws the boxes and returns the re-encoded frame.
+# metadata: only the detections are returned; the client draws the overlay.
+STREAM_MODE_ANNOTATED = 'annotated'
+STREAM_MODE_METADATA = 'metadata'
+STREAM_MODES = (STREAM_MODE_ANNOTATED, STREAM_MODE_METADATA)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_library_ids(value):
+    """
+    Library ids from the ?libraries= query parameter, e.g. "1,4". Raises
+    ValueError on anything but comma-separated integers.
+    """
+    return sorted({int(part) for part in value.split(',') if part.strip()})
 
 class StreamConsumer(AsyncWebsocketConsumer):
     
@@ -26,9 +46,54 @@ class StreamConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
-        print("WebSocket Connected and joined group: Ready for AI Stream.")
         
-        await sync_to_async(self.load_known_faces)()
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.stream_mode = params.get('mode', [settings.FACE_STREAM_DEFAULT_MODE])[0]
+        if self.stream_mode not in STREAM_MODES:
+            self.stream_mode = STREAM_MODE_ANNOTATED
+        
+        # A connection bound to libraries only ever matches against their
+        # shards; without ?libraries= it matches against every library.
+        try:
+            library_ids = parse_library_ids(params.get('libraries', [''])[0])
+        except ValueError:
+            logger.warning("Stream rejected: ?libraries= must be comma-separated library ids.")
+            await self.close(code=4400)
+            return
+        # ?watch=entrance,lobby (or ?watch=all) also forwards the results of
+        # those server-side ingested cameras (manage.py ingest_cameras). Each
+        # camera publishes to its own group, so other sockets never get them.
+        self.watch = {part.strip() for part in params.get('watch', [''])[0].split(',') if part.strip()}
+        # Results use the framing of the client's last frame; watchers, which
+        # send none, pick it with ?format=json (binary by default).
+        self.binary_results = params.get('format', ['binary'])[0] != 'json'
+        for group in self.watch_groups():
+            await self.channel_layer.group_add(group, self.channel_name)
+        if library_ids:
+            self.galleries = await sync_to_async(get_gallery_shards().acquire)(library_ids)
+            self.library_ids = library_ids
+        else:
+            await sync_to_async(get_gallery().ensure_loaded)()
+            self.galleries = None
+        logger.info(
+            "Stream connected (%s mode, libraries: %s).", self.stream_mode, ', '.join(map(str, library_ids)) or 'all',
+            extra={'channel': self.channel_name, 'stream_mode': self.stream_mode, 'library_ids': library_ids},
+        )
+        
+        # Load the models now rather than on this connection's first frame.
+        await sync_to_async(get_app, thread_sensitive=False)()
+        # One pipeline (tracker, motion gate, ROIs) per camera on this socket.
+        self.pipelines = {}
+        self.presence = {}
+        
+        # Latest-frame-wins: receive() only parks the newest frame here and
+        # the worker task processes whatever is newest when it gets free.
+        self.pending_frame = None
+        self.frame_ready = asyncio.Event()
+        self.frame_stats = {'received': 0, 'processed': 0, 'dropped': 0}
+        self.credits = settings.FACE_STREAM_MAX_CREDITS
+        self.processing_ms = 0.0
+        self.frame_worker = asyncio.create_task(self.process_frames())
 
 
     async def disconnect(self, close_code):
@@ -36,104 +101,191 @@ class StreamConsumer(AsyncWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
-        print(f"WebSocket Disconnected with code: {close_code}")
-        
-    def load_known_faces(self):
-        global KNOWN_FACES_DATA
+        for group in self.watch_groups():
+            await self.channel_layer.group_discard(group, self.channel_name)
+        if getattr(self, 'frame_worker', None):
+            self.frame_worker.cancel()
+        for presence in getattr(self, 'presence', {}).values():
+            self.log_visits(presence.close_all())
+        if getattr(self, 'library_ids', None):
+            get_gallery_shards().release(self.library_ids)
+        logger.info(
+            "Stream disconnected with code %s.", close_code,
+            extra={'channel': self.channel_name, 'close_code': close_code, 'frames': getattr(self, 'frame_stats', {})},
+        )
         
-        connection.close() 
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            if bytes_data is not None:
+                kind, seq, camera_id, _, jpeg = decode_message(bytes_data)
+                if kind != KIND_FRAME:
+                    raise ProtocolError(f"Unexpected message kind {kind}.")
+                frame = {'binary': True, 'seq': seq, 'camera_id': camera_id, 'payload': jpeg}
+            else:
+                data = json.loads(text_data)
+                if not data.get('frame'):
+                    return
+                frame = {'binary': False, 'seq': data.get('seq', 0), 'camera_id': '', 'payload': data['frame']}
+            self.binary_results = frame['binary']
+        except Exception as e:
+            logger.warning("Bad stream message: %s", e, extra={'channel': self.channel_name})
+            STREAM_FRAMES.labels('error').inc()
+            await self.send_result({'binary': bytes_data is not None, 'seq': 0, 'camera_id': ''},
+                                   {'error': str(e), 'status': 'frame_error'})
+            return
         
-        FaceProfile = apps.get_model('api', 'FaceProfile')
-        all_profiles = FaceProfile.objects.filter(is_registered=True, face_embedding__isnull=False)
+        self.frame_stats['received'] += 1
+        STREAM_FRAMES.labels('received').inc()
+        stale_frame, self.pending_frame = self.pending_frame, frame
+        self.frame_ready.set()
         
-        KNOWN_FACES_DATA['embeddings'] = [p.face_embedding for p in all_profiles]
-        KNOWN_FACES_DATA['names'] = [p.name for p in all_profiles]
-        KNOWN_FACES_DATA['profiles'] = all_profiles
-        print(f"✅ Loaded {len(KNOWN_FACES_DATA['embeddings'])} known faces.")
+        if stale_frame is not None:
+            # Ack the replaced frame so the client gets its credit back.
+            self.frame_stats['dropped'] += 1
+            STREAM_FRAMES.labels('dropped').inc()
+            self.credits = 1
+            await self.send_result(stale_frame, {'status': 'dropped', **self.flow_control()})
 
-    async def receive(self, text_data=None, bytes_data=None):
-        try:
-            data = json.loads(text_data)
-            image_data_b64 = data.get('frame') 
-            if not image_data_b64:
-                return
+    async def process_frames(self):
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            frame, self.pending_frame = self.pending_frame, None
+            if frame is None:
+                continue
             
-            processed_frame_b64, detections = await sync_to_async(self.process_frame_and_recognize)(image_data_b64)
+            started = time.perf_counter()
+            try:
+                jpeg, detections, frame_info = await self.process_frame_and_recognize(frame)
+            except Exception as e:
+                logger.exception("Frame processing failed.", extra={'channel': self.channel_name, 'camera_id': frame['camera_id']})
+                STREAM_FRAMES.labels('error').inc()
+                await self.send_result(frame, {'error': str(e), 'status': 'frame_error', **self.flow_control()})
+                continue
             
-            await self.send(text_data=json.dumps({
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.processing_ms = elapsed_ms if not self.processing_ms else 0.8 * self.processing_ms + 0.2 * elapsed_ms
+            self.frame_stats['processed'] += 1
+            STREAM_FRAMES.labels('processed').inc()
+            if self.pending_frame is None:
+                self.credits = min(self.credits + 1, settings.FACE_STREAM_MAX_CREDITS)
+            
+            await self.send_result(frame, {
                 'status': 'processed',
-                'frame': processed_frame_b64,
-                'detections': detections
-            }))
-        except Exception as e:
-            print(f"❌ ERROR in Consumer Receive: {e}")
-            await self.send(text_data=json.dumps({'error': str(e), 'status': 'frame_error'}))
+                'mode': self.stream_mode,
+                'detections': detections,
+                **frame_info,
+                **self.flow_control(),
+            }, jpeg)
 
+    def flow_control(self):
+        """
+        Credit/ack fields attached to every reply. `credits` is how many
+        frames the client may have in flight: it drops to one when a frame
+        is dropped and grows back while the worker keeps up.
+        """
+        return {
+            'credits': self.credits,
+            'processing_ms': round(self.processing_ms, 1),
+            'stats': dict(self.frame_stats),
+        }
 
-    def process_frame_and_recognize(self, image_data_b64):
+    async def send_result(self, frame, metadata, jpeg=b''):
+        with timed('send'):
+            await self._send_result(frame, metadata, jpeg)
 
-        img_bytes = base64.b64decode(image_data_b64)
-        np_arr = np.frombuffer(img_bytes, np.uint8)
-        frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        app = get_app()
+    async def _send_result(self, frame, metadata, jpeg):
+        if frame['binary']:
+            await self.send(bytes_data=encode_message(
+                KIND_RESULT, frame['seq'], frame['camera_id'], metadata, jpeg
+            ))
+        else:
+            await self.send(text_data=json.dumps({
+                **metadata,
+                'seq': frame['seq'],
+                'frame': base64.b64encode(jpeg).decode('utf-8') if len(jpeg) else None,
+            }))
+
+    async def process_frame_and_recognize(self, frame):
+        image, frame_rgb = await sync_to_async(self.decode_frame, thread_sensitive=False)(frame)
         
-        faces = app.get(frame_rgb)
+        detections = await get_inference_service().submit(self.get_pipeline(frame['camera_id']), frame_rgb)
         
-        results = []
+        jpeg = await sync_to_async(self.render_frame, thread_sensitive=False)(image, detections, frame['camera_id'])
+        return jpeg, detections, {'width': image.shape[1], 'height': image.shape[0]}
+
+    def get_pipeline(self, camera_id):
+        if camera_id not in self.pipelines:
+            self.pipelines[camera_id] = FramePipeline(camera_id, self.galleries)
+        return self.pipelines[camera_id]
+
+    def decode_frame(self, frame):
+        if frame['binary']:
+            jpeg = frame['payload']
+        else:
+            with timed('base64_decode'):
+                jpeg = base64.b64decode(frame['payload'])
+        with timed('imdecode'):
+            image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Frame is not a decodable image.")
         
-        for face in faces:
-            bbox = face.bbox.astype(int)
-            left, top, right, bottom = bbox[0], bbox[1], bbox[2], bbox[3]
-            
-            face_embedding = face.embedding.tolist()
-            
-            match_index = recognize_face(
-                unknown_embedding=face_embedding, 
-                known_embeddings=KNOWN_FACES_DATA['embeddings'],
-                tolerance=0.5
-            )
-            
-            if match_index != -1:
-                name = KNOWN_FACES_DATA['names'][match_index]
-                is_recognized = True
-                color = (16, 185, 129)
-            else:
-                name = "Stranger"
-                is_recognized = False
-                color = (239, 68, 68)
-            
-            log_message = f"Recognition successful for {name}" if is_recognized else "New Stranger detected"
-            
-            cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-            cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
-            cv2.putText(
-                frame, 
-                name, 
-                (left + 6, bottom - 6), 
-                cv2.FONT_HERSHEY_DUPLEX, 
-                0.8, 
-                (255, 255, 255), 
-                1
-            )
-            
-            create_access_log_task.delay(
-                profile_name=name,
-                log_message=log_message,
-                is_recognized=is_recognized,
+        return image, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    def render_frame(self, image, detections, camera_id=''):
+        # One access log per visit, not per frame: the presence tracker
+        # keeps the visits open and hands back the ones that just ended.
+        presence = self.presence.get(camera_id)
+        if presence is None:
+            presence = self.presence[camera_id] = PresenceTracker(
+                camera_id=camera_id,
+                absence_seconds=settings.FACE_PRESENCE_ABSENCE_SECONDS,
+                min_frames=settings.FACE_PRESENCE_MIN_FRAMES,
+                stranger_similarity=settings.FACE_PRESENCE_STRANGER_SIMILARITY,
             )
-            
-            results.append({'name': name, 'is_recognized': is_recognized})
+        self.log_visits(presence.observe(image, detections, self.get_pipeline(camera_id).track_embeddings()))
+        
+        if self.stream_mode == STREAM_MODE_METADATA:
+            # The browser still holds the original frame and draws the
+            # overlay itself, so skip drawing and JPEG encoding entirely.
+            return b''
         
-        _, buffer = cv2.imencode('.jpeg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        processed_frame_b64 = base64.b64encode(buffer).decode('utf-8')
+        with timed('draw'):
+            annotate_frame(image, detections)
+        with timed('jpeg_encode'):
+            _, buffer = cv2.imencode('.jpeg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
         
-        return processed_frame_b64, results
+        return buffer
+
+    def log_visits(self, sessions):
+        access_logs = get_access_log_buffer()
+        for session in sessions:
+            access_logs.add(session.to_log_entry())
+
+    def watch_groups(self):
+        watch = getattr(self, 'watch', set())
+        if 'all' in watch:
+            return [ALL_CAMERAS_GROUP]
+        return [camera_group(camera_id) for camera_id in watch]
+
+    async def camera_result(self, event):
+        # Distinct camera ids can share a sanitized group name.
+        watch = getattr(self, 'watch', set())
+        if 'all' not in watch and event['camera_id'] not in watch:
+            return
+        # A connection bound to libraries only sees cameras bound to a
+        # subset of them, so it never learns names from other libraries.
+        library_ids = getattr(self, 'library_ids', None)
+        if library_ids and not (event['library_ids'] and set(event['library_ids']) <= set(library_ids)):
+            return
+        frame = {'binary': getattr(self, 'binary_results', True), 'seq': event['seq'], 'camera_id': event['camera_id']}
+        # JSON results have no header, so they carry the camera id themselves.
+        await self.send_result(frame, {**event['metadata'], 'camera_id': event['camera_id']}, event['jpeg'])
 
     async def reload_ai_library(self, event):
-        await sync_to_async(self.load_known_faces)()
+        # Every socket in this process receives the event, but the shared
+        # gallery and shards apply each delta version only once.
+        await sync_to_async(apply_gallery_delta)(event['delta'])
 
         await self.send(text_data=json.dumps({
             'type': 'status_update',
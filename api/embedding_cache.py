@@ -0,0 +1,122 @@
+from django.conf import settings
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TMP_SUFFIX = '.tmp.npz'
+# Temporary files younger than this may still be being written by another
+# process; older ones were left behind by a crash.
+TMP_GRACE_SECONDS = 3600
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of detection + embedding results.
+
+    Entries are keyed by the SHA-256 of the image bytes and the embedding
+    model tag, so the same photo enrolled twice, or re-embedded after a
+    rollback or restore, is not run through the model again. Each entry is
+    a small .npz with the faces' embeddings, boxes and detection scores
+    (an image with no face is cached too).
+
+    Reads touch the file's mtime; once the cache grows past `max_bytes`
+    the least recently used entries are deleted down to 90% of it.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._written = 0
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def path(self, key, model_name):
+        return os.path.join(self.directory, model_name, key[:2], f"{key}.npz")
+
+    def get(self, key, model_name):
+        """
+        Returns (embeddings, bboxes, det_scores) arrays, or None on a miss.
+        """
+        path = self.path(key, model_name)
+        try:
+            with np.load(path) as entry:
+                result = entry['embeddings'], entry['bboxes'], entry['det_scores']
+            os.utime(path)
+            return result
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, key, model_name, embeddings, bboxes, det_scores):
+        path = self.path(key, model_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}{TMP_SUFFIX}"
+        np.savez(
+            tmp_path,
+            embeddings=np.asarray(embeddings, dtype=np.float32),
+            bboxes=np.asarray(bboxes, dtype=np.float32),
+            det_scores=np.asarray(det_scores, dtype=np.float32),
+        )
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._written += os.path.getsize(path)
+            # Only rescan the directory after writing a twentieth of the budget.
+            if self._written < self.max_bytes // 20:
+                return
+            self._written = 0
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                if name.endswith(TMP_SUFFIX) and now - stat.st_mtime < TMP_GRACE_SECONDS:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        logger.info(
+            "Embedding cache: evicted %d entries, %.0f MB left.", removed, total / 2**20,
+            extra={'evicted': removed, 'cache_bytes': total},
+        )
+        return removed
+
+
+_cache = None
+
+
+def get_embedding_cache():
+    """
+    The process-wide cache, or None when FACE_EMBEDDING_CACHE_DIR is unset.
+    """
+    global _cache
+    if _cache is None and settings.FACE_EMBEDDING_CACHE_DIR:
+        _cache = EmbeddingCache(settings.FACE_EMBEDDING_CACHE_DIR, settings.FACE_EMBEDDING_CACHE_MAX_BYTES)
+    return _cache
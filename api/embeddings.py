@@ -0,0 +1,56 @@
+import numpy as np
+
+# Embeddings are stored as packed little-endian float32, `dim` values each.
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+
+def pack_embedding(embedding):
+    """
+    Returns (bytes, dim, norm) for one raw embedding vector.
+    """
+    vector = np.ascontiguousarray(embedding, dtype=EMBEDDING_DTYPE).reshape(-1)
+    return vector.tobytes(), vector.shape[0], float(np.linalg.norm(vector))
+
+
+def unpack_embedding(data, dim):
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE, count=dim)
+
+
+def unpack_matrix(blobs, dim):
+    """
+    Turns a sequence of packed vectors into one writable (N, dim) float32
+    array, with a single copy into a contiguous buffer.
+    """
+    if not blobs:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.frombuffer(bytearray().join(blobs), dtype=EMBEDDING_DTYPE).reshape(-1, dim).astype(np.float32, copy=False)
+
+
+def build_face_embeddings(profile, embeddings, model_name=None):
+    """
+    Unsaved FaceEmbedding rows for every face `get_face_embedding` found in
+    a profile's image, in detection order.
+    """
+    from .ai_utils import current_embedding_model
+    from .models import FaceEmbedding
+
+    model_name = model_name or current_embedding_model()
+    rows = []
+    for face_index, embedding in enumerate(embeddings):
+        data, dim, norm = pack_embedding(embedding)
+        rows.append(FaceEmbedding(
+            profile=profile, model_name=model_name, face_index=face_index, dim=dim, norm=norm, vector=data,
+        ))
+    return rows
+
+
+def replace_face_embeddings(profiles, rows, model_name=None):
+    """
+    Swaps the stored embeddings of `profiles` for the given model with `rows`.
+    """
+    from .ai_utils import current_embedding_model
+    from .models import FaceEmbedding
+
+    model_name = model_name or current_embedding_model()
+    FaceEmbedding.objects.filter(profile__in=profiles, model_name=model_name).delete()
+    FaceEmbedding.objects.bulk_create(rows, batch_size=1000)
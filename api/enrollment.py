@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from celery import chord
+import csv
+import io
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+
+class ImageSource:
+    """
+    Reads enrollment images by relative path from a ZIP archive or from a
+    directory on the server.
+    """
+
+    def __init__(self, archive=None, directory=None):
+        self.zip = zipfile.ZipFile(archive) if archive is not None else None
+        self.directory = directory
+        self.names = set(self.zip.namelist()) if self.zip else None
+
+    def read(self, path):
+        path = path.strip().lstrip('/')
+        if self.zip is not None:
+            return self.zip.read(path) if path in self.names else None
+
+        full_path = os.path.realpath(os.path.join(self.directory, path))
+        if not full_path.startswith(os.path.realpath(self.directory) + os.sep) or not os.path.isfile(full_path):
+            return None
+        with open(full_path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+
+def read_mapping(data):
+    """
+    Parses the CSV mapping: one row per person with `image` (path inside the
+    archive or directory), `name` and an optional `description` column.
+    """
+    rows = list(csv.DictReader(io.StringIO(data.decode('utf-8-sig'))))
+    if rows and not {'image', 'name'} <= set(rows[0]):
+        raise ValueError("Mapping CSV needs 'image' and 'name' columns.")
+    return [row for row in rows if row.get('image') and row.get('name')]
+
+
+def prepare_enrollment(job):
+    """
+    Copies the job's images into media storage, creates their FaceProfile
+    rows in bulk (bulk_create sends no post_save, so no per-profile tasks
+    or gallery events fire), then starts the chunked embedding workflow.
+    """
+    from .models import EnrollmentJob, FaceProfile
+    from .tasks import bulk_embed_chunk_task, fail_enrollment_task, finish_enrollment_task
+
+    job.status = EnrollmentJob.STATUS_PREPARING
+    job.save(update_fields=['status'])
+
+    with job.mapping.open('rb') as mapping_file:
+        rows = read_mapping(mapping_file.read())
+
+    archive = job.archive.open('rb') if job.archive else None
+    source = ImageSource(archive=archive, directory=job.source_path or None)
+    profiles, missing = [], 0
+    try:
+        for row in rows:
+            data = source.read(row['image'])
+            if data is None:
+                missing += 1
+                continue
+            image_name = default_storage.save(
+                f"faces_images/{os.path.basename(row['image'])}", ContentFile(data)
+            )
+            profiles.append(FaceProfile(
+                library=job.library,
+                name=row['name'].strip(),
+                description=(row.get('description') or '').strip(),
+                face_image=image_name,
+            ))
+    finally:
+        source.close()
+        if archive is not None:
+            archive.close()
+
+    FaceProfile.objects.bulk_create(profiles, batch_size=1000)
+
+    job.total = len(rows)
+    job.processed = missing
+    job.failed = missing
+    job.status = EnrollmentJob.STATUS_EMBEDDING
+    job.save(update_fields=['total', 'processed', 'failed', 'status'])
+    logger.info(
+        "Enrollment #%s: created %d profiles, %d images missing.", job.pk, len(profiles), missing,
+        extra={'job_id': job.pk, 'profiles': len(profiles), 'missing': missing},
+    )
+
+    chunk_size = settings.FACE_ENROLLMENT_CHUNK_SIZE
+    profile_ids = [str(profile.face_id) for profile in profiles]
+    chunks = [profile_ids[i:i + chunk_size] for i in range(0, len(profile_ids), chunk_size)]
+    if not chunks:
+        finish_enrollment_task.delay([], job.pk)
+        return job
+
+    # A chunk that raises skips the callback; the errback then ends the job
+    # as failed instead of leaving it in "embedding" forever.
+    chord(
+        bulk_embed_chunk_task.s(job.pk, chunk) for chunk in chunks
+    )(finish_enrollment_task.s(job.pk).on_error(fail_enrollment_task.s(job.pk)))
+    return job
@@ -0,0 +1,588 @@
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from channels.layers import get_channel_layer
+from asgiref.sync import async_to_sync
+import logging
+import threading
+import json
+import time
+import numpy as np
+import redis
+
+from .ai_utils import current_embedding_model, read_active_tier, use_model_tier
+from .embeddings import unpack_embedding, unpack_matrix
+from .gallery_snapshot import current_snapshot_version, read_snapshot, write_snapshot
+from .search_index import get_search_index
+
+logger = logging.getLogger(__name__)
+
+GALLERY_GROUP = 'face_stream_group'
+GALLERY_VERSION_KEY = 'face_gallery:version'
+GALLERY_JOURNAL_KEY = 'face_gallery:journal'
+
+# Bumps the version and appends the delta to the journal in one atomic step,
+# so a version is never visible to readers before its journal entry is.
+_PUBLISH_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+local delta = cjson.decode(ARGV[1])
+delta['version'] = version
+local encoded = cjson.encode(delta)
+redis.call('RPUSH', KEYS[2], encoded)
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+return encoded
+"""
+
+
+def get_redis():
+    return redis.Redis(host=settings.REDIS_HOST, port=6379)
+
+
+def normalize_embedding(embedding):
+    """
+    Returns the stored embedding as a unit-length float32 vector.
+
+    `get_face_embedding` stores one embedding per detected face, so for
+    multi-face images the first (highest-scoring) face is used.
+    """
+    if embedding is None:
+        return None
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    if vector.size == 0:
+        return None
+    if vector.ndim > 1:
+        vector = vector.reshape(-1, vector.shape[-1])[0]
+
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return None
+    return vector / norm
+
+
+class FaceGallery:
+    """
+    Process-wide gallery of registered faces.
+
+    Holds a contiguous, pre-normalized float32 matrix (one row per profile)
+    plus an id -> row map and the match threshold of each row's library.
+    It is loaded from the database once and then
+    patched in place with the versioned deltas published on the channel layer.
+
+    With `library_id` the gallery is a shard holding only that library's
+    profiles (see GalleryShards); without it, it holds every library.
+    """
+
+    def __init__(self, library_id=None):
+        self.library_id = library_id
+        self.lock = threading.RLock()
+        self.version = 0
+        self.loaded = False
+        self.ids = []
+        self.names = []
+        self.library_ids = []
+        self._rows = {}
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._thresholds = np.empty(0, dtype=np.float32)
+        self._size = 0
+        self.index = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def matrix(self):
+        return self._matrix[:self._size]
+
+    @property
+    def thresholds(self):
+        return self._thresholds[:self._size]
+
+    def search(self, query_embeddings, top_k=1):
+        """
+        Scores every query embedding against the gallery in one matrix multiply.
+
+        Returns one list per query of up to `top_k` (match, score) pairs, best
+        first, keeping only candidates above their library's threshold.
+        """
+        with self.lock:
+            if self._size == 0:
+                return [[] for _ in range(len(query_embeddings))]
+
+            indices, scores = self.index.search(
+                self.matrix, self.thresholds, query_embeddings, top_k=top_k
+            )
+            return [
+                [
+                    ({'face_id': self.ids[i], 'name': self.names[i], 'library_id': self.library_ids[i]}, float(score))
+                    for i, score in zip(row_indices, row_scores) if i != -1
+                ]
+                for row_indices, row_scores in zip(indices, scores)
+            ]
+
+    def ensure_loaded(self):
+        """
+        Loads the gallery, or brings a loaded one up to the current version.
+        Deltas only arrive through connected sockets, so a process that had
+        none may have missed some.
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load()
+                return
+            try:
+                self.catch_up()
+            except redis.RedisError as e:
+                logger.warning("Could not catch up with the gallery journal: %s", e)
+
+    def load(self):
+        """
+        Loads the gallery from the shared snapshot when there is one and the
+        journal covers everything published since it, else from the database.
+        """
+        with self.lock:
+            use_model_tier(read_active_tier())
+            if settings.FACE_GALLERY_SNAPSHOT_DIR and self._load_snapshot():
+                if self._replay_journal():
+                    return
+                logger.info("Journal does not reach back to snapshot v%d, loading from the database.", self.version)
+            self._load_from_db()
+
+    def load_rows(self, ids, names, library_ids, thresholds, matrix, version=0):
+        """
+        Loads the gallery from in-memory rows instead of the snapshot or the
+        database, e.g. a synthetic gallery for benchmarks. The rows of
+        `matrix` must already be unit length.
+        """
+        with self.lock:
+            self._reset(ids, names, library_ids, matrix, thresholds, len(ids))
+            self.version = version
+            self.loaded = True
+
+    def _load_snapshot(self):
+        started = time.perf_counter()
+        snapshot = read_snapshot(settings.FACE_GALLERY_SNAPSHOT_DIR, current_embedding_model())
+        if snapshot is None:
+            return False
+
+        ids, names, library_ids = snapshot['ids'], snapshot['names'], snapshot['library_ids']
+        matrix, thresholds, size = snapshot['matrix'], snapshot['thresholds'], snapshot['size']
+        if self.library_id is not None:
+            # A shard copies its library's rows out of the shared mapping.
+            rows = [row for row, library_id in enumerate(library_ids) if library_id == self.library_id]
+            ids, names, library_ids = [ids[r] for r in rows], [names[r] for r in rows], [library_ids[r] for r in rows]
+            matrix, thresholds, size = matrix[rows], thresholds[rows], len(rows)
+
+        self._reset(ids, names, library_ids, matrix, thresholds, size)
+        self.version = snapshot['version']
+        self.loaded = True
+        self._log_loaded(f"snapshot v{self.version}", started)
+        return True
+
+    def _load_from_db(self):
+        started = time.perf_counter()
+        # Read the version before the rows: any delta published while we
+        # query is replayed on top, and replaying is idempotent.
+        version = int(get_redis().get(GALLERY_VERSION_KEY) or 0)
+        ids, names, library_ids, thresholds, matrix = read_gallery_rows(self.library_id)
+        self._reset(ids, names, library_ids, matrix, thresholds, len(ids))
+
+        self.version = version
+        self.loaded = True
+        self._log_loaded("the database", started)
+
+    def _reset(self, ids, names, library_ids, matrix, thresholds, size):
+        # `matrix` may have spare rows past `size` for cheap appends.
+        self.ids = list(ids)
+        self.names = list(names)
+        self.library_ids = list(library_ids)
+        self._rows = {face_id: row for row, face_id in enumerate(self.ids)}
+        self._matrix = matrix
+        self._thresholds = np.resize(np.asarray(thresholds, dtype=np.float32), matrix.shape[0])
+        self._size = size
+
+        self.index = get_search_index(None if self.library_id is None else f"library{self.library_id}")
+        self.index.build(self.matrix, self.ids)
+
+    def _log_loaded(self, source, started):
+        logger.info(
+            "Loaded %d known faces%s from %s (gallery v%d) in %.0f ms.",
+            self._size, '' if self.library_id is None else f" of library {self.library_id}",
+            source, self.version, (time.perf_counter() - started) * 1000,
+            extra={'library_id': self.library_id, 'faces': self._size, 'gallery_version': self.version},
+        )
+
+    def apply_delta(self, delta):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+                return
+
+            version = delta['version']
+            if version <= self.version:
+                return
+            if version == self.version + 1:
+                self._apply(delta)
+                if delta['op'] == 'snapshot' and settings.FACE_GALLERY_SNAPSHOT_DIR:
+                    # Swap our private copy for the freshly shared one.
+                    self.load()
+                return
+
+            self.catch_up()
+
+    def catch_up(self):
+        """
+        Replays the journal entries newer than our version, falling back to a
+        full reload when the journal no longer reaches back far enough.
+        """
+        with self.lock:
+            if not self._replay_journal():
+                logger.info("Journal does not reach back to v%d, reloading.", self.version)
+                self.load()
+
+    def _replay_journal(self):
+        """
+        Applies the journal entries newer than our version. Returns False,
+        changing nothing, when the journal has a gap after our version.
+        """
+        entries = get_redis().lrange(GALLERY_JOURNAL_KEY, 0, -1)
+        missed = sorted(
+            (d for d in map(json.loads, entries) if d['version'] > self.version),
+            key=lambda d: d['version'],
+        )
+        if not missed:
+            return int(get_redis().get(GALLERY_VERSION_KEY) or 0) <= self.version
+        if missed[0]['version'] != self.version + 1:
+            return False
+
+        for delta in missed:
+            if delta['version'] > self.version:
+                self._apply(delta)
+        logger.info("Gallery caught up to v%d (%d deltas).", self.version, len(missed))
+        return True
+
+    def _apply(self, delta):
+        if delta['op'] == 'reload':
+            # The reload reads the current version itself. Go straight to
+            # the database: a snapshot older than this delta would bring
+            # us right back here. A reload that ends a re-embedding run also
+            # switches the model tier, before the new tier's rows are read.
+            if delta.get('model_tier'):
+                use_model_tier(delta['model_tier'])
+            self._load_from_db()
+            return
+        if delta['op'] == 'snapshot':
+            # A new shared snapshot changes no faces; see apply_delta.
+            pass
+        elif delta['op'] == 'delete':
+            self._remove(delta['face_id'])
+        elif self.library_id is not None and delta.get('library_id') != self.library_id:
+            # Another library's change; drop the profile if it moved away.
+            if delta['op'] != 'library':
+                self._remove(delta['face_id'])
+        elif delta['op'] == 'library':
+            for row, library_id in enumerate(self.library_ids):
+                if library_id == delta['library_id']:
+                    self._thresholds[row] = delta['threshold']
+        else:
+            self._upsert(
+                delta['face_id'], delta['name'], normalize_embedding(delta['embedding']),
+                delta['library_id'], delta['threshold'],
+            )
+        self.version = delta['version']
+
+    def _upsert(self, face_id, name, vector, library_id, threshold):
+        if vector is None:
+            self._remove(face_id)
+            return
+
+        if self._matrix.shape[1] != vector.shape[0]:
+            if self._size:
+                logger.warning(
+                    "Embedding size %d does not match %d, skipping %s.", vector.shape[0], self._matrix.shape[1], name,
+                )
+                return
+            self._matrix = np.empty((0, vector.shape[0]), dtype=np.float32)
+
+        row = self._rows.get(face_id)
+        if row is None:
+            if self._size == self._matrix.shape[0]:
+                capacity = max(16, self._size * 2)
+                grown = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+                self._thresholds = np.resize(self._thresholds, capacity)
+            row = self._size
+            self._size += 1
+            self._rows[face_id] = row
+            self.ids.append(face_id)
+            self.names.append(name)
+            self.library_ids.append(library_id)
+
+        self._matrix[row] = vector
+        self._thresholds[row] = threshold
+        self.names[row] = name
+        self.library_ids[row] = library_id
+        if self.index is not None:
+            self.index.set_row(row, vector)
+
+    def _remove(self, face_id):
+        row = self._rows.pop(face_id, None)
+        if row is None:
+            return
+
+        # Move the last row into the hole so the matrix stays contiguous.
+        last = self._size - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._thresholds[row] = self._thresholds[last]
+            self.ids[row] = self.ids[last]
+            self.names[row] = self.names[last]
+            self.library_ids[row] = self.library_ids[last]
+            self._rows[self.ids[row]] = row
+        self.ids.pop()
+        self.names.pop()
+        self.library_ids.pop()
+        self._size = last
+        if self.index is not None:
+            self.index.move_row(last, row)
+
+
+def read_gallery_rows(library_id=None):
+    """
+    Reads every registered face-0 embedding of the current model, or only
+    those of one library, in one query. Returns (ids, names, library_ids, thresholds, matrix), with the
+    packed vectors joined into one normalized float32 matrix.
+    """
+    # Loads also run on long-lived executor threads whose connection the
+    # server may have dropped. Only drop it when it is broken or past
+    # CONN_MAX_AGE, and never inside the caller's transaction.
+    if not connection.in_atomic_block:
+        connection.close_if_unusable_or_obsolete()
+    FaceEmbedding = apps.get_model('api', 'FaceEmbedding')
+    rows = FaceEmbedding.objects.filter(
+        model_name=current_embedding_model(), face_index=0, norm__gt=0, profile__is_registered=True,
+    )
+    if library_id is not None:
+        rows = rows.filter(profile__library_id=library_id)
+    rows = list(rows.values_list(
+        'profile_id', 'profile__name', 'profile__library_id', 'profile__library__match_threshold',
+        'dim', 'norm', 'vector',
+    ))
+
+    dim = rows[0][4] if rows else 0
+    skipped = sum(1 for row in rows if row[4] != dim)
+    rows = [row for row in rows if row[4] == dim]
+    if skipped:
+        logger.warning("Skipped %d embeddings whose size does not match %d.", skipped, dim)
+
+    matrix = unpack_matrix([row[6] for row in rows], dim)
+    matrix /= np.asarray([row[5] for row in rows], dtype=np.float32)[:, None]
+    return (
+        [str(row[0]) for row in rows],
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        [row[3] for row in rows],
+        matrix,
+    )
+
+
+def export_gallery_snapshot(force=False):
+    """
+    Writes a new shared snapshot from the database unless the current one
+    is already up to date. Returns the new snapshot's version, or None.
+    """
+    directory = settings.FACE_GALLERY_SNAPSHOT_DIR
+    if not directory:
+        return None
+
+    version = int(get_redis().get(GALLERY_VERSION_KEY) or 0)
+    current = current_snapshot_version(directory)
+    if not force and current is not None and current >= version:
+        return None
+
+    ids, names, library_ids, thresholds, matrix = read_gallery_rows()
+    write_snapshot(directory, version, current_embedding_model(), ids, names, library_ids, thresholds, matrix)
+    publish_gallery_delta(make_snapshot_delta(), f"Gallery snapshot v{version} is ready.")
+    logger.info("Gallery snapshot v%d written (%d faces).", version, len(ids), extra={'gallery_version': version})
+    return version
+
+
+class GalleryShards:
+    """
+    Per-library gallery shards for stream connections bound to libraries.
+
+    A shard is loaded when the first connection using its library acquires
+    it and evicted once no connection has used it for `idle_seconds`, so a
+    process only holds the libraries its cameras actually match against.
+    """
+
+    def __init__(self, idle_seconds=60):
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.shards = {}
+        self.users = {}
+        self.idle_since = {}
+
+    def acquire(self, library_ids):
+        """
+        Returns the loaded shards of `library_ids`, counting one more user
+        of each.
+        """
+        with self.lock:
+            self._evict_idle()
+            shards = []
+            for library_id in library_ids:
+                if library_id not in self.shards:
+                    self.shards[library_id] = FaceGallery(library_id)
+                self.users[library_id] = self.users.get(library_id, 0) + 1
+                self.idle_since.pop(library_id, None)
+                shards.append(self.shards[library_id])
+        for shard in shards:
+            shard.ensure_loaded()
+        return shards
+
+    def release(self, library_ids):
+        with self.lock:
+            now = time.monotonic()
+            for library_id in library_ids:
+                self.users[library_id] = self.users.get(library_id, 1) - 1
+                if self.users[library_id] <= 0:
+                    del self.users[library_id]
+                    self.idle_since[library_id] = now
+            self._evict_idle()
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for library_id, since in list(self.idle_since.items()):
+            if now - since >= self.idle_seconds:
+                del self.idle_since[library_id]
+                self.shards.pop(library_id, None)
+                logger.info("Evicted unused gallery shard of library %s.", library_id, extra={'library_id': library_id})
+
+    def loaded(self):
+        with self.lock:
+            self._evict_idle()
+            return [shard for shard in self.shards.values() if shard.loaded]
+
+    def stats(self):
+        with self.lock:
+            return {
+                library_id: {'faces': len(shard), 'users': self.users.get(library_id, 0)}
+                for library_id, shard in self.shards.items()
+            }
+
+
+def search_galleries(galleries, query_embeddings, top_k=1):
+    """
+    `FaceGallery.search` over several galleries: each query's candidates
+    from every gallery, best first, cut to `top_k`.
+    """
+    if len(galleries) == 1:
+        return galleries[0].search(query_embeddings, top_k=top_k)
+
+    merged = [[] for _ in range(len(query_embeddings))]
+    for gallery in galleries:
+        for candidates, found in zip(merged, gallery.search(query_embeddings, top_k=top_k)):
+            candidates.extend(found)
+    return [sorted(candidates, key=lambda c: c[1], reverse=True)[:top_k] for candidates in merged]
+
+
+def apply_gallery_delta(delta):
+    """
+    Applies a published delta to every gallery this process has loaded:
+    the all-libraries gallery and the library shards.
+    """
+    if _gallery.loaded:
+        _gallery.apply_delta(delta)
+    for shard in _shards.loaded():
+        shard.apply_delta(delta)
+
+
+_gallery = FaceGallery()
+_shards = GalleryShards(idle_seconds=settings.FACE_GALLERY_SHARD_IDLE_SECONDS)
+
+
+def get_gallery():
+    return _gallery
+
+
+def get_gallery_shards():
+    return _shards
+
+
+def make_gallery_delta(op, profile, embedding=None):
+    """
+    Builds an add/update/delete delta from a FaceProfile. Build it eagerly:
+    Django clears the primary key of deleted instances. Without `embedding`
+    the profile's stored embedding for the current model is used.
+    """
+    delta = {
+        'op': op,
+        'face_id': str(profile.face_id),
+        'name': profile.name,
+        'library_id': profile.library_id,
+        'threshold': None,
+        'embedding': None,
+    }
+    if op != 'delete':
+        delta['threshold'] = profile.library.match_threshold
+        if embedding is None:
+            stored = profile.embeddings.filter(
+                model_name=current_embedding_model(), face_index=0
+            ).values_list('vector', 'dim').first()
+            embedding = unpack_embedding(*stored) if stored else None
+        vector = normalize_embedding(embedding)
+        delta['embedding'] = vector.tolist() if vector is not None else None
+    return delta
+
+
+def make_reload_delta(model_tier=None):
+    """
+    Coalesced delta for bulk changes: receivers reload the gallery once
+    instead of applying one delta per profile. With `model_tier` they switch
+    to that tier's model and embeddings first.
+    """
+    delta = {'op': 'reload'}
+    if model_tier:
+        delta['model_tier'] = model_tier
+    return delta
+
+
+def make_snapshot_delta():
+    """
+    Announces a new shared snapshot so running workers can re-map it.
+    """
+    return {'op': 'snapshot'}
+
+
+def make_library_delta(library):
+    return {
+        'op': 'library',
+        'library_id': library.pk,
+        'threshold': library.match_threshold,
+    }
+
+
+def publish_gallery_delta(delta, message):
+    """
+    Records a delta in the journal under the next gallery version and
+    broadcasts it to every connected stream consumer.
+    """
+    client = get_redis()
+    encoded = client.eval(
+        _PUBLISH_SCRIPT, 2, GALLERY_VERSION_KEY, GALLERY_JOURNAL_KEY,
+        json.dumps(delta), settings.FACE_GALLERY_JOURNAL_SIZE,
+    )
+    delta = json.loads(encoded)
+
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        GALLERY_GROUP,
+        {
+            "type": "reload_ai_library",
+            "message": message,
+            "delta": delta,
+        }
+    )
+    return delta
@@ -0,0 +1,99 @@
+"""
+Versioned on-disk snapshots of the gallery, shared by every worker process.
+
+A snapshot is a directory holding the normalized float32 matrix as a .npy
+file (with spare rows, so deltas can append without copying it), the
+per-row thresholds and a JSON file with the ids, names and library ids.
+`current.json` names the live snapshot; writers replace it atomically, so
+readers always see a complete snapshot.
+
+Workers map the matrix copy-on-write: the pages are shared through the
+page cache, and only the rows a worker patches with deltas are copied.
+"""
+import json
+import logging
+import os
+import shutil
+import uuid
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = 'current.json'
+KEEP_SNAPSHOTS = 2
+
+
+def write_snapshot(directory, version, model_name, ids, names, library_ids, thresholds, matrix, spare_rows=1024):
+    os.makedirs(directory, exist_ok=True)
+    name = f"v{version}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+
+    size, dim = matrix.shape
+    capacity = size + max(spare_rows, size // 10)
+    stored = np.lib.format.open_memmap(
+        os.path.join(path, 'matrix.npy'), mode='w+', dtype=np.float32, shape=(capacity, dim)
+    )
+    stored[:size] = matrix
+    stored[size:] = 0
+    stored.flush()
+    del stored
+    np.save(os.path.join(path, 'thresholds.npy'), np.asarray(thresholds, dtype=np.float32))
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'ids': ids, 'names': names, 'library_ids': library_ids}, f)
+
+    pointer = {'version': version, 'model_name': model_name, 'path': name, 'size': size, 'dim': dim}
+    tmp_path = os.path.join(directory, f'{CURRENT_FILE}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(pointer, f)
+    os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+
+    _remove_old_snapshots(directory, keep=name)
+    return pointer
+
+
+def read_snapshot(directory, model_name):
+    """
+    Opens the live snapshot, or returns None if there is none for this
+    model. The matrix is memory-mapped copy-on-write.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            pointer = json.load(f)
+        if pointer['model_name'] != model_name:
+            return None
+
+        path = os.path.join(directory, pointer['path'])
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return {
+            **pointer,
+            **meta,
+            'matrix': np.load(os.path.join(path, 'matrix.npy'), mmap_mode='c'),
+            'thresholds': np.load(os.path.join(path, 'thresholds.npy')),
+        }
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("Cannot read gallery snapshot in %s: %s", directory, e)
+        return None
+
+
+def current_snapshot_version(directory):
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return json.load(f)['version']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _remove_old_snapshots(directory, keep):
+    # Keep the previous snapshot too: workers still starting from it are
+    # safe either way (an unlinked mapped file stays readable), but a
+    # half-read meta.json is not.
+    snapshots = sorted(
+        (entry for entry in os.scandir(directory) if entry.is_dir() and entry.name.startswith('v')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in snapshots[KEEP_SNAPSHOTS:]:
+        if entry.name != keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,239 @@
+from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import logging
+import time
+import numpy as np
+
+from .ai_utils import embed_face_batch
+from .gallery import search_galleries
+from .metrics import FACES_PER_FRAME, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class InferenceService:
+    """
+    Process-wide inference queue shared by every stream connection.
+
+    Frames from all cameras are collected into micro-batches of up to
+    `max_batch` frames, waiting at most `max_wait_ms` for a batch to fill.
+    Each batch runs detection per frame, then one recognition-model run over
+    the faces of every frame in the batch and one gallery search per set of
+    bound libraries, on a dedicated pool of `workers` threads. Frames are
+    tracked once; when the shared embedding and search run fails, it is run
+    again frame by frame, so a bad frame fails only its own.
+    """
+
+    def __init__(self, max_batch=8, max_wait_ms=10, workers=1, history=200):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.batches = deque(maxlen=history)
+        self._loop = None
+        self._queue = None
+        self._slots = None
+
+    async def submit(self, pipeline, frame_rgb):
+        """
+        Queues one frame for the connection's pipeline and returns its
+        detections once its batch has run.
+        """
+        self._bind_loop()
+        future = self._loop.create_future()
+        await self._queue.put((pipeline, frame_rgb, future, time.perf_counter()))
+        return await future
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        loop.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._slots.acquire()
+            self._loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            results = await self._loop.run_in_executor(self.executor, self.process_each, batch)
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self._slots.release()
+
+        for (*_, future, _), detections in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(detections, Exception):
+                future.set_exception(detections)
+            else:
+                future.set_result(detections)
+
+    def process_batch(self, batch):
+        """
+        Runs a batch and returns the detections of every frame; raises the
+        error of the first frame that failed.
+        """
+        results = self.process_each(batch)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def process_each(self, batch):
+        """
+        Runs a batch and returns, for every frame, its detections or the
+        exception it failed with. Every frame is tracked once; if the shared
+        embedding and search run fails, it is run again frame by frame, so a
+        bad frame fails only its own.
+        """
+        started = time.perf_counter()
+        queue_ms = max((started - queued_at) * 1000 for *_, queued_at in batch)
+
+        results = [None] * len(batch)
+        tracked = {}
+        for i, (pipeline, frame_rgb, _, queued_at) in enumerate(batch):
+            STAGE_SECONDS.labels('queue').observe(started - queued_at)
+            frame_started = time.perf_counter()
+            try:
+                tracked[i] = pipeline.track(frame_rgb)
+            except Exception as e:
+                results[i] = e
+                continue
+            STAGE_SECONDS.labels('detect').observe(time.perf_counter() - frame_started)
+            FACES_PER_FRAME.observe(len(tracked[i][0]))
+        detected = time.perf_counter()
+
+        try:
+            runs = [self.recognize(batch, tracked)]
+        except Exception as e:
+            runs = []
+            if len(tracked) == 1:
+                (i,) = tracked
+                results[i] = e
+                del tracked[i]
+            else:
+                logger.warning("Inference batch of %d frames failed; retrying frame by frame.", len(tracked), exc_info=True)
+                for i in list(tracked):
+                    try:
+                        runs.append(self.recognize(batch, {i: tracked[i]}))
+                    except Exception as frame_error:
+                        results[i] = frame_error
+                        del tracked[i]
+        embedded = sum(count for count, _ in runs)
+        embed_seconds = sum(seconds for _, seconds in runs)
+        matched = time.perf_counter()
+
+        self.batches.append({
+            'frames': len(batch),
+            'faces': sum(len(tracks) for tracks, _ in tracked.values()),
+            'embedded': embedded,
+            'queue_ms': queue_ms,
+            'detect_ms': (detected - started) * 1000,
+            'embed_ms': embed_seconds * 1000,
+            'match_ms': (matched - detected - embed_seconds) * 1000,
+            'total_ms': (matched - started) * 1000,
+        })
+        for i, (tracks, _) in tracked.items():
+            results[i] = [batch[i][0].describe(track) for track in tracks]
+        return results
+
+    def recognize(self, batch, tracked):
+        """
+        Embeds the stale tracks of the tracked frames (index into `batch` to
+        the result of `pipeline.track`) in one model run and matches them
+        with one search per set of galleries. Returns the number of faces
+        embedded and the seconds the embedding took.
+        """
+        started = time.perf_counter()
+        items = [
+            (batch[i][1], track.face)
+            for i, (_, stale) in tracked.items()
+            for track in stale
+        ]
+        embed_face_batch(items)
+        embedded = time.perf_counter()
+        if items:
+            STAGE_SECONDS.labels('embed').observe(embedded - started)
+
+        # One search per set of galleries: frames of cameras bound to the
+        # same libraries share it, and are never scored against others.
+        # Faces without landmarks were not embedded; they are matched again
+        # on a later frame.
+        groups = {}
+        for i, (_, stale) in tracked.items():
+            stale = [track for track in stale if track.face.embedding is not None]
+            if stale:
+                pipeline = batch[i][0]
+                groups.setdefault(tuple(map(id, pipeline.galleries)), []).append((pipeline, stale))
+        for entries in groups.values():
+            matches = search_galleries(
+                entries[0][0].galleries,
+                np.stack([track.face.embedding for _, stale in entries for track in stale]),
+                top_k=settings.FACE_MATCH_TOP_K,
+            )
+            offset = 0
+            for pipeline, stale in entries:
+                pipeline.apply_matches(stale, matches[offset:offset + len(stale)])
+                offset += len(stale)
+        if items:
+            STAGE_SECONDS.labels('match').observe(time.perf_counter() - embedded)
+        return len(items), embedded - started
+
+    def stats(self):
+        """
+        Aggregates the recent batches: mean and p95 of every timing, plus
+        batch size and frames per second of busy time.
+        """
+        batches = list(self.batches)
+        summary = {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'workers': self.workers,
+            'batches': len(batches),
+        }
+        if not batches:
+            return summary
+
+        for key in ('frames', 'faces', 'embedded'):
+            summary[f'mean_{key}'] = round(float(np.mean([b[key] for b in batches])), 2)
+        for key in ('queue_ms', 'detect_ms', 'embed_ms', 'match_ms', 'total_ms'):
+            values = [b[key] for b in batches]
+            summary[key] = {
+                'mean': round(float(np.mean(values)), 2),
+                'p95': round(float(np.percentile(values, 95)), 2),
+            }
+        busy_seconds = sum(b['total_ms'] for b in batches) / 1000
+        summary['frames_per_busy_second'] = round(sum(b['frames'] for b in batches) / busy_seconds, 1) if busy_seconds else None
+        return summary
+
+
+_service = None
+
+
+def get_inference_service():
+    global _service
+    if _service is None:
+        _service = InferenceService(
+            max_batch=settings.FACE_INFERENCE_MAX_BATCH,
+            max_wait_ms=settings.FACE_INFERENCE_MAX_WAIT_MS,
+            workers=settings.FACE_INFERENCE_WORKERS,
+        )
+    return _service
@@ -0,0 +1,365 @@
+"""
+Headless ingestion of RTSP streams and video files (manage.py
+ingest_cameras).
+
+Each camera is read by its own thread with OpenCV. Only sampled frames are
+decoded into images, once, and only the newest one is kept: a camera whose
+frames arrive faster than the worker recognizes them skips ahead instead of
+building a backlog. The worker runs the sampled frames of every camera
+through the shared inference service in one batch, keeps the presence
+sessions and access logs like a stream connection does, and publishes
+each result to its camera's channel group, which only the viewers that
+asked for that camera (?watch=) join. Frames never pass through a browser.
+"""
+from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import cv2
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from .access_logs import get_access_log_buffer
+from .ai_utils import get_app
+from .gallery import GALLERY_GROUP, apply_gallery_delta, get_gallery, get_gallery_shards
+from .inference import get_inference_service
+from .metrics import STREAM_FRAMES, timed
+from .pipeline import FramePipeline, annotate_frame
+from .presence import PresenceTracker
+
+# RTSP over TCP: UDP loses packets on busy networks and smears the frames.
+os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'rtsp_transport;tcp')
+
+logger = logging.getLogger(__name__)
+
+# Viewers of ?watch=all join this group; every result is sent to it as well
+# as to its camera's group.
+ALL_CAMERAS_GROUP = 'ingest_cameras'
+
+
+def camera_group(camera_id):
+    """
+    The channel group of one ingested camera. Group names only allow ASCII
+    letters, digits, hyphens, underscores and periods.
+    """
+    return 'camera_' + re.sub(r'[^A-Za-z0-9_.-]', '_', camera_id)[:80]
+
+
+class CameraSource:
+    """
+    Reads one RTSP stream or video file on a background thread and keeps
+    the newest sampled frame.
+
+    Frames are grabbed as fast as the source delivers them but only
+    `fps` per second are decoded. Live streams are sampled by wall clock
+    and reopened after `reconnect_seconds` when they fail; files are
+    sampled by their own timestamps, played at their native speed when
+    `realtime` is set, and end (or start over with `loop`) at their last
+    frame.
+    """
+
+    def __init__(self, camera_id, source, fps, realtime=True, loop=False, reconnect_seconds=5.0):
+        self.camera_id = camera_id
+        self.source = source
+        self.is_file = os.path.isfile(source)
+        self.interval = 1 / fps
+        self.realtime = realtime
+        self.loop = loop
+        self.reconnect_seconds = reconnect_seconds
+        self.finished = threading.Event()
+        self.stats = {'grabbed': 0, 'sampled': 0, 'skipped': 0, 'reconnects': 0}
+        self._frame = None
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'ingest-{camera_id}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=self.reconnect_seconds + 1)
+
+    def latest(self):
+        """
+        Takes the newest sampled frame as (seq, BGR image, RGB image,
+        perf_counter time it was decoded), or None when there is no new one.
+        """
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+    def _run(self):
+        while not self._stop.is_set():
+            capture = self._open()
+            if capture is None:
+                self._stop.wait(self.reconnect_seconds)
+                continue
+            try:
+                ended = self._read(capture)
+            except Exception:
+                logger.exception("Reading the camera failed.", extra={'camera_id': self.camera_id})
+                ended = False
+            finally:
+                capture.release()
+
+            if self.is_file and ended and not self.loop:
+                break
+            if not self.is_file and not self._stop.is_set():
+                self.stats['reconnects'] += 1
+                logger.warning(
+                    "Camera stream ended, reconnecting in %.0f s.", self.reconnect_seconds,
+                    extra={'camera_id': self.camera_id},
+                )
+                self._stop.wait(self.reconnect_seconds)
+        self.finished.set()
+
+    def _open(self):
+        capture = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG)
+        if not capture.isOpened():
+            logger.warning("Could not open the camera source.", extra={'camera_id': self.camera_id})
+            capture.release()
+            return None
+        # Keep FFmpeg's own queue short so "newest" really is recent.
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        logger.info("Camera source opened.", extra={'camera_id': self.camera_id, 'file': self.is_file})
+        return capture
+
+    def _read(self, capture):
+        """
+        Grabs frames until the source ends or the worker stops. Returns True
+        when the source ran out of frames.
+        """
+        native_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        started = time.monotonic()
+        next_sample = 0.0
+        index = 0
+        while not self._stop.is_set():
+            if self.is_file:
+                # A file's position is its own timeline, not the wall clock.
+                position = index / native_fps
+                if self.realtime:
+                    delay = started + position - time.monotonic()
+                    if delay > 0:
+                        self._stop.wait(delay)
+            else:
+                position = time.monotonic() - started
+
+            if not capture.grab():
+                return True
+            index += 1
+            self.stats['grabbed'] += 1
+            if position < next_sample:
+                continue
+            # Behind schedule (a slow source) restarts the schedule rather
+            # than sampling a burst of frames to catch up.
+            next_sample = max(next_sample + self.interval, position)
+
+            ok, image = capture.retrieve()
+            if not ok:
+                continue
+            frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            with self._lock:
+                if self._frame is not None:
+                    self.stats['skipped'] += 1
+                    STREAM_FRAMES.labels('dropped').inc()
+                self._seq += 1
+                self._frame = (self._seq, image, frame_rgb, time.perf_counter())
+            self.stats['sampled'] += 1
+            STREAM_FRAMES.labels('received').inc()
+
+            if self.is_file and not self.realtime:
+                # As fast as possible, but never decode frames the worker
+                # would only skip.
+                while self._frame is not None and not self._stop.is_set():
+                    time.sleep(0.002)
+        return False
+
+
+class IngestCamera:
+    """
+    One ingested camera: its source, pipeline and presence tracker.
+    `library_ids` binds it to those libraries' gallery shards.
+    """
+
+    def __init__(self, camera_id, source, fps, library_ids=None, realtime=True, loop=False):
+        self.camera_id = camera_id
+        self.library_ids = sorted(library_ids) if library_ids else None
+        self.source = CameraSource(camera_id, source, fps, realtime=realtime, loop=loop)
+        self.pipeline = None
+        self.presence = PresenceTracker(
+            camera_id=camera_id,
+            absence_seconds=settings.FACE_PRESENCE_ABSENCE_SECONDS,
+            min_frames=settings.FACE_PRESENCE_MIN_FRAMES,
+            stranger_similarity=settings.FACE_PRESENCE_STRANGER_SIMILARITY,
+        )
+
+
+class IngestWorker:
+    """
+    Runs a set of IngestCameras until they end or the worker is stopped.
+
+    Sampled frames go through the shared inference service, so cameras with
+    a new frame are detected, embedded and matched together in one batch.
+    The worker joins the stream group itself to receive gallery deltas, like
+    a stream connection would. With `publish_jpeg` every result carries the
+    annotated frame, scaled down to `jpeg_width` pixels wide.
+    """
+
+    def __init__(self, cameras, publish_jpeg=True, jpeg_width=640, jpeg_quality=80, poll_seconds=0.005):
+        self.cameras = cameras
+        self.publish_jpeg = publish_jpeg
+        self.jpeg_width = jpeg_width
+        self.jpeg_quality = jpeg_quality
+        self.poll_seconds = poll_seconds
+        self.channel_layer = get_channel_layer()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest')
+        self.stats = {'batches': 0, 'processed': 0, 'errors': 0}
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.prepare)
+        listener = asyncio.create_task(self.follow_gallery())
+        for camera in self.cameras:
+            camera.source.start()
+        try:
+            while not self._stop.is_set():
+                if all(camera.source.finished.is_set() for camera in self.cameras):
+                    break
+                frames = [(camera, frame) for camera in self.cameras if (frame := camera.source.latest())]
+                if not frames:
+                    await asyncio.sleep(self.poll_seconds)
+                    continue
+                try:
+                    results = await loop.run_in_executor(self.executor, self.process, frames)
+                except Exception:
+                    logger.exception("Ingest batch failed.", extra={'cameras': [camera.camera_id for camera, _ in frames]})
+                    self.stats['errors'] += len(frames)
+                    STREAM_FRAMES.labels('error').inc(len(frames))
+                    continue
+                for camera, seq, metadata, jpeg in results:
+                    await self.publish(camera, seq, metadata, jpeg)
+        finally:
+            listener.cancel()
+            for camera in self.cameras:
+                camera.source.stop()
+            await loop.run_in_executor(self.executor, self.shutdown)
+        logger.info("Ingest finished.", extra={
+            'stats': self.stats, 'cameras': {camera.camera_id: camera.source.stats for camera in self.cameras},
+        })
+
+    def prepare(self):
+        """
+        Loads the model and every gallery the cameras match against before
+        the first frame arrives.
+        """
+        get_app()
+        for camera in self.cameras:
+            if camera.library_ids:
+                galleries = get_gallery_shards().acquire(camera.library_ids)
+            else:
+                get_gallery().ensure_loaded()
+                galleries = None
+            camera.pipeline = FramePipeline(camera.camera_id, galleries)
+
+    def process(self, frames):
+        service = get_inference_service()
+        batch = [(camera.pipeline, frame_rgb, None, decoded_at) for camera, (_, _, frame_rgb, decoded_at) in frames]
+        detections = []
+        for start in range(0, len(batch), service.max_batch):
+            detections.extend(service.process_each(batch[start:start + service.max_batch]))
+        self.stats['batches'] += 1
+
+        results = []
+        for (camera, (seq, image, _, _)), frame_detections in zip(frames, detections):
+            if isinstance(frame_detections, Exception):
+                logger.error("Ingest frame failed: %s", frame_detections, exc_info=frame_detections,
+                             extra={'camera_id': camera.camera_id, 'seq': seq})
+                self.stats['errors'] += 1
+                STREAM_FRAMES.labels('error').inc()
+                continue
+            self.log_visits(camera.presence.observe(image, frame_detections, camera.pipeline.track_embeddings()))
+            results.append((camera, seq, {
+                'status': 'processed',
+                'mode': 'annotated' if self.publish_jpeg else 'metadata',
+                'source': 'ingest',
+                'detections': frame_detections,
+                'width': image.shape[1],
+                'height': image.shape[0],
+            }, self.render(image, frame_detections)))
+            self.stats['processed'] += 1
+            STREAM_FRAMES.labels('processed').inc()
+        return results
+
+    def render(self, image, detections):
+        if not self.publish_jpeg:
+            return b''
+        with timed('draw'):
+            annotate_frame(image, detections)
+        with timed('jpeg_encode'):
+            height, width = image.shape[:2]
+            if width > self.jpeg_width:
+                image = cv2.resize(image, (self.jpeg_width, round(height * self.jpeg_width / width)),
+                                   interpolation=cv2.INTER_AREA)
+            _, buffer = cv2.imencode('.jpeg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return buffer.tobytes()
+
+    async def publish(self, camera, seq, metadata, jpeg):
+        with timed('send'):
+            message = {
+                'type': 'camera_result',
+                'camera_id': camera.camera_id,
+                'library_ids': camera.library_ids,
+                'seq': seq,
+                'metadata': metadata,
+                'jpeg': jpeg,
+            }
+            await self.channel_layer.group_send(camera_group(camera.camera_id), message)
+            await self.channel_layer.group_send(ALL_CAMERAS_GROUP, message)
+
+    async def follow_gallery(self):
+        """
+        Applies the gallery deltas broadcast to the stream group. Group
+        membership expires in the channel layer, so it is renewed hourly.
+        """
+        channel = await self.channel_layer.new_channel()
+        joined = 0.0
+        while True:
+            if time.monotonic() - joined > 3600:
+                await self.channel_layer.group_add(GALLERY_GROUP, channel)
+                joined = time.monotonic()
+            try:
+                message = await asyncio.wait_for(self.channel_layer.receive(channel), 60)
+            except asyncio.TimeoutError:
+                continue
+            except asyncio.CancelledError:
+                await self.channel_layer.group_discard(GALLERY_GROUP, channel)
+                raise
+            if message.get('type') == 'reload_ai_library':
+                try:
+                    await sync_to_async(apply_gallery_delta, thread_sensitive=False)(message['delta'])
+                except Exception:
+                    logger.exception("Applying a gallery delta failed.")
+
+    def shutdown(self):
+        for camera in self.cameras:
+            self.log_visits(camera.presence.close_all())
+            if camera.library_ids:
+                get_gallery_shards().release(camera.library_ids)
+        get_access_log_buffer().flush()
+
+    def log_visits(self, sessions):
+        access_logs = get_access_log_buffer()
+        for session in sessions:
+            access_logs.add(session.to_log_entry())
+
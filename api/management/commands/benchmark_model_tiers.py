@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import time
+import numpy as np
+import cv2
+
+from api.ai_utils import detect_faces, embed_face_batch, load_face_app, normalize_rows
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the model tiers on a local image set laid out as <dir>/<person>/<image>: "
+        "detection and embedding time per image, and leave-one-out rank-1 identification accuracy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', help="Directory with one sub-directory of images per person.")
+        parser.add_argument('--tiers', nargs='+', default=list(settings.FACE_MODEL_TIERS), help="Tiers to compare.")
+        parser.add_argument('--warmup', type=int, default=3, help="Images run before timing starts.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        samples = self.load_samples(options['images'])
+        unknown = set(options['tiers']) - set(settings.FACE_MODEL_TIERS)
+        if unknown:
+            raise CommandError(f"Unknown tiers: {', '.join(sorted(unknown))}")
+
+        results = [self.run_tier(tier, samples, options['warmup']) for tier in options['tiers']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{len(samples)} images of {len({label for label, _ in samples})} people")
+        self.stdout.write(f"{'tier':<12}{'model':<18}{'found':>7}{'det ms':>9}{'emb ms':>9}{'img/s':>8}{'rank-1':>8}")
+        for r in results:
+            self.stdout.write(
+                f"{r['tier']:<12}{r['model']:<18}{r['found']:>7.1%}{r['detect_ms']:>9.1f}"
+                f"{r['embed_ms']:>9.1f}{r['images_per_second']:>8.1f}{r['rank1_accuracy']:>8.1%}"
+            )
+
+    def load_samples(self, directory):
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory.")
+
+        samples = []
+        for person in sorted(os.listdir(directory)):
+            person_dir = os.path.join(directory, person)
+            if not os.path.isdir(person_dir):
+                continue
+            for name in sorted(os.listdir(person_dir)):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                image = cv2.imread(os.path.join(person_dir, name))
+                if image is not None:
+                    samples.append((person, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+        if not samples:
+            raise CommandError(f"No images found under {directory}.")
+        return samples
+
+    def run_tier(self, tier, samples, warmup):
+        started = time.perf_counter()
+        app = load_face_app(tier)
+        load_seconds = time.perf_counter() - started
+
+        for _, image in samples[:warmup]:
+            embed_face_batch([(image, face) for face in detect_faces(image, max_num=1, app=app)], app=app)
+
+        labels, embeddings = [], []
+        detect_time = embed_time = 0.0
+        for label, image in samples:
+            started = time.perf_counter()
+            faces = detect_faces(image, max_num=1, app=app)
+            detected = time.perf_counter()
+            if faces:
+                embed_face_batch([(image, faces[0])], app=app)
+                labels.append(label)
+                embeddings.append(faces[0].embedding)
+            embed_time += time.perf_counter() - detected
+            detect_time += detected - started
+
+        return {
+            'tier': tier,
+            'model': settings.FACE_MODEL_TIERS[tier]['EMBEDDING_MODEL'],
+            'load_seconds': round(load_seconds, 2),
+            'found': len(labels) / len(samples),
+            'detect_ms': detect_time * 1000 / len(samples),
+            'embed_ms': embed_time * 1000 / max(len(labels), 1),
+            'images_per_second': len(samples) / (detect_time + embed_time),
+            'rank1_accuracy': self.rank1_accuracy(labels, embeddings),
+        }
+
+    def rank1_accuracy(self, labels, embeddings):
+        """
+        Leave-one-out identification: each image whose person has at least
+        one other image is matched against all the others.
+        """
+        if len(embeddings) < 2:
+            return 0.0
+
+        matrix = normalize_rows(np.stack(embeddings))
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, -np.inf)
+        labels = np.asarray(labels)
+        counts = {label: int((labels == label).sum()) for label in set(labels)}
+        probes = [i for i, label in enumerate(labels) if counts[label] > 1]
+        if not probes:
+            return 0.0
+        best = scores[probes].argmax(axis=1)
+        return float(np.mean(labels[best] == labels[probes]))
@@ -0,0 +1,284 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import cv2
+
+from api.ai_utils import install_app, load_face_app, normalize_rows
+from api.gallery import FaceGallery, get_gallery
+from api.inference import InferenceService
+from api.pipeline import FramePipeline, annotate_frame
+from api.stub_model import StubFaceApp
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def synthetic_gallery(size, dim, rng, chunk_size=65536):
+    """
+    Unit-length, clustered embeddings (real face embeddings are far from
+    uniformly spread over the sphere), generated in chunks so a 1M-row
+    gallery needs no temporaries of its size.
+    """
+    centers = rng.normal(size=(max(1, size // 100), dim)).astype(np.float32)
+    matrix = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, chunk_size):
+        end = min(size, start + chunk_size)
+        labels = rng.integers(0, len(centers), end - start)
+        noise = rng.normal(scale=0.6, size=(end - start, dim)).astype(np.float32)
+        matrix[start:end] = normalize_rows(centers[labels] + noise)
+    return matrix
+
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms)
+    return {
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "CPU-only benchmark of the gallery matcher on synthetic galleries of several sizes and of the "
+        "whole frame path on local images or a video, with a weight-free stub model by default. "
+        "Prints the results as JSON; --compare shows the change against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                            help="Synthetic gallery sizes for the matcher benchmark.")
+        parser.add_argument('--dim', type=int, default=512)
+        parser.add_argument('--queries', type=int, default=200, help="Queries per gallery size.")
+        parser.add_argument('--query-batch', type=int, default=8, help="Faces per search in the batched run.")
+        parser.add_argument('--top-k', type=int, default=settings.FACE_MATCH_TOP_K)
+        parser.add_argument('--skip-matcher', action='store_true')
+        parser.add_argument('--media', help="Directory of images or a video file for the frame-path benchmark.")
+        parser.add_argument('--frames', type=int, default=300, help="Frames to run through the frame path.")
+        parser.add_argument('--warmup', type=int, default=10, help="Frames run before timing starts.")
+        parser.add_argument('--cameras', type=int, default=1, help="Simulated cameras batched together.")
+        parser.add_argument('--gallery-size', type=int, default=10000, help="Gallery size for the frame path.")
+        parser.add_argument('--model', default='stub', choices=['stub', *settings.FACE_MODEL_TIERS],
+                            help="'stub' needs no weights; a tier name loads that tier's real model.")
+        parser.add_argument('--stub-faces', type=int, default=2, help="Faces the stub detector finds per frame.")
+        parser.add_argument('--output', help="Also write the JSON results to this file.")
+        parser.add_argument('--compare', help="JSON results of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        if options['skip_matcher'] and not options['media']:
+            raise CommandError("Nothing to run: pass --media or drop --skip-matcher.")
+
+        results = {'meta': self.meta(options)}
+        # The synthetic galleries get indexes that are never saved, so the
+        # saved index of the real gallery is left alone.
+        unsaved = {key: value for key, value in settings.FACE_SEARCH_INDEX.items() if key != 'PATH'}
+        with override_settings(FACE_SEARCH_INDEX=unsaved):
+            if not options['skip_matcher']:
+                results['matcher'] = [self.bench_matcher(size, options) for size in options['sizes']]
+            if options['media']:
+                results['pipeline'] = self.bench_pipeline(options)
+
+        text = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text)
+        self.stdout.write(text)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), results)
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=settings.BASE_DIR,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+            'machine': platform.machine(),
+            'model': options['model'],
+            'search_index': settings.FACE_SEARCH_INDEX['BACKEND'],
+            'top_k': options['top_k'],
+        }
+
+    def bench_matcher(self, size, options):
+        """
+        Times FaceGallery.search, the call the inference service makes, one
+        face at a time and in batches of --query-batch faces.
+        """
+        rng = np.random.default_rng(0)
+        matrix = synthetic_gallery(size, options['dim'], rng)
+        ids = [str(i) for i in range(size)]
+
+        gallery = FaceGallery()
+        started = time.perf_counter()
+        gallery.load_rows(ids, ids, [1] * size, np.full(size, 0.3, dtype=np.float32), matrix)
+        build_seconds = time.perf_counter() - started
+
+        # Queries are noisy copies of gallery rows, like a new photo of an
+        # enrolled person.
+        picks = rng.choice(size, min(options['queries'], size), replace=False)
+        queries = normalize_rows(matrix[picks] + rng.normal(scale=0.03, size=(len(picks), options['dim'])).astype(np.float32))
+        top_k = options['top_k']
+
+        single_ms, hits = [], 0
+        for pick, query in zip(picks, queries):
+            started = time.perf_counter()
+            found = gallery.search(query[None, :], top_k=top_k)[0]
+            single_ms.append((time.perf_counter() - started) * 1000)
+            hits += bool(found) and found[0][0]['face_id'] == str(pick)
+
+        batch = options['query_batch']
+        started = time.perf_counter()
+        for start in range(0, len(queries), batch):
+            gallery.search(queries[start:start + batch], top_k=top_k)
+        batched_seconds = time.perf_counter() - started
+
+        result = {
+            'size': size,
+            'dim': options['dim'],
+            'matrix_mb': round(matrix.nbytes / 2**20, 1),
+            'build_seconds': round(build_seconds, 3),
+            'single_ms': percentiles(single_ms),
+            'batched_queries_per_second': round(len(queries) / batched_seconds, 1),
+            'rank1': round(hits / len(picks), 4),
+        }
+        self.stderr.write(
+            f"matcher {size:>8}: {result['single_ms']['p50']:.3f} ms/query p50, "
+            f"{result['batched_queries_per_second']:.0f} q/s batched, rank-1 {result['rank1']:.3f}"
+        )
+        del gallery, matrix
+        gc.collect()
+        return result
+
+    def load_frames(self, media, count):
+        frames = []
+        if os.path.isdir(media):
+            for name in sorted(os.listdir(media)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    image = cv2.imread(os.path.join(media, name))
+                    if image is not None:
+                        frames.append(image)
+                if len(frames) >= count:
+                    break
+        else:
+            capture = cv2.VideoCapture(media)
+            while len(frames) < count:
+                ok, image = capture.read()
+                if not ok:
+                    break
+                frames.append(image)
+            capture.release()
+        if not frames:
+            raise CommandError(f"No images or video frames found in {media}.")
+        # Encode once up front, as the browser does before sending.
+        return [cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes() for image in frames]
+
+    def bench_pipeline(self, options):
+        """
+        Runs frames through the consumer's path: JPEG decode, the inference
+        service's batch (motion gate, detection, tracking, embedding,
+        matching), drawing and JPEG encode. Without --model the stub model
+        stands in for InsightFace.
+        """
+        if options['model'] == 'stub':
+            app = StubFaceApp(faces=options['stub_faces'], dim=options['dim'])
+            install_app(app)
+        else:
+            app = load_face_app(options['model'])
+            install_app(app, options['model'])
+
+        rng = np.random.default_rng(1)
+        size = options['gallery_size']
+        ids = [str(i) for i in range(size)]
+        get_gallery().load_rows(
+            ids, ids, [1] * size, np.full(size, 0.3, dtype=np.float32), synthetic_gallery(size, options['dim'], rng),
+        )
+
+        jpegs = self.load_frames(options['media'], options['frames'])
+        cameras = options['cameras']
+        pipelines = [FramePipeline(f'bench-{i}') for i in range(cameras)]
+        service = InferenceService(max_batch=cameras, history=options['frames'] + options['warmup'])
+
+        total = options['warmup'] + options['frames']
+        decode_ms, render_ms = [], []
+        started = None
+        for start in range(0, total, cameras):
+            if started is None and start >= options['warmup']:
+                started = time.perf_counter()
+                service.batches.clear()
+                decode_ms.clear()
+                render_ms.clear()
+
+            batch, images = [], []
+            for i, pipeline in enumerate(pipelines):
+                jpeg = jpegs[(start + i) % len(jpegs)]
+                decode_started = time.perf_counter()
+                image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                decode_ms.append((time.perf_counter() - decode_started) * 1000)
+                images.append(image)
+                batch.append((pipeline, frame_rgb, None, time.perf_counter()))
+
+            for image, detections in zip(images, service.process_batch(batch)):
+                render_started = time.perf_counter()
+                annotate_frame(image, detections)
+                cv2.imencode('.jpeg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                render_ms.append((time.perf_counter() - render_started) * 1000)
+        elapsed = time.perf_counter() - (started or time.perf_counter())
+
+        frames = len(decode_ms)
+        stats = service.stats()
+        result = {
+            'media': options['media'],
+            'distinct_frames': len(jpegs),
+            'frames': frames,
+            'cameras': cameras,
+            'gallery_size': size,
+            'seconds': round(elapsed, 3),
+            'frames_per_second': round(frames / elapsed, 1) if elapsed else None,
+            'decode_ms': percentiles(decode_ms),
+            'render_ms': percentiles(render_ms),
+            'mean_faces': stats.get('mean_faces'),
+            'mean_embedded': stats.get('mean_embedded'),
+            **{key: stats[key] for key in ('detect_ms', 'embed_ms', 'match_ms', 'total_ms') if key in stats},
+        }
+        self.stderr.write(f"pipeline: {result['frames_per_second']} frames/s over {frames} frames")
+        return result
+
+    def compare(self, baseline, results):
+        """
+        Prints the relative change of every headline number, matched by
+        gallery size for the matcher.
+        """
+        self.stdout.write("\nChange against the baseline (positive is better):")
+        previous = {row['size']: row for row in baseline.get('matcher', [])}
+        for row in results.get('matcher', []):
+            old = previous.get(row['size'])
+            if old:
+                self.stdout.write(
+                    f"  matcher {row['size']:>8}: p50 {self.change(old['single_ms']['p50'], row['single_ms']['p50'], lower_is_better=True)}, "
+                    f"batched {self.change(old['batched_queries_per_second'], row['batched_queries_per_second'])}"
+                )
+        if 'pipeline' in results and 'pipeline' in baseline:
+            self.stdout.write(
+                f"  pipeline: {self.change(baseline['pipeline']['frames_per_second'], results['pipeline']['frames_per_second'])} frames/s"
+            )
+
+    @staticmethod
+    def change(old, new, lower_is_better=False):
+        if not old or new is None:
+            return 'n/a'
+        ratio = (old / new - 1) if lower_is_better else (new / old - 1)
+        return f"{ratio:+.1%}"
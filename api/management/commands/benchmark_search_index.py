@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+import time
+import numpy as np
+
+from api.ai_utils import normalize_rows, match_embeddings
+from api.search_index import IVFFlatIndex
+
+
+class Command(BaseCommand):
+    help = "Measures recall@k and per-query latency of the IVF index against the exact matcher."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100000, help="Synthetic gallery size.")
+        parser.add_argument('--dim', type=int, default=512)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--top-k', type=int, default=1)
+        parser.add_argument('--nlist', type=int, default=1024)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+        parser.add_argument('--from-db', action='store_true', help="Use registered profiles instead of synthetic data.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        matrix = self.load_gallery(options, rng)
+        size, dim = matrix.shape
+        ids = [str(i) for i in range(size)]
+
+        # Queries are noisy copies of gallery rows, like a new photo of an
+        # enrolled person.
+        picks = rng.choice(size, min(options['queries'], size), replace=False)
+        queries = normalize_rows(matrix[picks] + rng.normal(scale=0.03, size=(len(picks), dim)).astype(np.float32))
+        thresholds = np.full(size, -1.0, dtype=np.float32)
+        top_k = options['top_k']
+
+        # Both backends are timed one query at a time, like a frame with a
+        # single face in it.
+        start = time.perf_counter()
+        exact = np.vstack([
+            match_embeddings(queries[q:q + 1], matrix, thresholds, top_k=top_k)[0]
+            for q in range(len(queries))
+        ])
+        exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        self.stdout.write(f"Gallery: {size} x {dim}, {len(queries)} queries, recall@{top_k}")
+        self.stdout.write(f"{'backend':<22}{'recall':>8}{'ms/query':>12}")
+        self.stdout.write(f"{'exact':<22}{1.0:>8.3f}{exact_ms:>12.3f}")
+
+        start = time.perf_counter()
+        index = IVFFlatIndex(nlist=options['nlist'])
+        index.build(matrix, ids)
+        self.stdout.write(f"IVF build: {time.perf_counter() - start:.1f}s ({'trained' if index.trained else 'too small, exact fallback'})")
+
+        for nprobe in options['nprobe']:
+            index.nprobe = nprobe
+            start = time.perf_counter()
+            found = np.vstack([
+                index.search(matrix, thresholds, queries[q:q + 1], top_k=top_k)[0]
+                for q in range(len(queries))
+            ])
+            ivf_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            hits = sum(len(set(a) & set(b)) for a, b in zip(found.tolist(), exact.tolist()))
+            recall = hits / exact.size
+            self.stdout.write(f"{f'ivf nprobe={nprobe}':<22}{recall:>8.3f}{ivf_ms:>12.3f}")
+
+    def load_gallery(self, options, rng):
+        if options['from_db']:
+            from api.gallery import get_gallery
+            gallery = get_gallery()
+            gallery.load()
+            return np.ascontiguousarray(gallery.matrix)
+
+        # Clustered synthetic embeddings: real face embeddings are far from
+        # uniformly spread over the sphere.
+        centers = rng.normal(size=(max(1, options['size'] // 100), options['dim'])).astype(np.float32)
+        labels = rng.integers(0, len(centers), options['size'])
+        noise = rng.normal(scale=0.6, size=(options['size'], options['dim'])).astype(np.float32)
+        return normalize_rows(centers[labels] + noise)
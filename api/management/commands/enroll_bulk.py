@@ -0,0 +1,50 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+import os
+import time
+
+from api.enrollment import prepare_enrollment
+from api.models import EnrollmentJob, FaceLibrary
+
+
+class Command(BaseCommand):
+    help = "Bulk-enrolls profiles from a ZIP archive or a directory of images plus a CSV mapping (image,name[,description])."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="ZIP archive or directory containing the images.")
+        parser.add_argument('mapping', help="CSV file with 'image' and 'name' columns.")
+        parser.add_argument('--library', required=True, help="Name of the FaceLibrary to enroll into (created if missing).")
+        parser.add_argument('--no-wait', action='store_true', help="Return once the Celery chunks are queued.")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f"Source {source} does not exist.")
+
+        library, _ = FaceLibrary.objects.get_or_create(name=options['library'])
+        job = EnrollmentJob(library=library)
+        with open(options['mapping'], 'rb') as mapping:
+            job.mapping.save(os.path.basename(options['mapping']), File(mapping), save=False)
+        if os.path.isdir(source):
+            job.source_path = os.path.abspath(source)
+        else:
+            with open(source, 'rb') as archive:
+                job.archive.save(os.path.basename(source), File(archive), save=False)
+        job.save()
+
+        prepare_enrollment(job)
+        self.stdout.write(f"Enrollment #{job.pk}: {job.total} rows queued in chunks.")
+        if options['no_wait']:
+            return
+
+        while job.status not in (EnrollmentJob.STATUS_DONE, EnrollmentJob.STATUS_FAILED):
+            time.sleep(2)
+            job.refresh_from_db()
+            self.stdout.write(
+                f"\r{job.progress:5.1f}%  processed {job.processed}/{job.total}  "
+                f"registered {job.registered}  failed {job.failed}",
+                ending='',
+            )
+        self.stdout.write('')
+        style = self.style.SUCCESS if job.status == EnrollmentJob.STATUS_DONE else self.style.ERROR
+        self.stdout.write(style(f"Enrollment #{job.pk} {job.status}: {job.registered}/{job.total} registered."))
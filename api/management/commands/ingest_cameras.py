@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+import signal
+
+from api.consumers import parse_library_ids
+from api.ingest import IngestCamera, IngestWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Reads RTSP streams or video files on the server, runs sampled frames through the recognition "
+        "pipeline and publishes the results to stream viewers (?watch=<camera id>). Runs the cameras "
+        "of FACE_INGEST_CAMERAS, or the ones named, or a single --source."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('cameras', nargs='*', help="Camera ids from FACE_INGEST_CAMERAS; all of them by default.")
+        parser.add_argument('--source', help="An RTSP URL or video file to ingest instead of the configured cameras.")
+        parser.add_argument('--camera-id', default='ingest', help="Camera id of --source.")
+        parser.add_argument('--libraries', help="Library ids --source is matched against, e.g. 1,4.")
+        parser.add_argument('--fps', type=float, help="Frames sampled per second; overrides every camera's FPS.")
+        parser.add_argument('--loop', action='store_true', help="Start video files over at their end.")
+        parser.add_argument('--fast', action='store_true',
+                            help="Process video files as fast as possible instead of at their native speed.")
+        parser.add_argument('--no-jpeg', action='store_true', help="Publish only the detections, not the frames.")
+
+    def handle(self, *args, **options):
+        cameras = [
+            IngestCamera(
+                camera_id, config['SOURCE'], config['FPS'], library_ids=config['LIBRARIES'],
+                realtime=not options['fast'], loop=options['loop'],
+            )
+            for camera_id, config in self.camera_configs(options).items()
+        ]
+        worker = IngestWorker(
+            cameras,
+            publish_jpeg=settings.FACE_INGEST_PUBLISH_JPEG and not options['no_jpeg'],
+            jpeg_width=settings.FACE_INGEST_JPEG_WIDTH,
+        )
+        self.stdout.write(f"Ingesting {', '.join(camera.camera_id for camera in cameras)}; Ctrl+C to stop.")
+        asyncio.run(self.run(worker))
+        for camera in cameras:
+            stats = camera.source.stats
+            self.stdout.write(
+                f"{camera.camera_id}: {stats['sampled']} frames sampled of {stats['grabbed']}, "
+                f"{stats['skipped']} skipped, {stats['reconnects']} reconnects."
+            )
+
+    async def run(self, worker):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, worker.stop)
+        await worker.run()
+
+    def camera_configs(self, options):
+        fps = options['fps']
+        if options['source']:
+            try:
+                library_ids = parse_library_ids(options['libraries'] or '')
+            except ValueError:
+                raise CommandError("--libraries must be comma-separated library ids.")
+            return {options['camera_id']: {
+                'SOURCE': options['source'], 'FPS': fps or settings.FACE_INGEST_DEFAULT_FPS, 'LIBRARIES': library_ids,
+            }}
+
+        configured = settings.FACE_INGEST_CAMERAS
+        names = options['cameras'] or list(configured)
+        if not names:
+            raise CommandError("No cameras: configure FACE_INGEST_CAMERAS or pass --source.")
+        unknown = [name for name in names if name not in configured]
+        if unknown:
+            raise CommandError(f"Unknown cameras: {', '.join(unknown)}.")
+        return {
+            name: {
+                'SOURCE': configured[name]['SOURCE'],
+                'FPS': fps or configured[name].get('FPS', settings.FACE_INGEST_DEFAULT_FPS),
+                'LIBRARIES': configured[name].get('LIBRARIES'),
+            }
+            for name in names
+        }
@@ -0,0 +1,249 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import numpy as np
+
+from api.protocol import KIND_FRAME, KIND_RESULT, decode_message, encode_message
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+class StageStats:
+    def __init__(self):
+        self.sent = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.skipped = 0
+        self.lost = 0
+        self.faces = 0
+        self.rtt_ms = []
+        self.celery_depth = []
+        self.channel_depth = []
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-tests ws/ai/stream/: opens N concurrent camera connections that replay JPEGs from a "
+        "directory at a target FPS, and reports round-trip latency percentiles, server-side drops, "
+        "throughput and the Celery and channel-layer queue depths. Pass several connection counts "
+        "to step the load and find where throughput saturates. Run the server with "
+        "FACE_MODEL_STUB=True to take the model out of the measurement."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('frames', help="Directory of JPEG files to replay.")
+        parser.add_argument('--url', default='ws://localhost:8000/ws/ai/stream/')
+        parser.add_argument('--connections', type=int, nargs='+', default=[1, 4, 16],
+                            help="Concurrent connections; each count is run as one stage.")
+        parser.add_argument('--fps', type=float, default=10, help="Target frames per second per connection.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds per stage.")
+        parser.add_argument('--mode', choices=['metadata', 'annotated'], default='metadata')
+        parser.add_argument('--libraries', help="Value of ?libraries= for every connection.")
+        parser.add_argument('--text', action='store_true', help="Send base64 JSON frames instead of binary ones.")
+        parser.add_argument('--ignore-credits', action='store_true',
+                            help="Send at the target FPS even when the server asks the client to slow down.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise CommandError("loadtest_stream needs the 'websockets' package.")
+
+        jpegs = self.load_frames(options['frames'])
+        results = asyncio.run(self.run_stages(jpegs, options))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(
+            f"{'conns':>6}{'offered':>9}{'done/s':>9}{'drop%':>7}{'err':>5}{'skip':>6}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'celery':>8}{'chan':>7}"
+        )
+        for r in results:
+            self.stdout.write(
+                f"{r['connections']:>6}{r['offered_fps']:>9.1f}{r['processed_per_second']:>9.1f}"
+                f"{r['drop_rate']:>7.1%}{r['errors']:>5}{r['client_skipped']:>6}"
+                f"{r['rtt_ms']['p50']:>9.1f}{r['rtt_ms']['p95']:>9.1f}{r['rtt_ms']['p99']:>9.1f}"
+                f"{self.max_depth(r['celery_queue']):>8}{self.max_depth(r['channel_layer']):>7}"
+            )
+
+    @staticmethod
+    def max_depth(depth):
+        return '-' if depth is None else depth['max']
+
+    def load_frames(self, directory):
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory.")
+        jpegs = []
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    jpegs.append(f.read())
+        if not jpegs:
+            raise CommandError(f"No JPEG files in {directory}.")
+        return jpegs
+
+    async def run_stages(self, jpegs, options):
+        results = []
+        for connections in options['connections']:
+            stats = StageStats()
+            stop = asyncio.Event()
+            sampler = asyncio.create_task(self.sample_queues(stats, stop))
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.run_connection(index, jpegs, options, stats) for index in range(connections)
+            ))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await sampler
+            results.append(self.summarize(connections, elapsed, stats, options))
+            self.stderr.write(
+                f"{connections} connections: {results[-1]['processed_per_second']:.1f} frames/s processed, "
+                f"p95 {results[-1]['rtt_ms']['p95']:.1f} ms"
+            )
+        return results
+
+    def stream_url(self, options):
+        params = [f"mode={options['mode']}"]
+        if options['libraries']:
+            params.append(f"libraries={options['libraries']}")
+        return f"{options['url']}?{'&'.join(params)}"
+
+    async def run_connection(self, index, jpegs, options, stats):
+        import websockets
+
+        camera_id = f"loadtest-{index}"
+        interval = 1 / options['fps']
+        in_flight = {}
+        state = {'credits': 1}
+
+        async with websockets.connect(self.stream_url(options), max_size=None) as ws:
+            receiver = asyncio.create_task(self.receive_results(ws, in_flight, state, stats))
+            loop = asyncio.get_running_loop()
+            # Stagger the connections so they do not all send at once.
+            next_send = loop.time() + random.random() * interval
+            stop_at = loop.time() + options['duration']
+            seq = 0
+            while next_send < stop_at:
+                await asyncio.sleep(max(0.0, next_send - loop.time()))
+                next_send += interval
+                if not options['ignore_credits'] and len(in_flight) >= state['credits']:
+                    stats.skipped += 1
+                    continue
+
+                seq += 1
+                jpeg = jpegs[(seq + index) % len(jpegs)]
+                in_flight[seq] = time.perf_counter()
+                if options['text']:
+                    await ws.send(json.dumps({'frame': base64.b64encode(jpeg).decode('ascii'), 'seq': seq}))
+                else:
+                    await ws.send(encode_message(KIND_FRAME, seq, camera_id, None, jpeg))
+                stats.sent += 1
+
+            # Give the last frames a moment to come back.
+            deadline = loop.time() + 5
+            while in_flight and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+            stats.lost += len(in_flight)
+            receiver.cancel()
+
+    async def receive_results(self, ws, in_flight, state, stats):
+        async for message in ws:
+            if isinstance(message, bytes):
+                kind, seq, _, metadata, _ = decode_message(message)
+                if kind != KIND_RESULT:
+                    continue
+            else:
+                metadata = json.loads(message)
+                if metadata.get('type') == 'status_update':
+                    continue
+                seq = metadata.get('seq', 0)
+
+            sent_at = in_flight.pop(seq, None)
+            state['credits'] = metadata.get('credits', state['credits'])
+            status = metadata.get('status')
+            if status == 'processed':
+                stats.processed += 1
+                stats.faces += len(metadata.get('detections', []))
+                if sent_at is not None:
+                    stats.rtt_ms.append((time.perf_counter() - sent_at) * 1000)
+            elif status == 'dropped':
+                stats.dropped += 1
+            else:
+                stats.errors += 1
+
+    async def sample_queues(self, stats, stop):
+        """
+        Samples the Celery broker queue and the channel layer once a second.
+        Channel messages waiting for a consumer sit in one sorted set per
+        channel under the layer's key prefix.
+        """
+        import redis.asyncio as aioredis
+
+        broker = aioredis.from_url(settings.CELERY_BROKER_URL)
+        layer_config = settings.CHANNEL_LAYERS['default'].get('CONFIG', {})
+        host, port = layer_config.get('hosts', [(settings.REDIS_HOST, 6379)])[0]
+        layer = aioredis.Redis(host=host, port=port)
+        prefix = layer_config.get('prefix', 'asgi')
+        try:
+            while not stop.is_set():
+                try:
+                    stats.celery_depth.append(await broker.llen('celery'))
+                    depth = 0
+                    async for key in layer.scan_iter(match=f"{prefix}*", count=1000):
+                        if not key.startswith(f"{prefix}:group:".encode()) and await layer.type(key) == b'zset':
+                            depth += await layer.zcard(key)
+                    stats.channel_depth.append(depth)
+                except aioredis.RedisError as e:
+                    self.stderr.write(f"Queue sampling failed: {e}")
+                    return
+                try:
+                    await asyncio.wait_for(stop.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await broker.aclose()
+            await layer.aclose()
+
+    def summarize(self, connections, elapsed, stats, options):
+        def distribution(values):
+            if not values:
+                return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+            values = np.asarray(values)
+            return {
+                'p50': round(float(np.percentile(values, 50)), 1),
+                'p95': round(float(np.percentile(values, 95)), 1),
+                'p99': round(float(np.percentile(values, 99)), 1),
+                'max': round(float(values.max()), 1),
+            }
+
+        def depth(values):
+            # None when Redis could not be sampled.
+            if not values:
+                return None
+            return {'max': max(values), 'mean': round(float(np.mean(values)), 1)}
+
+        return {
+            'connections': connections,
+            'offered_fps': connections * options['fps'],
+            'seconds': round(elapsed, 2),
+            'sent': stats.sent,
+            'processed': stats.processed,
+            'dropped': stats.dropped,
+            'errors': stats.errors,
+            'lost': stats.lost,
+            'client_skipped': stats.skipped,
+            'processed_per_second': round(stats.processed / elapsed, 1),
+            'drop_rate': round(stats.dropped / stats.sent, 4) if stats.sent else 0.0,
+            'mean_faces': round(stats.faces / stats.processed, 2) if stats.processed else 0.0,
+            'rtt_ms': distribution(stats.rtt_ms),
+            'celery_queue': depth(stats.celery_depth),
+            'channel_layer': depth(stats.channel_depth),
+        }
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+import os
+
+from api.ai_utils import current_embedding_model
+from api.gallery import get_gallery
+from api.search_index import search_index_files
+
+
+class Command(BaseCommand):
+    help = "Re-trains the gallery search index from the registered profiles and saves it to disk."
+
+    def handle(self, *args, **options):
+        # Shard indexes are removed too; each is re-trained when its shard
+        # is next loaded.
+        for path in search_index_files(current_embedding_model()):
+            os.remove(path)
+
+        gallery = get_gallery()
+        gallery.load()
+        trained = getattr(gallery.index, 'trained', False)
+        self.stdout.write(self.style.SUCCESS(
+            f"Search index rebuilt over {len(gallery)} faces ({'trained' if trained else 'exact search'})."
+        ))
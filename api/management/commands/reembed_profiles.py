@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import json
+import time
+
+from api.ai_utils import read_active_tier
+from api.reembedding import ReembedRun, format_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embeds every registered profile with a model tier, in resumable keyset chunks, "
+        "and switches all workers to that tier once every profile is done."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tier', choices=list(settings.FACE_MODEL_TIERS), help="Target model tier.")
+        parser.add_argument('--chunk-size', type=int, default=settings.FACE_REEMBED_CHUNK_SIZE)
+        parser.add_argument('--threads', type=int, default=settings.FACE_REEMBED_DECODE_THREADS,
+                            help="Threads reading and decoding images.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of an unfinished run.")
+        parser.add_argument('--no-switch', action='store_true',
+                            help="Only write the embeddings; keep serving the current tier.")
+        parser.add_argument('--celery', action='store_true', help="Run the chunks as a chain of Celery tasks.")
+        parser.add_argument('--no-wait', action='store_true', help="With --celery, return once the run is queued.")
+        parser.add_argument('--json', action='store_true', help="Print the final report as JSON.")
+
+    def handle(self, *args, **options):
+        tier = options['tier']
+        switch = not options['no_switch']
+        run = ReembedRun(tier, chunk_size=options['chunk_size'], threads=options['threads'])
+        if not run.start(restart=options['restart']):
+            raise CommandError(f"A re-embedding run towards {tier} is already going on.")
+
+        checkpoint = run.checkpoint()
+        if checkpoint['last_face_id']:
+            self.stdout.write(f"Resuming after {checkpoint['last_face_id']} ({checkpoint['processed']} done).")
+        self.stdout.write(f"Re-embedding with {run.model_name}; serving {read_active_tier()} meanwhile.")
+
+        if options['celery']:
+            from api.tasks import reembed_profiles_task
+
+            reembed_profiles_task.delay(tier, switch, options['chunk_size'], options['threads'])
+            if options['no_wait']:
+                self.stdout.write(f"Run towards {tier} queued.")
+                return
+            while not checkpoint['finished']:
+                time.sleep(2)
+                checkpoint = run.checkpoint()
+                self.stdout.write(f"\r{format_report(checkpoint)}", ending='')
+                if not checkpoint['finished'] and not run.is_running():
+                    self.stdout.write('')
+                    raise CommandError("The run stopped; see the worker log, then run this again to resume.")
+            self.stdout.write('')
+        else:
+            try:
+                while run.run_chunk() is not None:
+                    self.stdout.write(f"\r{format_report(run.checkpoint())}", ending='')
+            except BaseException:
+                run.release()
+                self.stdout.write('')
+                raise
+            self.stdout.write('')
+            run.finish(switch=switch)
+
+        checkpoint = run.checkpoint()
+        if options['json']:
+            self.stdout.write(json.dumps(checkpoint, indent=2))
+            return
+        self.stdout.write(self.style.SUCCESS(format_report(checkpoint)))
+        if switch:
+            self.stdout.write(self.style.SUCCESS(f"All workers switched to {tier}."))
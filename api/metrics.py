@@ -0,0 +1,85 @@
+"""
+Prometheus metrics for the frame path, the gallery and Celery tasks,
+served at /metrics.
+
+Stage timings share one histogram labelled by stage. Per-frame stages are
+base64_decode, imdecode, queue, detect, draw, jpeg_encode and send. embed
+and match run once per inference batch, so they are recorded per batch.
+
+Every process keeps its own metrics. When daphne and the Celery workers
+share a host, set PROMETHEUS_MULTIPROC_DIR to the same empty directory for
+all of them, and /metrics then reports every process together. The gallery
+sizes always come from the process serving the request.
+"""
+from contextlib import contextmanager
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+STAGE_SECONDS = Histogram(
+    'face_stage_seconds', "Time spent in each stage of the frame path.", ['stage'], buckets=STAGE_BUCKETS,
+)
+FACES_PER_FRAME = Histogram(
+    'face_faces_per_frame', "Faces tracked in each processed frame.", buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24),
+)
+STREAM_FRAMES = Counter(
+    'face_stream_frames', "Stream frames by outcome: received, processed, dropped or error.", ['status'],
+)
+CELERY_TASK_SECONDS = Histogram(
+    'face_celery_task_seconds', "Celery task run time.", ['task', 'state'], buckets=TASK_BUCKETS,
+)
+CELERY_QUEUE_SECONDS = Histogram(
+    'face_celery_queue_seconds', "Time from publishing a Celery task to a worker starting it.", ['task'],
+    buckets=TASK_BUCKETS,
+)
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+class GalleryCollector:
+    """
+    Faces and delta version of each gallery this process has loaded.
+    """
+
+    def collect(self):
+        from .gallery import get_gallery, get_gallery_shards
+
+        faces = GaugeMetricFamily('face_gallery_faces', "Faces in each loaded gallery.", labels=['library'])
+        version = GaugeMetricFamily('face_gallery_version', "Delta version of each loaded gallery.", labels=['library'])
+        galleries = [('all', get_gallery())] + [(str(shard.library_id), shard) for shard in get_gallery_shards().loaded()]
+        for library, gallery in galleries:
+            if gallery.loaded:
+                faces.add_metric([library], len(gallery))
+                version.add_metric([library], gallery.version)
+        yield faces
+        yield version
+
+
+REGISTRY.register(GalleryCollector())
+
+
+def render_metrics():
+    """
+    Returns (body, content type) of the Prometheus text exposition.
+    """
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(GalleryCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
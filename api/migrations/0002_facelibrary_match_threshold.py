@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facelibrary',
+            name='match_threshold',
+            field=models.FloatField(default=0.5, verbose_name='حد التطابق'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_facelibrary_match_threshold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive', models.FileField(blank=True, null=True, upload_to='enrollment_uploads/', verbose_name='ملف الصور المضغوط (ZIP)')),
+                ('source_path', models.CharField(blank=True, max_length=500, verbose_name='مجلد الصور على الخادم')),
+                ('mapping', models.FileField(upload_to='enrollment_uploads/', verbose_name='ملف الربط (CSV)')),
+                ('status', models.CharField(choices=[('pending', 'بالانتظار'), ('preparing', 'جارٍ التحضير'), ('embedding', 'جارٍ استخراج الـ Embedding'), ('done', 'مكتمل'), ('failed', 'فشل')], default='pending', max_length=20, verbose_name='الحالة')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='إجمالي الصور')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='الصور المعالجة')),
+                ('registered', models.PositiveIntegerField(default=0, verbose_name='الوجوه المسجلة')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='الصور الفاشلة')),
+                ('error', models.TextField(blank=True, verbose_name='الخطأ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('library', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollment_jobs', to='api.facelibrary', verbose_name='المكتبة المرتبطة')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:44
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_enrollmentjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='accesslog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='تاريخ ووقت الحدث'),
+        ),
+    ]
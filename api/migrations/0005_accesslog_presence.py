@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_accesslog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='accesslog',
+            name='best_score',
+            field=models.FloatField(blank=True, null=True, verbose_name='أفضل درجة تطابق'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='camera_id',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='الكاميرا'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='frame_count',
+            field=models.PositiveIntegerField(default=1, verbose_name='عدد الإطارات'),
+        ),
+        migrations.AddField(
+            model_name='accesslog',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر ظهور'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+from datetime import timedelta
+
+from api.partitions import DEFAULT_PARTITION, PARENT_TABLE, ensure_partitions
+
+OLD_TABLE = f'{PARENT_TABLE}_unpartitioned'
+SEQUENCE = f'{PARENT_TABLE}_log_id_seq'
+
+
+def partition_access_logs(apps, schema_editor):
+    """
+    Rebuilds api_accesslog as a table range-partitioned on "timestamp" and
+    moves the existing rows into it. Postgres requires the partition key in
+    the primary key, so it becomes (id, timestamp); ids stay unique through
+    the shared sequence and Django keeps using `id` alone.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" RENAME TO "{OLD_TABLE}"')
+        cursor.execute(
+            f'CREATE TABLE "{PARENT_TABLE}" (LIKE "{OLD_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'CREATE SEQUENCE "{SEQUENCE}" OWNED BY "{PARENT_TABLE}"."id"')
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{SEQUENCE}"\')')
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{PARENT_TABLE}" DEFAULT')
+
+        cursor.execute(f'SELECT MIN("timestamp") FROM "{OLD_TABLE}"')
+        oldest = cursor.fetchone()[0]
+        today = timezone.now().date()
+        ensure_partitions(
+            cursor,
+            oldest.date() if oldest else today,
+            today + timedelta(days=settings.FACE_ACCESS_LOG_PARTITION_PREMAKE_DAYS),
+            settings.FACE_ACCESS_LOG_PARTITION_DAYS,
+        )
+
+        cursor.execute(f'INSERT INTO "{PARENT_TABLE}" SELECT * FROM "{OLD_TABLE}"')
+        cursor.execute(f'SELECT setval(\'"{SEQUENCE}"\', COALESCE(MAX("id"), 0) + 1, false) FROM "{PARENT_TABLE}"')
+        cursor.execute(f'DROP TABLE "{OLD_TABLE}"')
+
+        # Created after the old table is gone, since index names are shared
+        # across the schema. Each is cloned onto every partition.
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" ADD PRIMARY KEY ("id", "timestamp")')
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ADD CONSTRAINT "{PARENT_TABLE}_profile_id_fk" '
+            f'FOREIGN KEY ("profile_id") REFERENCES "api_faceprofile" ("face_id") DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'CREATE INDEX "{PARENT_TABLE}_profile_id_idx" ON "{PARENT_TABLE}" ("profile_id")')
+
+
+def unpartition_access_logs(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    partitioned = f'{PARENT_TABLE}_partitioned'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" RENAME TO "{partitioned}"')
+        cursor.execute(f'CREATE TABLE "{PARENT_TABLE}" (LIKE "{partitioned}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'INSERT INTO "{PARENT_TABLE}" SELECT * FROM "{partitioned}"')
+        cursor.execute(f'ALTER SEQUENCE "{SEQUENCE}" OWNED BY "{PARENT_TABLE}"."id"')
+        cursor.execute(f'DROP TABLE "{partitioned}" CASCADE')
+
+        cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" ADD PRIMARY KEY ("id")')
+        cursor.execute(
+            f'ALTER TABLE "{PARENT_TABLE}" ADD CONSTRAINT "{PARENT_TABLE}_profile_id_fk" '
+            f'FOREIGN KEY ("profile_id") REFERENCES "api_faceprofile" ("face_id") DEFERRABLE INITIALLY DEFERRED'
+        )
+        cursor.execute(f'CREATE INDEX "{PARENT_TABLE}_profile_id_idx" ON "{PARENT_TABLE}" ("profile_id")')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_accesslog_presence'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_access_logs, unpartition_access_logs, elidable=False),
+    ]
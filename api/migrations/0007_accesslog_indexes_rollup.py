@@ -0,0 +1,43 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_partition_accesslog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessLogRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='اليوم')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='الساعة')),
+                ('is_recognized', models.BooleanField(default=False, verbose_name='هل تم التعرف عليه؟')),
+                ('visits', models.PositiveIntegerField(default=0, verbose_name='عدد الزيارات')),
+                ('frames', models.PositiveIntegerField(default=0, verbose_name='عدد الإطارات')),
+                ('last_log_id', models.BigIntegerField(default=0, verbose_name='آخر سجل محتسب')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='accesslog',
+            index=models.Index(fields=['-timestamp', '-id'], name='api_accesslog_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accesslog',
+            index=models.Index(fields=['profile', '-timestamp'], name='api_accesslog_profile_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='accesslogrollup',
+            name='profile',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.faceprofile', verbose_name='الشخص المعرف عليه'),
+        ),
+        migrations.AddIndex(
+            model_name='accesslogrollup',
+            index=models.Index(fields=['day', 'hour'], name='api_rollup_day_hour_idx'),
+        ),
+    ]
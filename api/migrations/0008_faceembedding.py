@@ -0,0 +1,78 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+import numpy as np
+
+# The ArrayField embeddings were all computed with buffalo_l.
+LEGACY_MODEL_NAME = 'buffalo_l'
+
+
+def copy_embeddings(apps, schema_editor):
+    """
+    Moves every ArrayField embedding (a list of vectors, one per detected
+    face) into packed float32 FaceEmbedding rows.
+    """
+    FaceProfile = apps.get_model('api', 'FaceProfile')
+    FaceEmbedding = apps.get_model('api', 'FaceEmbedding')
+
+    rows = []
+    for face_id, embedding in FaceProfile.objects.filter(face_embedding__isnull=False).values_list('face_id', 'face_embedding').iterator():
+        vectors = np.asarray(embedding, dtype='<f4')
+        if vectors.size == 0:
+            continue
+        for face_index, vector in enumerate(vectors.reshape(-1, vectors.shape[-1])):
+            rows.append(FaceEmbedding(
+                profile_id=face_id, model_name=LEGACY_MODEL_NAME, face_index=face_index,
+                dim=vector.shape[0], norm=float(np.linalg.norm(vector)), vector=vector.tobytes(),
+            ))
+        if len(rows) >= 1000:
+            FaceEmbedding.objects.bulk_create(rows)
+            rows = []
+    FaceEmbedding.objects.bulk_create(rows)
+
+
+def restore_embeddings(apps, schema_editor):
+    FaceProfile = apps.get_model('api', 'FaceProfile')
+    FaceEmbedding = apps.get_model('api', 'FaceEmbedding')
+
+    vectors = {}
+    for face_id, dim, data in FaceEmbedding.objects.filter(model_name=LEGACY_MODEL_NAME).order_by('face_index').values_list('profile_id', 'dim', 'vector').iterator():
+        vectors.setdefault(face_id, []).append(np.frombuffer(data, dtype='<f4', count=dim).tolist())
+    for face_id, embedding in vectors.items():
+        FaceProfile.objects.filter(face_id=face_id).update(face_embedding=embedding)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_accesslog_indexes_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=64, verbose_name='النموذج')),
+                ('face_index', models.PositiveSmallIntegerField(default=0, verbose_name='ترتيب الوجه في الصورة')),
+                ('dim', models.PositiveSmallIntegerField(verbose_name='عدد الأبعاد')),
+                ('norm', models.FloatField(verbose_name='الطول')),
+                ('vector', models.BinaryField(verbose_name='التمثيل الرقمي (Embedding)')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='api.faceprofile', verbose_name='الشخص')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['model_name', 'face_index'], name='api_faceembedding_model_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='faceembedding',
+            constraint=models.UniqueConstraint(fields=('profile', 'model_name', 'face_index'), name='api_faceembedding_unique_face'),
+        ),
+        migrations.RunPython(copy_embeddings, restore_embeddings),
+        migrations.RemoveField(
+            model_name='faceprofile',
+            name='face_embedding',
+        ),
+    ]
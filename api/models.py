@@ -1,16 +1,22 @@
 from django.db import models
-from django.contrib.postgres.fields import ArrayField 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _ 
 from django.db import transaction
+import logging
 import uuid
 
 from .tasks import calculate_embedding_task
+from .embeddings import unpack_embedding
+from .gallery import make_gallery_delta, make_library_delta, publish_gallery_delta
+
+logger = logging.getLogger(__name__)
 
 class FaceLibrary(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name=_("اسم المكتبة"))
     description = models.TextField(blank=True, verbose_name=_("وصف المكتبة"))
+    match_threshold = models.FloatField(default=0.5, verbose_name=_("حد التطابق"))
     creation_date = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -23,28 +29,144 @@ class FaceProfile(models.Model):
     name = models.CharField(max_length=150, verbose_name=_("اسم الشخص"))
     description = models.TextField(blank=True, verbose_name=_("وصف إضافي"))
     face_image = models.ImageField(upload_to='faces_images/', verbose_name=_("صورة الوجه"))
-    face_embedding = ArrayField(models.FloatField(), size=128, blank=True, null=True, verbose_name=_("التمثيل الرقمي (Embedding)"))
     is_registered = models.BooleanField(default=False, verbose_name=_("هل تم استخراج الـ Embedding؟"))
 
     def __str__(self):
         return f"{self.name} ({self.library.name})"
 
+class FaceEmbedding(models.Model):
+    """
+    One face's embedding from one recognition model, stored as packed
+    float32 (see api/embeddings.py). Face 0 is the one the gallery matches.
+    """
+    profile = models.ForeignKey(FaceProfile, on_delete=models.CASCADE, related_name='embeddings', verbose_name=_("الشخص"))
+    model_name = models.CharField(max_length=64, verbose_name=_("النموذج"))
+    face_index = models.PositiveSmallIntegerField(default=0, verbose_name=_("ترتيب الوجه في الصورة"))
+    dim = models.PositiveSmallIntegerField(verbose_name=_("عدد الأبعاد"))
+    norm = models.FloatField(verbose_name=_("الطول"))
+    vector = models.BinaryField(verbose_name=_("التمثيل الرقمي (Embedding)"))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'model_name', 'face_index'], name='api_faceembedding_unique_face'),
+        ]
+        indexes = [
+            models.Index(fields=['model_name', 'face_index'], name='api_faceembedding_model_idx'),
+        ]
+
+    @property
+    def embedding(self):
+        return unpack_embedding(self.vector, self.dim)
 
+
+# The table is range-partitioned on `timestamp` by migration 0006 (see
+# api/partitions.py); retention drops partitions, so avoid bulk deletes.
 class AccessLog(models.Model):
     profile = models.ForeignKey(FaceProfile, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("الشخص المعرف عليه"))
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name=_("تاريخ ووقت الحدث"))
+    # Not auto_now_add: buffered logs are bulk-inserted later with the time they were detected.
+    timestamp = models.DateTimeField(default=timezone.now, editable=False, verbose_name=_("تاريخ ووقت الحدث"))
     is_recognized = models.BooleanField(default=False, verbose_name=_("هل تم التعرف عليه؟"))
     snapshot_image = models.ImageField(upload_to='log_snapshots/', blank=True, null=True, verbose_name=_("صورة اللقطة"))
     log_message = models.CharField(max_length=255, verbose_name=_("رسالة السجل"))
+    # Stream logs are one row per visit: `timestamp` is when it started.
+    camera_id = models.CharField(max_length=64, blank=True, default='', verbose_name=_("الكاميرا"))
+    last_seen = models.DateTimeField(null=True, blank=True, verbose_name=_("آخر ظهور"))
+    frame_count = models.PositiveIntegerField(default=1, verbose_name=_("عدد الإطارات"))
+    best_score = models.FloatField(null=True, blank=True, verbose_name=_("أفضل درجة تطابق"))
+
+    class Meta:
+        indexes = [
+            # Keyset pagination walks (timestamp, id) newest first.
+            models.Index(fields=['-timestamp', '-id'], name='api_accesslog_time_id_idx'),
+            models.Index(fields=['profile', '-timestamp'], name='api_accesslog_profile_time_idx'),
+        ]
 
     def __str__(self):
         return f"Log at {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
 
+class AccessLogRollup(models.Model):
+    """
+    Visit counts per local day, hour and profile (NULL for strangers),
+    maintained incrementally from AccessLog by rollup_access_logs_task.
+    """
+    day = models.DateField(verbose_name=_("اليوم"))
+    hour = models.PositiveSmallIntegerField(verbose_name=_("الساعة"))
+    profile = models.ForeignKey(FaceProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("الشخص المعرف عليه"))
+    is_recognized = models.BooleanField(default=False, verbose_name=_("هل تم التعرف عليه؟"))
+    visits = models.PositiveIntegerField(default=0, verbose_name=_("عدد الزيارات"))
+    frames = models.PositiveIntegerField(default=0, verbose_name=_("عدد الإطارات"))
+    last_log_id = models.BigIntegerField(default=0, verbose_name=_("آخر سجل محتسب"))
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['day', 'hour'], name='api_rollup_day_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.hour:02d}:00 ({self.visits})"
+
+class EnrollmentJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PREPARING = 'preparing'
+    STATUS_EMBEDDING = 'embedding'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _("بالانتظار")),
+        (STATUS_PREPARING, _("جارٍ التحضير")),
+        (STATUS_EMBEDDING, _("جارٍ استخراج الـ Embedding")),
+        (STATUS_DONE, _("مكتمل")),
+        (STATUS_FAILED, _("فشل")),
+    )
+
+    library = models.ForeignKey(FaceLibrary, on_delete=models.CASCADE, related_name='enrollment_jobs', verbose_name=_("المكتبة المرتبطة"))
+    archive = models.FileField(upload_to='enrollment_uploads/', blank=True, null=True, verbose_name=_("ملف الصور المضغوط (ZIP)"))
+    source_path = models.CharField(max_length=500, blank=True, verbose_name=_("مجلد الصور على الخادم"))
+    mapping = models.FileField(upload_to='enrollment_uploads/', verbose_name=_("ملف الربط (CSV)"))
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name=_("الحالة"))
+    total = models.PositiveIntegerField(default=0, verbose_name=_("إجمالي الصور"))
+    processed = models.PositiveIntegerField(default=0, verbose_name=_("الصور المعالجة"))
+    registered = models.PositiveIntegerField(default=0, verbose_name=_("الوجوه المسجلة"))
+    failed = models.PositiveIntegerField(default=0, verbose_name=_("الصور الفاشلة"))
+    error = models.TextField(blank=True, verbose_name=_("الخطأ"))
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Enrollment #{self.pk} into {self.library.name} ({self.status})"
+
+    @property
+    def progress(self):
+        return round(100 * self.processed / self.total, 1) if self.total else 0.0
+
 @receiver(post_save, sender=FaceProfile)
 def process_face_on_save(sender, instance, created, **kwargs):
     if created:
         transaction.on_commit(
             lambda: calculate_embedding_task.delay(profile_id=instance.pk)
         )
-        print(f"ASYNC Signal: Task submitted for {instance.name} with PK={instance.pk} (On Commit).")
+        logger.info("Embedding task queued for %s.", instance.name, extra={'profile_id': str(instance.pk)})
+    elif instance.is_registered and kwargs.get('update_fields') is None:
+        delta = make_gallery_delta('update', instance)
+        transaction.on_commit(
+            lambda: publish_gallery_delta(delta, f"Profile {instance.name} updated.")
+        )
+
+
+@receiver(post_delete, sender=FaceProfile)
+def remove_face_on_delete(sender, instance, **kwargs):
+    if instance.is_registered:
+        delta = make_gallery_delta('delete', instance)
+        transaction.on_commit(
+            lambda: publish_gallery_delta(delta, f"Profile {instance.name} removed.")
+        )
 
+
+@receiver(post_save, sender=FaceLibrary)
+def update_library_threshold(sender, instance, created, **kwargs):
+    if not created:
+        delta = make_library_delta(instance)
+        transaction.on_commit(
+            lambda: publish_gallery_delta(delta, f"Library {instance.name} updated.")
+        )
@@ -0,0 +1,119 @@
+from collections import defaultdict
+import threading
+import numpy as np
+import cv2
+
+
+def roi_boxes(rois, width, height):
+    """
+    Converts ROIs given as (left, top, right, bottom) fractions of the frame
+    into pixel boxes clamped to the frame; no ROIs means the whole frame.
+    Overlapping ROIs are merged into their bounding box, so no face is
+    detected twice.
+    """
+    if not rois:
+        return [(0, 0, width, height)]
+    boxes = []
+    for left, top, right, bottom in rois:
+        box = (
+            max(0, int(left * width)), max(0, int(top * height)),
+            min(width, int(np.ceil(right * width))), min(height, int(np.ceil(bottom * height))),
+        )
+        if box[0] < box[2] and box[1] < box[3]:
+            boxes.append(box)
+
+    merged = []
+    while boxes:
+        box = boxes.pop()
+        other = next((m for m in merged if _overlaps(box, m)), None)
+        if other is None:
+            merged.append(box)
+        else:
+            merged.remove(other)
+            boxes.append((min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])))
+    return sorted(merged)
+
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+class MotionGate:
+    """
+    Cheap pre-stage that decides whether a frame is worth running the face
+    detector on.
+
+    The frame is shrunk to `width` pixels wide, converted to gray and
+    compared with a running-average background; the frame has motion when
+    more than `min_area` of the ROI pixels changed by over
+    `pixel_threshold` gray levels. Frames with live tracks always pass, so a
+    person standing still is not lost, and every `force_every`-th frame
+    passes so a face absorbed into the background is still found.
+    """
+
+    def __init__(self, rois=None, width=160, pixel_threshold=25, min_area=0.002,
+                 force_every=30, learning_rate=0.05):
+        self.rois = rois or []
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.force_every = force_every
+        self.learning_rate = learning_rate
+        self.background = None
+        self.mask = None
+        self.skipped_in_a_row = 0
+
+    def should_detect(self, frame, has_tracks=False):
+        height, width = frame.shape[:2]
+        small_height = max(1, round(height * self.width / width))
+        gray = cv2.cvtColor(cv2.resize(frame, (self.width, small_height), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            self.mask = self._roi_mask(gray.shape)
+            self.skipped_in_a_row = 0
+            return True
+
+        changed = cv2.absdiff(gray, cv2.convertScaleAbs(self.background)) > self.pixel_threshold
+        cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+        moving = np.count_nonzero(changed & self.mask) >= self.min_area * max(1, np.count_nonzero(self.mask))
+
+        if moving or has_tracks or self.skipped_in_a_row + 1 >= self.force_every:
+            self.skipped_in_a_row = 0
+            return True
+        self.skipped_in_a_row += 1
+        return False
+
+    def _roi_mask(self, shape):
+        mask = np.zeros(shape, dtype=bool)
+        for left, top, right, bottom in roi_boxes(self.rois, shape[1], shape[0]):
+            mask[top:bottom, left:right] = True
+        return mask
+
+
+class GateStats:
+    """
+    Process-wide per-camera counts of frames seen and frames whose detector
+    run was skipped by the motion gate.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cameras = defaultdict(lambda: {'frames': 0, 'skipped': 0})
+
+    def record(self, camera_id, skipped):
+        with self.lock:
+            counts = self.cameras[camera_id or 'default']
+            counts['frames'] += 1
+            counts['skipped'] += int(skipped)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                camera: {**counts, 'skip_rate': round(counts['skipped'] / counts['frames'], 4) if counts['frames'] else 0.0}
+                for camera, counts in self.cameras.items()
+            }
+
+
+gate_stats = GateStats()
@@ -0,0 +1,94 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from datetime import datetime
+import base64
+
+
+def encode_cursor(log, reverse=False):
+    value = f"{log.timestamp.isoformat()}|{log.pk}|{'r' if reverse else 'f'}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, id, reverse) from a cursor; raises ValueError on
+    anything malformed.
+    """
+    try:
+        timestamp, pk, direction = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk), direction == 'r'
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(queryset, cursor=None, page_size=100):
+    """
+    Newest-first keyset page over (timestamp, id): seeks past the cursor's
+    row with an index range scan instead of an OFFSET, so deep pages cost
+    the same as the first one.
+
+    Returns (items, next_cursor, previous_cursor); a cursor is None when
+    there is nothing further in that direction.
+    """
+    timestamp, pk, reverse = decode_cursor(cursor) if cursor else (None, None, False)
+
+    if timestamp is None:
+        items = list(queryset.order_by('-timestamp', '-id')[:page_size + 1])
+    elif not reverse:
+        items = list(queryset.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+        ).order_by('-timestamp', '-id')[:page_size + 1])
+    else:
+        items = list(queryset.filter(
+            Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+        ).order_by('timestamp', 'id')[:page_size + 1])
+
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if reverse:
+        items.reverse()
+    if not items:
+        return items, None, None
+
+    has_older = has_more if not reverse else True
+    has_newer = timestamp is not None if not reverse else has_more
+    return (
+        items,
+        encode_cursor(items[-1]) if has_older else None,
+        encode_cursor(items[0], reverse=True) if has_newer else None,
+    )
+
+
+class AccessLogCursorPagination(BasePagination):
+    """
+    DRF pagination over keyset_page: `?cursor=` links instead of page
+    numbers, and no COUNT(*) over the log table.
+    """
+    page_size = 100
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            items, self.next_cursor, self.previous_cursor = keyset_page(
+                queryset, request.query_params.get(self.cursor_query_param), self.page_size
+            )
+        except ValueError as e:
+            raise NotFound(str(e))
+        return items
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.next_cursor),
+            'previous': self.get_link(self.previous_cursor),
+            'results': data,
+        })
@@ -0,0 +1,111 @@
+"""
+Range partitions of the AccessLog table on `timestamp`.
+
+The table is partitioned by migration 0006. Each partition covers
+FACE_ACCESS_LOG_PARTITION_DAYS UTC days and is named after its first day
+(`api_accesslog_p20261018`). A DEFAULT partition catches rows no partition
+covers yet. Retention detaches and drops whole partitions instead of
+running a large DELETE.
+"""
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+import re
+
+PARENT_TABLE = 'api_accesslog'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+
+# Weekly partitions start on Mondays; 1970-01-05 was one.
+_ALIGN_EPOCH = date(1970, 1, 5)
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def partition_start(day, width_days):
+    return day - timedelta(days=(day - _ALIGN_EPOCH).days % width_days)
+
+
+def partition_name(start):
+    return f"{PARENT_TABLE}_p{start:%Y%m%d}"
+
+
+def _utc_midnight(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def list_partitions(cursor):
+    """
+    Returns (name, start, end) for every ranged partition, oldest first.
+    """
+    cursor.execute(
+        """
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        """,
+        [PARENT_TABLE],
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        found = _BOUND_RE.search(bound)
+        if found:
+            start, end = (datetime.fromisoformat(value) for value in found.groups())
+            partitions.append((name, start, end))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(cursor, start, end):
+    """
+    Creates the partition for [start, end) and attaches it. Rows already
+    parked in the DEFAULT partition for that range are moved into it first,
+    otherwise the attach would fail.
+    """
+    name = partition_name(start)
+    lower, upper = _utc_midnight(start), _utc_midnight(end)
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{PARENT_TABLE}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f'INSERT INTO "{name}" SELECT * FROM moved',
+        [lower, upper],
+    )
+    cursor.execute(
+        f'ALTER TABLE "{PARENT_TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+        [lower, upper],
+    )
+    return name
+
+
+def ensure_partitions(cursor, first_day, last_day, width_days=1):
+    """
+    Makes sure partitions cover every day from `first_day` to `last_day`.
+    New partitions start where the newest existing one ends, so changing
+    the width never creates overlapping ranges.
+    """
+    existing = list_partitions(cursor)
+    day = partition_start(first_day, width_days)
+    if existing:
+        covered_until = existing[-1][2].astimezone(dt_timezone.utc).date()
+        if covered_until > day:
+            day = covered_until
+
+    created = []
+    while day <= last_day:
+        end = partition_start(day, width_days) + timedelta(days=width_days)
+        created.append(create_partition(cursor, day, end))
+        day = end
+    return created
+
+
+def drop_partitions_before(cursor, cutoff):
+    """
+    Detaches and drops the partitions that end at or before `cutoff`, and
+    deletes the (normally few) expired rows left in the DEFAULT partition.
+    """
+    dropped = []
+    for name, _, end in list_partitions(cursor):
+        if end <= cutoff:
+            cursor.execute(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"')
+            cursor.execute(f'DROP TABLE "{name}"')
+            dropped.append(name)
+
+    cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" WHERE "timestamp" < %s', [cutoff])
+    return dropped, cursor.rowcount
@@ -0,0 +1,137 @@
+from django.conf import settings
+import numpy as np
+import cv2
+
+from .ai_utils import detect_faces, embed_faces
+from .gallery import get_gallery, search_galleries
+from .motion import MotionGate, gate_stats, roi_boxes
+from .tracking import FaceTracker
+
+RECOGNIZED_COLOR = (16, 185, 129)
+STRANGER_COLOR = (239, 68, 68)
+
+
+def annotate_frame(frame, detections):
+    """
+    Draws each detection's box and name onto the frame in place.
+    """
+    for detection in detections:
+        left, top, right, bottom = detection['bbox']
+        color = RECOGNIZED_COLOR if detection['is_recognized'] else STRANGER_COLOR
+
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
+        cv2.putText(
+            frame,
+            detection['name'],
+            (left + 6, bottom - 6),
+            cv2.FONT_HERSHEY_DUPLEX,
+            0.8,
+            (255, 255, 255),
+            1
+        )
+    return frame
+
+
+class FramePipeline:
+    """
+    Detection, tracking and recognition for one camera stream.
+
+    A motion gate skips the detector on frames where nothing moved, and the
+    detector only looks inside the camera's configured ROIs. The
+    recognition model only runs for tracks that are new or due for a
+    refresh, so frames where every face is already identified never touch
+    the embedding model. Faces are matched against `galleries` only,
+    every library's when none are given.
+    """
+
+    def __init__(self, camera_id='', galleries=None):
+        self.camera_id = camera_id
+        self.rois = settings.FACE_CAMERA_ROIS.get(camera_id, [])
+        self.gate = MotionGate(
+            rois=self.rois,
+            width=settings.FACE_MOTION_WIDTH,
+            pixel_threshold=settings.FACE_MOTION_PIXEL_THRESHOLD,
+            min_area=settings.FACE_MOTION_MIN_AREA,
+            force_every=settings.FACE_MOTION_FORCE_EVERY,
+        ) if settings.FACE_MOTION_GATE else None
+        self.galleries = galleries or [get_gallery()]
+        self.tracker = FaceTracker(
+            iou_threshold=settings.FACE_TRACK_IOU_THRESHOLD,
+            max_missed=settings.FACE_TRACK_MAX_MISSED,
+            recognize_every=settings.FACE_TRACK_RECOGNIZE_EVERY,
+            retry_every=settings.FACE_TRACK_RETRY_EVERY,
+            confident_score=settings.FACE_TRACK_CONFIDENT_SCORE,
+        )
+
+    def process(self, frame_rgb):
+        tracks, stale = self.track(frame_rgb)
+        if stale:
+            embed_faces(frame_rgb, [track.face for track in stale])
+            stale = [track for track in stale if track.face.embedding is not None]
+        if stale:
+            self.recognize(stale)
+        return [self.describe(track) for track in tracks]
+
+    def track(self, frame_rgb):
+        """
+        Detects and tracks the faces in a frame. Returns all tracks in the
+        frame and the subset that still needs an embedding.
+        """
+        skipped = self.gate is not None and not self.gate.should_detect(frame_rgb, has_tracks=bool(self.tracker.tracks))
+        gate_stats.record(self.camera_id, skipped)
+        faces = [] if skipped else self.detect(frame_rgb)
+        tracks = self.tracker.update(faces)
+        return tracks, [track for track in tracks if self.tracker.needs_recognition(track)]
+
+    def detect(self, frame_rgb):
+        if not self.rois:
+            return detect_faces(frame_rgb)
+
+        # Run the detector on each ROI crop and map the faces back to frame
+        # coordinates.
+        height, width = frame_rgb.shape[:2]
+        faces = []
+        for left, top, right, bottom in roi_boxes(self.rois, width, height):
+            crop = frame_rgb[top:bottom, left:right]
+            if crop.size == 0:
+                continue
+            for face in detect_faces(np.ascontiguousarray(crop)):
+                face.bbox = face.bbox + np.array([left, top, left, top], dtype=face.bbox.dtype)
+                if face.kps is not None:
+                    face.kps = face.kps + np.array([left, top], dtype=face.kps.dtype)
+                faces.append(face)
+        return faces
+
+    def recognize(self, stale):
+        matches = search_galleries(
+            self.galleries,
+            np.stack([track.face.embedding for track in stale]),
+            top_k=settings.FACE_MATCH_TOP_K,
+        )
+        self.apply_matches(stale, matches)
+
+    def apply_matches(self, stale, matches):
+        for track, candidates in zip(stale, matches):
+            self.tracker.set_candidates(track, candidates)
+
+    def track_embeddings(self):
+        """
+        Latest embedding of every live track, by track id.
+        """
+        return {track.track_id: track.embedding for track in self.tracker.tracks if track.embedding is not None}
+
+    def describe(self, track):
+        match, score = track.best_match
+        return {
+            'track_id': track.track_id,
+            'bbox': [int(v) for v in track.bbox],
+            'face_id': match['face_id'] if match else None,
+            'name': match['name'] if match else "Stranger",
+            'is_recognized': match is not None,
+            'score': round(score, 4) if score is not None else None,
+            'candidates': [
+                {'name': candidate['name'], 'score': round(candidate_score, 4)}
+                for candidate, candidate_score in track.candidates
+            ],
+        }
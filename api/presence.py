@@ -0,0 +1,153 @@
+from django.utils import timezone
+from datetime import timedelta
+import base64
+import itertools
+import threading
+import numpy as np
+import cv2
+
+from .ai_utils import normalize_rows
+
+
+class PresenceSession:
+    """
+    One visit of one identity (a profile, or a group of similar stranger
+    faces) in front of one camera.
+    """
+
+    def __init__(self, session_id, camera_id, detection, now):
+        self.session_id = session_id
+        self.camera_id = camera_id
+        self.profile_id = detection['face_id']
+        self.name = detection['name']
+        self.is_recognized = detection['is_recognized']
+        self.first_seen = now
+        self.last_seen = now
+        self.frame_count = 0
+        self.best_score = None
+        self.best_area = 0
+        self.snapshot = None
+        self.embedding = None
+
+    def add_embedding(self, embedding):
+        # Running mean of the unit embeddings seen so far, so a stranger's
+        # group matches on the whole visit rather than one pose.
+        vector = normalize_rows(embedding)[0]
+        if self.embedding is None:
+            self.embedding = vector
+        else:
+            self.embedding = normalize_rows(self.embedding * self.frame_count + vector)[0]
+
+    def to_log_entry(self):
+        name = self.name
+        return {
+            'profile_id': str(self.profile_id) if self.profile_id else None,
+            'camera_id': self.camera_id,
+            'log_message': f"Recognition successful for {name}" if self.is_recognized else "New Stranger detected",
+            'is_recognized': self.is_recognized,
+            'timestamp': self.first_seen.isoformat(),
+            'last_seen': self.last_seen.isoformat(),
+            'frame_count': self.frame_count,
+            'best_score': self.best_score,
+            'snapshot': base64.b64encode(self.snapshot).decode('utf-8') if self.snapshot is not None else None,
+        }
+
+
+class PresenceTracker:
+    """
+    Turns the per-frame detections of one camera into visits.
+
+    Recognized faces are grouped by profile and strangers by embedding
+    similarity. A visit stays open while its identity keeps appearing and
+    is closed once it has been absent for `absence_seconds`; visits shorter
+    than `min_frames` (flicker, or the frames before a track was
+    recognized) are dropped.
+    """
+
+    def __init__(self, camera_id='', absence_seconds=5.0, min_frames=3, stranger_similarity=0.45):
+        self.camera_id = camera_id
+        self.absence = timedelta(seconds=absence_seconds)
+        self.min_frames = min_frames
+        self.stranger_similarity = stranger_similarity
+        self.profiles = {}
+        self.strangers = []
+        self.track_sessions = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def observe(self, image, detections, embeddings, now=None):
+        """
+        Adds one frame's detections. `embeddings` maps track ids to their
+        latest embedding. Returns the visits closed by this frame.
+        """
+        now = now or timezone.now()
+        with self.lock:
+            # Close first, so a face back after the timeout opens a new visit.
+            closed = self._close(lambda session: now - session.last_seen > self.absence)
+            for detection in detections:
+                session = self._session_for(detection, embeddings.get(detection['track_id']), now)
+                self._update(session, image, detection, now)
+            return closed
+
+    def close_all(self):
+        with self.lock:
+            return self._close(lambda session: True)
+
+    def _session_for(self, detection, embedding, now):
+        track_id = detection['track_id']
+        if detection['is_recognized']:
+            session = self.profiles.get(detection['face_id'])
+            if session is None:
+                session = PresenceSession(next(self._ids), self.camera_id, detection, now)
+                self.profiles[detection['face_id']] = session
+            self.track_sessions[track_id] = session
+            return session
+
+        session = self.track_sessions.get(track_id)
+        if session is None or session.is_recognized:
+            session = self._similar_stranger(embedding)
+            if session is None:
+                session = PresenceSession(next(self._ids), self.camera_id, detection, now)
+                self.strangers.append(session)
+            self.track_sessions[track_id] = session
+        if embedding is not None:
+            session.add_embedding(embedding)
+        return session
+
+    def _similar_stranger(self, embedding):
+        candidates = [session for session in self.strangers if session.embedding is not None]
+        if embedding is None or not candidates:
+            return None
+        scores = np.stack([session.embedding for session in candidates]) @ normalize_rows(embedding)[0]
+        best = int(np.argmax(scores))
+        return candidates[best] if scores[best] >= self.stranger_similarity else None
+
+    def _update(self, session, image, detection, now):
+        session.last_seen = now
+        session.frame_count += 1
+        if detection['score'] is not None:
+            session.best_score = max(session.best_score or 0.0, detection['score'])
+
+        # Keep the largest (closest) view of the face as the visit's snapshot;
+        # only re-encode when a better one shows up.
+        left, top, right, bottom = detection['bbox']
+        area = max(0, right - left) * max(0, bottom - top)
+        if image is not None and area > session.best_area:
+            height, width = image.shape[:2]
+            crop = image[max(0, top):min(height, bottom), max(0, left):min(width, right)]
+            if crop.size:
+                ok, buffer = cv2.imencode('.jpeg', crop, [cv2.IMWRITE_JPEG_QUALITY, 90])
+                if ok:
+                    session.best_area = area
+                    session.snapshot = buffer.tobytes()
+
+    def _close(self, is_over):
+        closed = [s for s in itertools.chain(self.profiles.values(), self.strangers) if is_over(s)]
+        if not closed:
+            return []
+
+        closed_ids = {session.session_id for session in closed}
+        self.profiles = {key: s for key, s in self.profiles.items() if s.session_id not in closed_ids}
+        self.strangers = [s for s in self.strangers if s.session_id not in closed_ids]
+        self.track_sessions = {key: s for key, s in self.track_sessions.items() if s.session_id not in closed_ids}
+        return [session for session in closed if session.frame_count >= self.min_frames]
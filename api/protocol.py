@@ -0,0 +1,64 @@
+"""
+Binary frame protocol for `ws/ai/stream/`.
+
+Every binary WebSocket message, in both directions, is a fixed header
+followed by three variable parts:
+
+    offset  size  field
+    0       1     protocol version (PROTOCOL_VERSION)
+    1       1     kind (KIND_FRAME from the client, KIND_RESULT from the server)
+    2       4     sequence number, echoed back in the result
+    6       2     camera id length (n)
+    8       4     metadata length (m)
+    12      n     camera id, UTF-8
+    12+n    m     metadata, UTF-8 JSON (empty in client frames)
+    12+n+m  ...   JPEG bytes
+
+All integers are unsigned big-endian.
+"""
+import json
+import struct
+
+PROTOCOL_VERSION = 1
+KIND_FRAME = 1
+KIND_RESULT = 2
+
+HEADER = struct.Struct('!BBIHI')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def decode_message(data):
+    """
+    Returns (kind, seq, camera_id, metadata, jpeg) from a binary message.
+    The JPEG is a memoryview into `data`, so no copy is made.
+    """
+    if len(data) < HEADER.size:
+        raise ProtocolError("Message shorter than the frame header.")
+
+    version, kind, seq, camera_len, meta_len = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}.")
+
+    view = memoryview(data)
+    camera_end = HEADER.size + camera_len
+    meta_end = camera_end + meta_len
+    if meta_end > len(data):
+        raise ProtocolError("Header lengths exceed the message size.")
+
+    camera_id = bytes(view[HEADER.size:camera_end]).decode('utf-8')
+    metadata = json.loads(bytes(view[camera_end:meta_end])) if meta_len else {}
+    return kind, seq, camera_id, metadata, view[meta_end:]
+
+
+def encode_message(kind, seq, camera_id, metadata=None, jpeg=b''):
+    camera = camera_id.encode('utf-8')
+    meta = json.dumps(metadata).encode('utf-8') if metadata is not None else b''
+    return b''.join((
+        HEADER.pack(PROTOCOL_VERSION, kind, seq, len(camera), len(meta)),
+        camera,
+        meta,
+        jpeg,
+    ))
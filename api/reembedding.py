@@ -0,0 +1,282 @@
+"""
+Streaming re-embedding of every registered profile with another model tier.
+
+Profiles are read in face_id order, one keyset chunk at a time, so a run
+over a large gallery never holds more than a chunk in memory. The images of
+a chunk are read and decoded in a thread pool, faces are detected one image
+at a time and the recognition model embeds the whole chunk in one batch.
+New rows are stored under the target tier's model tag, next to the
+current ones, so the live gallery is untouched while the run goes on.
+
+Progress is checkpointed in Redis after every chunk: an interrupted run
+resumes after the last finished face_id. Profiles enrolled during the run
+may sort below the checkpoint, so once the keyset is exhausted a sweep
+embeds every registered profile still missing a row for the target model.
+The run then switches the active tier and publishes one reload, so all
+workers move to the new model and its gallery together.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+import logging
+import os
+import time
+import numpy as np
+import cv2
+
+from .ai_utils import ACTIVE_TIER_KEY, detect_faces, embed_face_batch, load_face_app, use_model_tier
+from .embedding_cache import get_embedding_cache
+from .embeddings import build_face_embeddings, replace_face_embeddings
+from .gallery import export_gallery_snapshot, get_redis, make_reload_delta, publish_gallery_delta
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'face_model:reembed:{tier}:checkpoint'
+# Held while a run is going on and refreshed after every chunk; a run whose
+# worker died can be resumed once it expires.
+RUNNING_KEY = 'face_model:reembed:{tier}:running'
+RUNNING_TTL = 600
+COUNTERS = ('processed', 'embedded', 'failed', 'cached', 'swept')
+
+
+class ReembedRun:
+    """
+    One resumable re-embedding run towards `tier`, with its checkpoint.
+    """
+
+    def __init__(self, tier, chunk_size=None, threads=None):
+        if tier not in settings.FACE_MODEL_TIERS:
+            raise ValueError(f"Unknown model tier {tier!r}.")
+        self.tier = tier
+        self.model_name = settings.FACE_MODEL_TIERS[tier]['EMBEDDING_MODEL']
+        self.chunk_size = chunk_size or settings.FACE_REEMBED_CHUNK_SIZE
+        self.threads = threads or settings.FACE_REEMBED_DECODE_THREADS
+        self.key = CHECKPOINT_KEY.format(tier=tier)
+        self.running_key = RUNNING_KEY.format(tier=tier)
+        self._app = None
+
+    @property
+    def app(self):
+        # The target tier's model, loaded next to whatever this process serves.
+        if self._app is None:
+            self._app = load_face_app(self.tier)
+        return self._app
+
+    def checkpoint(self):
+        """
+        The run's progress: last_face_id, the counters, seconds spent in
+        chunks and whether the run finished.
+        """
+        raw = {k.decode(): v.decode() for k, v in get_redis().hgetall(self.key).items()}
+        checkpoint = {name: int(raw.get(name, 0)) for name in COUNTERS}
+        checkpoint.update({
+            'tier': self.tier,
+            'model_name': self.model_name,
+            'last_face_id': raw.get('last_face_id', ''),
+            'sweeping': raw.get('sweeping') == '1',
+            'sweep_after': raw.get('sweep_after', ''),
+            'seconds': float(raw.get('seconds', 0)),
+            'finished': raw.get('finished') == '1',
+        })
+        return checkpoint
+
+    def start(self, restart=False):
+        """
+        Claims the run. A finished (or, with `restart`, any) checkpoint is
+        cleared first; otherwise the run resumes where it stopped. Returns
+        False if another run towards this tier holds the claim.
+        """
+        client = get_redis()
+        if not client.set(self.running_key, 1, nx=True, ex=RUNNING_TTL):
+            return False
+        if restart or self.checkpoint()['finished']:
+            client.delete(self.key)
+        return True
+
+    def release(self):
+        get_redis().delete(self.running_key)
+
+    def is_running(self):
+        return bool(get_redis().exists(self.running_key))
+
+    def registered_after(self, after):
+        from .models import FaceProfile
+
+        profiles = FaceProfile.objects.filter(is_registered=True).order_by('face_id')
+        return profiles.filter(face_id__gt=after) if after else profiles
+
+    def next_chunk(self, after):
+        return list(self.registered_after(after)[:self.chunk_size])
+
+    def missing_chunk(self, after):
+        """
+        The next registered profiles, in face_id order, that have no row for
+        the target model yet.
+        """
+        from .models import FaceEmbedding
+
+        embedded = FaceEmbedding.objects.filter(model_name=self.model_name).values('profile_id')
+        return list(self.registered_after(after).exclude(face_id__in=embedded)[:self.chunk_size])
+
+    def run_chunk(self):
+        """
+        Embeds the chunk after the checkpoint and advances it. Returns the
+        chunk's counts, or None when no profiles are left.
+        """
+        started = time.perf_counter()
+        checkpoint = self.checkpoint()
+        sweeping = checkpoint['sweeping']
+        if sweeping:
+            profiles = self.missing_chunk(checkpoint['sweep_after'])
+        else:
+            profiles = self.next_chunk(checkpoint['last_face_id'])
+            if not profiles:
+                get_redis().hset(self.key, 'sweeping', 1)
+                sweeping = True
+                profiles = self.missing_chunk('')
+        if not profiles:
+            return None
+
+        counts, embedded, rows = self.embed(profiles)
+        with transaction.atomic():
+            replace_face_embeddings(embedded, rows, model_name=self.model_name)
+        if sweeping:
+            # Profiles without a face were already counted by the keyset.
+            counts['swept'], counts['processed'], counts['failed'] = counts['processed'], 0, 0
+
+        pipe = get_redis().pipeline()
+        for name in COUNTERS:
+            pipe.hincrby(self.key, name, counts[name])
+        pipe.hincrbyfloat(self.key, 'seconds', time.perf_counter() - started)
+        pipe.hset(self.key, 'sweep_after' if sweeping else 'last_face_id', str(profiles[-1].face_id))
+        pipe.expire(self.running_key, RUNNING_TTL)
+        pipe.execute()
+        return counts
+
+    def embed(self, profiles):
+        """
+        Returns (counts, profiles with a face, their unsaved FaceEmbedding
+        rows) for one chunk.
+        """
+        cache = get_embedding_cache()
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            images = list(pool.map(lambda profile: self.read_image(profile, cache), profiles))
+
+        counts = dict.fromkeys(COUNTERS, 0)
+        counts['processed'] = len(profiles)
+        found, batch = {}, []
+        for profile, key, image, cached in images:
+            if cached is not None:
+                counts['cached'] += 1
+                found[profile.pk] = list(cached)
+            elif image is not None:
+                # Faces without landmarks cannot be embedded.
+                faces = [face for face in detect_faces(image, app=self.app) if face.kps is not None]
+                found[profile.pk] = faces
+                batch.extend((image, face) for face in faces)
+
+        # One recognition run for every face in the chunk.
+        embed_face_batch(batch, app=self.app)
+
+        embedded, rows = [], []
+        for profile, key, image, cached in images:
+            faces = found.get(profile.pk)
+            if cached is None and faces is not None and cache:
+                try:
+                    cache.put(
+                        key, self.model_name, [face.embedding for face in faces],
+                        [face.bbox for face in faces], [face.det_score for face in faces],
+                    )
+                except Exception:
+                    logger.exception("Writing the embedding cache failed.", extra={'profile_id': str(profile.pk)})
+            if cached is None and faces:
+                faces = [face.embedding for face in faces]
+            if not faces:
+                counts['failed'] += 1
+                continue
+            embedded.append(profile)
+            rows.extend(build_face_embeddings(profile, faces, model_name=self.model_name))
+        counts['embedded'] = len(embedded)
+        return counts, embedded, rows
+
+    def read_image(self, profile, cache):
+        """
+        Reads one profile image. Returns (profile, cache key, RGB image,
+        cached embeddings); the image is None on a cache hit or when it
+        cannot be read.
+        """
+        try:
+            with open(os.path.join(settings.MEDIA_ROOT, profile.face_image.name), 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot read image of %s: %s", profile.name, e, extra={'profile_id': str(profile.pk)})
+            return profile, None, None, None
+
+        key = cache.key(data) if cache else None
+        cached = None
+        if cache:
+            try:
+                cached = cache.get(key, self.model_name)
+            except Exception:
+                logger.exception("Reading the embedding cache failed.", extra={'profile_id': str(profile.pk)})
+        if cached is not None:
+            return profile, key, None, cached[0]
+
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            logger.warning("Cannot decode image of %s.", profile.name, extra={'profile_id': str(profile.pk)})
+            return profile, key, None, None
+        return profile, key, cv2.cvtColor(image, cv2.COLOR_BGR2RGB), None
+
+    def finish(self, switch=True):
+        """
+        Marks the run finished and, with `switch`, makes its tier the active
+        one: every worker reloads its gallery from the new rows in one step.
+        """
+        client = get_redis()
+        client.hset(self.key, 'finished', 1)
+        self.release()
+        if not switch:
+            return
+        client.set(ACTIVE_TIER_KEY, self.tier)
+        use_model_tier(self.tier)
+        checkpoint = self.checkpoint()
+        publish_gallery_delta(
+            make_reload_delta(model_tier=self.tier),
+            f"{checkpoint['embedded']} profiles re-embedded with {self.model_name}. Switching AI library.",
+        )
+        export_gallery_snapshot()
+
+        # Enrollments after the sweep, or on workers that have not noticed
+        # the switch yet, were embedded with the old tier. Pick them up once
+        # every worker has.
+        from .tasks import reembed_stale_profiles_task
+        reembed_stale_profiles_task.apply_async(countdown=settings.FACE_MODEL_TIER_REFRESH_SECONDS * 2)
+
+
+_runs = {}
+
+
+def get_reembed_run(tier, chunk_size=None, threads=None):
+    """
+    The process-wide run towards `tier`, so consecutive chunks handled by
+    one worker load the target model once.
+    """
+    if tier not in _runs:
+        _runs[tier] = ReembedRun(tier)
+    run = _runs[tier]
+    run.chunk_size = chunk_size or settings.FACE_REEMBED_CHUNK_SIZE
+    run.threads = threads or settings.FACE_REEMBED_DECODE_THREADS
+    return run
+
+
+def format_report(checkpoint):
+    """
+    One-line throughput summary of a checkpoint.
+    """
+    rate = checkpoint['processed'] / checkpoint['seconds'] if checkpoint['seconds'] else 0.0
+    return (
+        f"{checkpoint['model_name']}: processed {checkpoint['processed']}, embedded {checkpoint['embedded']}, "
+        f"no face {checkpoint['failed']}, from cache {checkpoint['cached']}, swept {checkpoint['swept']}, "
+        f"{checkpoint['seconds']:.1f} s, {rate:.1f} profiles/s"
+    )
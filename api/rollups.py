@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+import logging
+import redis
+
+logger = logging.getLogger(__name__)
+
+# pg advisory lock key so overlapping beat runs never count a log twice.
+ROLLUP_LOCK_ID = 0x616363657373
+# "<highest log id>:<unix time it was seen>", see settled_log_id().
+ROLLUP_CEILING_KEY = 'face_access_log:rollup_ceiling'
+
+
+def settled_log_id():
+    """
+    The highest log id that is safe to fold in. Concurrent bulk inserts
+    commit out of id order, so below the highest id visible now, lower ids
+    may still be committing. Each run stores the highest id it sees and
+    the next run, at least FACE_ACCESS_LOG_ROLLUP_LAG_SECONDS later, only
+    goes up to that one: every insert that had taken an id by then has
+    committed since. Returns None when there is no such observation yet.
+    """
+    from .gallery import get_redis
+    from .models import AccessLog
+
+    now = timezone.now().timestamp()
+    try:
+        client = get_redis()
+        stored = client.get(ROLLUP_CEILING_KEY)
+        if stored:
+            ceiling, seen_at = stored.decode().split(':')
+            if now - float(seen_at) < settings.FACE_ACCESS_LOG_ROLLUP_LAG_SECONDS:
+                return None
+        latest = AccessLog.objects.aggregate(last=Max('id'))['last'] or 0
+        client.set(ROLLUP_CEILING_KEY, f"{latest}:{now}")
+    except redis.RedisError as e:
+        logger.warning("Access log rollup skipped, Redis is unavailable: %s", e)
+        return None
+    return int(ceiling) if stored else None
+
+
+def update_access_log_rollup():
+    """
+    Folds the access logs written since the last run into AccessLogRollup.
+
+    Logs are picked up by id rather than timestamp, because buffered visit
+    logs arrive after the time they record. Each rollup row remembers the
+    highest log id it includes, which is also the watermark for the next
+    run, so the counts and the watermark commit together. Logs newer than
+    settled_log_id() wait for the next run, so a log whose insert commits
+    late is never skipped by the watermark.
+    """
+    from .models import AccessLog, AccessLogRollup
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [ROLLUP_LOCK_ID])
+            if not cursor.fetchone()[0]:
+                return 0
+
+        last_id = AccessLogRollup.objects.aggregate(last=Max('last_log_id'))['last'] or 0
+        ceiling = settled_log_id()
+        if ceiling is None or ceiling <= last_id:
+            return 0
+        groups = (
+            AccessLog.objects.filter(id__gt=last_id, id__lte=ceiling)
+            .annotate(day=TruncDate('timestamp'), hour=ExtractHour('timestamp'))
+            .values('day', 'hour', 'profile_id', 'is_recognized')
+            .annotate(visits=Count('id'), frames=Sum('frame_count'), last_log_id=Max('id'))
+            .order_by()
+        )
+
+        for group in groups:
+            key = {
+                'day': group['day'],
+                'hour': group['hour'],
+                'profile_id': group['profile_id'],
+                'is_recognized': group['is_recognized'],
+            }
+            rollup_id = AccessLogRollup.objects.filter(**key).values_list('pk', flat=True).first()
+            if rollup_id is None:
+                AccessLogRollup.objects.create(
+                    **key, visits=group['visits'], frames=group['frames'], last_log_id=group['last_log_id']
+                )
+            else:
+                AccessLogRollup.objects.filter(pk=rollup_id).update(
+                    visits=F('visits') + group['visits'],
+                    frames=F('frames') + group['frames'],
+                    last_log_id=group['last_log_id'],
+                )
+        return len(groups)
+
+
+def visits_on(day):
+    """
+    Number of visits on a local day: the rollup, plus the few logs written
+    since its last run.
+    """
+    from .models import AccessLog, AccessLogRollup
+
+    rolled_up = AccessLogRollup.objects.filter(day=day).aggregate(visits=Sum('visits'))['visits'] or 0
+    last_id = AccessLogRollup.objects.aggregate(last=Max('last_log_id'))['last'] or 0
+    day_start = timezone.make_aware(datetime.combine(day, time.min))
+    pending = AccessLog.objects.filter(
+        id__gt=last_id, timestamp__gte=day_start, timestamp__lt=day_start + timedelta(days=1)
+    ).count()
+    return rolled_up + pending
@@ -0,0 +1,237 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+import glob
+import logging
+import os
+import re
+import numpy as np
+
+from .ai_utils import current_embedding_model, match_embeddings, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+class ExactIndex:
+    """
+    Brute-force search over the whole gallery matrix. Holds no state, so
+    the row hooks are no-ops.
+    """
+
+    def __init__(self, model_name=None):
+        self.model_name = model_name
+
+    def build(self, matrix, ids):
+        pass
+
+    def set_row(self, row, vector):
+        pass
+
+    def move_row(self, src, dst):
+        pass
+
+    def save(self, ids):
+        pass
+
+    def search(self, matrix, thresholds, query_embeddings, top_k=1):
+        return match_embeddings(query_embeddings, matrix, thresholds, top_k=top_k)
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index: gallery rows are bucketed by their nearest k-means
+    centroid, and a query is only scored against the rows of its `nprobe`
+    nearest buckets.
+
+    Centroids and row assignments are saved to `path`, so a restarted
+    worker reuses them instead of re-training. The file records the
+    embedding model it was trained on and a signature of every row, so it
+    is ignored after a model switch, and rows whose vector changed since
+    it was saved are assigned again. Galleries smaller than
+    `min_train_size` are searched exactly.
+    """
+
+    def __init__(self, nlist=1024, nprobe=16, path=None, min_train_size=None, train_iterations=10, model_name=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.path = path
+        self.min_train_size = min_train_size or nlist * 8
+        self.train_iterations = train_iterations
+        self.model_name = model_name
+        self.centroids = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._order = None
+        self._offsets = None
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def build(self, matrix, ids):
+        self._size = matrix.shape[0]
+        self._assign = np.full(max(16, self._size), -1, dtype=np.int32)
+        self._order = None
+
+        stored = self._load(matrix.shape[1])
+        if stored is not None:
+            centroids, stored_ids, stored_assign, stored_signatures = stored
+            self.centroids = centroids
+            known = {face_id: row for row, face_id in enumerate(stored_ids)}
+            rows = np.asarray([known.get(face_id, -1) for face_id in ids], dtype=np.int64)
+            self._assign[:self._size] = np.where(rows >= 0, stored_assign[rows], -1)
+            # Rows enrolled, or re-embedded, since the file was saved.
+            changed = (rows >= 0) & ~np.isclose(stored_signatures[rows], self._signatures(matrix), atol=1e-5)
+            missing = np.flatnonzero((self._assign[:self._size] == -1) | changed)
+            if missing.size:
+                self._assign[missing] = self._nearest(matrix[missing])
+                self.save(ids, matrix)
+            logger.info("Loaded IVF index (%d lists, %d rows assigned again).", len(self.centroids), missing.size)
+            return
+
+        if self._size < self.min_train_size:
+            self.centroids = None
+            return
+
+        self.centroids = self._train(matrix)
+        self._assign[:self._size] = self._nearest(matrix)
+        self.save(ids, matrix)
+        logger.info("Trained IVF index with %d lists on %d rows.", len(self.centroids), self._size)
+
+    def set_row(self, row, vector):
+        if row >= self._assign.shape[0]:
+            self._assign = np.resize(self._assign, max(16, row * 2))
+        self._size = max(self._size, row + 1)
+        if self.trained:
+            self._assign[row] = self._nearest(vector[None, :])[0]
+        self._order = None
+
+    def move_row(self, src, dst):
+        if dst != src:
+            self._assign[dst] = self._assign[src]
+        self._size = src
+        self._order = None
+
+    def save(self, ids, matrix):
+        if not self.trained or not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            ids=np.asarray(ids[:self._size]),
+            assign=self._assign[:self._size],
+            signatures=self._signatures(matrix[:self._size]),
+            model=np.asarray(self.model_name or ''),
+        )
+        os.replace(tmp_path, self.path)
+
+    def search(self, matrix, thresholds, query_embeddings, top_k=1):
+        if not self.trained:
+            return match_embeddings(query_embeddings, matrix, thresholds, top_k=top_k)
+
+        if self._order is None:
+            assign = self._assign[:self._size]
+            self._order = np.argsort(assign, kind='stable')
+            self._offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))))
+
+        queries = normalize_rows(query_embeddings)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        width = min(top_k, matrix.shape[0])
+        indices = np.full((queries.shape[0], width), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], width), -1.0, dtype=np.float32)
+        thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float32), (matrix.shape[0],))
+
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([self._order[self._offsets[i]:self._offsets[i + 1]] for i in lists])
+            if rows.size == 0:
+                continue
+            found, found_scores = match_embeddings(queries[q:q + 1], matrix[rows], thresholds[rows], top_k=top_k)
+            n = found.shape[1]
+            indices[q, :n] = np.where(found[0] == -1, -1, rows[found[0]])
+            scores[q, :n] = found_scores[0]
+        return indices, scores
+
+    def _signatures(self, matrix):
+        # One number per row: its projection on a fixed random direction.
+        # Any change of the vector changes it, and it costs one matrix-vector
+        # product instead of scoring every row against every centroid.
+        probe = np.random.default_rng(12345).normal(size=matrix.shape[1]).astype(np.float32)
+        return matrix @ probe
+
+    def _nearest(self, vectors, chunk_size=65536):
+        nearest = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = vectors[start:start + chunk_size]
+            nearest[start:start + chunk_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return nearest
+
+    def _train(self, matrix):
+        # Spherical k-means on a sample: rows are unit vectors, so the
+        # nearest centroid is the one with the largest dot product.
+        rng = np.random.default_rng(0)
+        nlist = min(self.nlist, matrix.shape[0])
+        sample_size = min(matrix.shape[0], nlist * 64)
+        sample = matrix[rng.choice(matrix.shape[0], sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            self.centroids = centroids
+            labels = self._nearest(sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _load(self, dim):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path) as data:
+                centroids = data['centroids']
+                if centroids.shape[1] != dim or str(data['model']) != (self.model_name or ''):
+                    logger.info("Search index %s belongs to another model, re-training.", self.path)
+                    return None
+                return centroids, data['ids'].tolist(), data['assign'], data['signatures']
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("Cannot read search index %s: %s", self.path, e)
+            return None
+
+
+def search_index_path(model_name, name=None):
+    """
+    Where the index of `model_name` is saved: FACE_SEARCH_INDEX's PATH with
+    the model, and the shard `name` if any, added to the file name.
+    """
+    root, ext = os.path.splitext(str(settings.FACE_SEARCH_INDEX['PATH']))
+    suffix = re.sub(r'[^\w.-]', '_', model_name) + (f"-{name}" if name else '')
+    return f"{root}-{suffix}{ext}"
+
+
+def search_index_files(model_name):
+    """
+    Saved index files of `model_name`, the global one and every shard's.
+    """
+    if not settings.FACE_SEARCH_INDEX.get('PATH'):
+        return []
+    path = search_index_path(model_name)
+    root, ext = os.path.splitext(path)
+    return [file for file in [path, *glob.glob(f"{glob.escape(root)}-*{ext}")] if os.path.exists(file)]
+
+
+def get_search_index(name=None):
+    """
+    A new index from FACE_SEARCH_INDEX for the current embedding model.
+    Indexes of gallery shards pass a `name`, which is added to the saved
+    file's name.
+    """
+    config = dict(settings.FACE_SEARCH_INDEX)
+    config['MODEL_NAME'] = current_embedding_model()
+    if config.get('PATH'):
+        config['PATH'] = search_index_path(config['MODEL_NAME'], name)
+    backend = import_string(config.pop('BACKEND'))
+    return backend(**{key.lower(): value for key, value in config.items()})
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import FaceLibrary, FaceProfile, AccessLog
+from .models import FaceLibrary, FaceProfile, AccessLog, EnrollmentJob
 
 class FaceLibrarySerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,4 +18,18 @@ class FaceProfileSerializer(serializers.ModelSerializer):
 class AccessLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = AccessLog
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class EnrollmentJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = EnrollmentJob
+        fields = (
+            'id', 'library', 'archive', 'mapping', 'status', 'total', 'processed',
+            'registered', 'failed', 'progress', 'error', 'created_at', 'finished_at',
+        )
+        read_only_fields = (
+            'status', 'total', 'processed', 'registered', 'failed', 'error', 'created_at', 'finished_at',
+        )
+        extra_kwargs = {'archive': {'required': True, 'allow_null': False}}
@@ -0,0 +1,80 @@
+"""
+Weight-free stand-in for InsightFace's FaceAnalysis, for benchmarks and
+load tests on machines without the model packs.
+
+The detector reports `faces` boxes at fixed places in every frame, and the
+recognizer projects a downsampled crop onto 512 dimensions with a fixed
+random matrix. Both have the same interface and return the same shapes as
+the real models, so the rest of the frame path (decode, motion gate,
+tracking, alignment, matching, drawing, encoding) runs unchanged. Their
+accuracy and cost are not those of the real models.
+"""
+import numpy as np
+import cv2
+
+# ArcFace's 5-point template for a 112x112 crop, as fractions of the box.
+LANDMARKS = np.array([
+    [38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041],
+], dtype=np.float32) / 112
+
+
+class StubSession:
+    def get_providers(self):
+        return ['StubExecutionProvider']
+
+
+class StubDetector:
+    def __init__(self, faces=1):
+        self.faces = faces
+        self.session = StubSession()
+
+    def detect(self, image, max_num=0, metric='default'):
+        height, width = image.shape[:2]
+        count = min(self.faces, max_num) if max_num else self.faces
+        size = min(height, width) / 4
+        bboxes = np.zeros((count, 5), dtype=np.float32)
+        kpss = np.zeros((count, 5, 2), dtype=np.float32)
+        for i in range(count):
+            left = (i + 1) * width / (count + 1) - size / 2
+            top = height / 3 - size / 2
+            bboxes[i] = [left, top, left + size, top + size, 0.99]
+            kpss[i] = LANDMARKS * size + [left, top]
+        return bboxes, kpss
+
+
+class StubRecognizer:
+    input_size = (112, 112)
+
+    def __init__(self, dim=512, seed=0):
+        self.projection = np.random.default_rng(seed).normal(size=(16 * 16 * 3, dim)).astype(np.float32)
+
+    def get_feat(self, crops):
+        if not isinstance(crops, list):
+            crops = [crops]
+        pixels = np.stack([
+            cv2.resize(crop, (16, 16), interpolation=cv2.INTER_AREA).reshape(-1) for crop in crops
+        ]).astype(np.float32) / 255 - 0.5
+        return pixels @ self.projection
+
+
+class StubFaceApp:
+    """
+    FaceAnalysis look-alike: `det_model`, `models` and `get()`.
+    """
+
+    def __init__(self, faces=1, dim=512):
+        self.det_model = StubDetector(faces)
+        self.models = {'detection': self.det_model, 'recognition': StubRecognizer(dim)}
+
+    def get(self, image, max_num=0):
+        from insightface.app.common import Face
+        from insightface.utils import face_align
+
+        bboxes, kpss = self.det_model.detect(image, max_num=max_num)
+        faces = [Face(bbox=bboxes[i, 0:4], kps=kpss[i], det_score=bboxes[i, 4]) for i in range(bboxes.shape[0])]
+        recognizer = self.models['recognition']
+        crops = [face_align.norm_crop(image, landmark=face.kps, image_size=recognizer.input_size[0]) for face in faces]
+        if crops:
+            for face, embedding in zip(faces, recognizer.get_feat(crops)):
+                face.embedding = embedding
+        return faces
@@ -1,13 +1,22 @@
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
 from django.utils import timezone
 
 from celery import shared_task
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from datetime import timedelta
+from datetime import datetime, timedelta
+import base64
+import logging
+import uuid
 
-from .ai_utils import get_face_embedding
+from .ai_utils import current_embedding_model, get_face_embedding
+from .embeddings import build_face_embeddings, replace_face_embeddings
+from .gallery import export_gallery_snapshot, make_gallery_delta, make_reload_delta, publish_gallery_delta
 from face_ai.celery import app
 
+logger = logging.getLogger(__name__)
+
 
 @app.task
 def calculate_embedding_task(profile_id):
@@ -22,68 +31,443 @@ def calculate_embedding_task(profile_id):
     try:
         profile = FaceProfile.objects.get(face_id=profile_id) 
     except FaceProfile.DoesNotExist:
-        print(f"Celery Error: Profile with ID {profile_id} not found.")
+        logger.error("Profile %s not found.", profile_id, extra={'profile_id': str(profile_id)})
         return
 
     embedding_list = get_face_embedding(profile.face_image.name)
     
     if embedding_list:
-        profile.face_embedding = embedding_list
+        op = 'update' if profile.is_registered else 'add'
+        with transaction.atomic():
+            replace_face_embeddings([profile], build_face_embeddings(profile, embedding_list))
+            profile.is_registered = True
+            profile.save(update_fields=['is_registered'])
+        logger.info("Embedding saved for %s.", profile.name, extra={'profile_id': str(profile.pk)})
+
+        publish_gallery_delta(
+            make_gallery_delta(op, profile, embedding_list[0]),
+            f"New profile {profile.name} saved. Updating AI library.",
+        )
+    else:
+        logger.warning("No face detected in the image of %s.", profile.name, extra={'profile_id': str(profile.pk)})
+
+
+def embed_profiles(profiles):
+    """
+    Runs the current model over each profile's image.
+
+    Returns:
+        tuple: (profiles with a detected face, their unsaved FaceEmbedding rows).
+    """
+    embedded, rows = [], []
+    for profile in profiles:
+        embedding_list = get_face_embedding(profile.face_image.name)
+        if embedding_list:
+            embedded.append(profile)
+            rows.extend(build_face_embeddings(profile, embedding_list))
+    return embedded, rows
+
+
+@app.task
+def prepare_enrollment_task(job_id):
+    """
+    Celery task that unpacks an uploaded enrollment job and starts its
+    chunked embedding workflow.
+
+    Args:
+        job_id (int): The primary key of the EnrollmentJob.
+    """
+    from .enrollment import prepare_enrollment
+    from .models import EnrollmentJob
+
+    job = EnrollmentJob.objects.get(pk=job_id)
+    try:
+        prepare_enrollment(job)
+    except Exception as e:
+        EnrollmentJob.objects.filter(pk=job_id).update(
+            status=EnrollmentJob.STATUS_FAILED, error=str(e), finished_at=timezone.now()
+        )
+        logger.exception("Enrollment #%s failed.", job_id, extra={'job_id': job_id})
+
+
+@app.task
+def bulk_embed_chunk_task(job_id, profile_ids):
+    """
+    Celery task that computes embeddings for one chunk of a bulk enrollment
+    and writes them back with a single bulk_update. No gallery event is
+    sent per profile; `finish_enrollment_task` sends one for the whole job.
+
+    Args:
+        job_id (int): The primary key of the EnrollmentJob.
+        profile_ids (list[str]): face_ids of the profiles in this chunk.
+
+    Returns:
+        int: Number of profiles registered in this chunk.
+    """
+    from django.db.models import F
+    from .models import EnrollmentJob, FaceProfile
+
+    registered, embeddings = embed_profiles(FaceProfile.objects.filter(face_id__in=profile_ids))
+    for profile in registered:
         profile.is_registered = True
-        profile.save(update_fields=['face_embedding', 'is_registered'])
-        print(f"Celery Success: Embedding calculated and saved for {profile.name}.")
-
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "face_stream_group", 
-            {
-                "type": "reload_ai_library",
-                "message": f"New profile {profile.name} saved. Reloading AI models.",
-            }
+
+    with transaction.atomic():
+        replace_face_embeddings(registered, embeddings)
+        FaceProfile.objects.bulk_update(registered, ['is_registered'])
+    EnrollmentJob.objects.filter(pk=job_id).update(
+        processed=F('processed') + len(profile_ids),
+        registered=F('registered') + len(registered),
+        failed=F('failed') + len(profile_ids) - len(registered),
+    )
+    logger.info(
+        "Enrollment #%s chunk done, %d/%d registered.", job_id, len(registered), len(profile_ids),
+        extra={'job_id': job_id, 'registered': len(registered), 'profiles': len(profile_ids)},
+    )
+    return len(registered)
+
+
+@app.task
+def finish_enrollment_task(chunk_results, job_id):
+    """
+    Chord callback of a bulk enrollment: marks the job done and sends one
+    coalesced gallery update for all of its profiles.
+
+    Args:
+        chunk_results (list[int]): Registered counts returned by the chunks.
+        job_id (int): The primary key of the EnrollmentJob.
+    """
+    from .models import EnrollmentJob
+
+    job = EnrollmentJob.objects.get(pk=job_id)
+    job.status = EnrollmentJob.STATUS_DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+
+    if sum(chunk_results):
+        publish_gallery_delta(
+            make_reload_delta(),
+            f"Bulk enrollment #{job.pk}: {job.registered} profiles added to {job.library.name}. Updating AI library.",
+        )
+        export_gallery_snapshot()
+    logger.info(
+        "Enrollment #%s finished (%d/%d registered).", job_id, job.registered, job.total,
+        extra={'job_id': job_id, 'registered': job.registered, 'profiles': job.total},
+    )
+
+
+@app.task
+def fail_enrollment_task(request, exc, traceback, job_id):
+    """
+    Error callback of a bulk enrollment's chord: marks the job failed with
+    the error. Profiles registered by the chunks that did finish are still
+    added to the gallery.
+
+    Args:
+        request: The request of the task that failed.
+        exc (Exception): The exception it raised.
+        traceback (str): Its traceback.
+        job_id (int): The primary key of the EnrollmentJob.
+    """
+    from .models import EnrollmentJob
+
+    EnrollmentJob.objects.filter(pk=job_id).update(
+        status=EnrollmentJob.STATUS_FAILED, error=str(exc), finished_at=timezone.now()
+    )
+    job = EnrollmentJob.objects.get(pk=job_id)
+    logger.error(
+        "Enrollment #%s failed: %s", job_id, exc,
+        extra={'job_id': job_id, 'task_id': getattr(request, 'id', None), 'registered': job.registered},
+    )
+    if job.registered:
+        publish_gallery_delta(
+            make_reload_delta(),
+            f"Bulk enrollment #{job.pk}: {job.registered} profiles added to {job.library.name} before it failed. Updating AI library.",
+        )
+        export_gallery_snapshot()
+
+
+@app.task
+def sync_model_tier_task():
+    """
+    Celery task sent by every worker on startup. When FACE_MODEL_TIER names
+    another tier than the one being served, it starts a streaming
+    re-embedding run towards it; every process keeps serving the current
+    tier until the run switches. Otherwise it re-embeds the profiles that
+    only have another tier's embedding.
+
+    The first time tiers are tracked in Redis, the served tier is pinned to
+    the one most stored embeddings belong to, so a FACE_MODEL_TIER changed
+    at the same time still goes through a run.
+
+    Returns:
+        str: What was started, if anything.
+    """
+    from django.db.models import Count
+    from .ai_utils import ACTIVE_TIER_KEY, read_active_tier
+    from .gallery import get_redis
+    from .models import FaceEmbedding
+    from .reembedding import ReembedRun
+
+    if settings.FACE_MODEL_STUB:
+        return "Tier sync: skipped with the stub model."
+
+    client = get_redis()
+    if not client.exists(ACTIVE_TIER_KEY):
+        tiers = {config['EMBEDDING_MODEL']: tier for tier, config in settings.FACE_MODEL_TIERS.items()}
+        counts = (
+            FaceEmbedding.objects.filter(model_name__in=list(tiers), face_index=0)
+            .values('model_name').annotate(rows=Count('id')).order_by('-rows')
+        )
+        stored = next((tiers[row['model_name']] for row in counts), settings.FACE_MODEL_TIER)
+        client.set(ACTIVE_TIER_KEY, stored, nx=True)
+
+    active, configured = read_active_tier(), settings.FACE_MODEL_TIER
+    if active == configured:
+        return reembed_stale_profiles_task()
+
+    run = ReembedRun(configured)
+    if not run.start():
+        return f"Tier sync: a run towards {configured} is already going on."
+    logger.info(
+        "FACE_MODEL_TIER is %s, serving %s until every profile is re-embedded.", configured, active,
+        extra={'tier': configured, 'active_tier': active},
+    )
+    reembed_profiles_task.delay(configured)
+    return f"Tier sync: re-embedding towards {configured}."
+
+
+@app.task
+def reembed_stale_profiles_task():
+    """
+    Celery task that re-embeds every registered profile that has another
+    model's embedding but none for the current model, e.g. profiles
+    enrolled with the old tier while a switch was going on. Profiles in
+    which no model found a face are left alone. A Redis lock keeps workers
+    starting together from dispatching the work twice.
+    """
+    from celery import chord
+    from .gallery import get_redis
+    from .models import FaceEmbedding, FaceProfile
+
+    model_name = current_embedding_model()
+    current = FaceEmbedding.objects.filter(model_name=model_name).values('profile_id')
+    other = FaceEmbedding.objects.exclude(model_name=model_name).values('profile_id')
+    stale = list(
+        FaceProfile.objects.filter(is_registered=True, face_id__in=other).exclude(face_id__in=current)
+        .values_list('face_id', flat=True)
+    )
+    if not stale:
+        return "Re-embed: every profile has a current embedding."
+    if not get_redis().set(f"face_model:reembed:{model_name}", 1, nx=True, ex=3600):
+        return "Re-embed: already running."
+
+    logger.info("Re-embedding %d profiles with %s.", len(stale), model_name, extra={'model_name': model_name})
+    chunk_size = settings.FACE_ENROLLMENT_CHUNK_SIZE
+    profile_ids = [str(face_id) for face_id in stale]
+    chord(
+        reembed_chunk_task.s(profile_ids[i:i + chunk_size]) for i in range(0, len(profile_ids), chunk_size)
+    )(finish_reembed_task.s())
+    return f"Re-embed: {len(stale)} profiles queued."
+
+
+@app.task
+def reembed_chunk_task(profile_ids):
+    """
+    Celery task that stores current-model embeddings for one chunk of
+    profiles. Profiles are left registered either way: a face the new model
+    cannot find simply stays out of this model's gallery.
+
+    Args:
+        profile_ids (list[str]): face_ids of the profiles in this chunk.
+
+    Returns:
+        int: Number of profiles embedded.
+    """
+    from .models import FaceProfile
+
+    profiles = list(FaceProfile.objects.filter(face_id__in=profile_ids))
+    embedded, rows = embed_profiles(profiles)
+    with transaction.atomic():
+        replace_face_embeddings(embedded, rows)
+    if len(embedded) < len(profiles):
+        logger.warning(
+            "No face found with %s for %d profiles.", current_embedding_model(), len(profiles) - len(embedded),
         )
+    return len(embedded)
+
+
+@app.task
+def finish_reembed_task(chunk_results):
+    """
+    Chord callback of a re-embedding run: reloads every gallery once.
+
+    Args:
+        chunk_results (list[int]): Embedded counts returned by the chunks.
+    """
+    from .gallery import get_redis
+
+    model_name = current_embedding_model()
+    get_redis().delete(f"face_model:reembed:{model_name}")
+    if not sum(chunk_results):
+        return
+    publish_gallery_delta(
+        make_reload_delta(),
+        f"{sum(chunk_results)} profiles re-embedded with {model_name}. Updating AI library.",
+    )
+    export_gallery_snapshot()
+
+
+@app.task
+def reembed_profiles_task(tier, switch=True, chunk_size=None, threads=None):
+    """
+    Celery task that embeds the next chunk of a streaming re-embedding run
+    (see api.reembedding) and queues itself for the one after, so the run
+    is a chain of small tasks that resumes from its checkpoint. The last
+    call switches every worker to the new tier.
+
+    Args:
+        tier (str): Target entry of FACE_MODEL_TIERS.
+        switch (bool): Make `tier` the active tier once every profile is done.
+        chunk_size (int, optional): Profiles per chunk; FACE_REEMBED_CHUNK_SIZE by default.
+        threads (int, optional): Image decoding threads; FACE_REEMBED_DECODE_THREADS by default.
+
+    Returns:
+        dict: The run's checkpoint after this chunk.
+    """
+    from .reembedding import format_report, get_reembed_run
+
+    run = get_reembed_run(tier, chunk_size=chunk_size, threads=threads)
+    try:
+        counts = run.run_chunk()
+    except Exception:
+        run.release()
+        logger.exception("Re-embedding towards %s stopped; resume it later.", tier, extra={'tier': tier})
+        raise
+
+    if counts is None:
+        run.finish(switch=switch)
+        logger.info("Re-embedding finished. %s", format_report(run.checkpoint()), extra={'checkpoint': run.checkpoint()})
     else:
-        print(f"Celery Warning: Face not detected in image for {profile.name}.")
+        reembed_profiles_task.delay(tier, switch, chunk_size, threads)
+        logger.info("Re-embedding: %s", format_report(run.checkpoint()), extra={'checkpoint': run.checkpoint()})
+    return run.checkpoint()
 
 
 @app.task
-def create_access_log_task(profile_name, log_message, is_recognized, snapshot_base64=None):
+def create_access_log_task(log_message, is_recognized, profile_id=None, snapshot_base64=None, profile_name=None):
     """
     Celery task to asynchronously create a new AccessLog entry.
 
     Args:
-        profile_name (str): The name of the recognized person, or "Stranger".
         log_message (str): The detailed log description.
         is_recognized (bool): True if a profile was successfully matched.
+        profile_id (uuid, optional): The primary key (face_id) of the matched FaceProfile.
         snapshot_base64 (str, optional): Base64 image data of the snapshot. (Currently unused).
+        profile_name (str, optional): Deprecated name lookup, kept for messages queued before profile_id.
+    """
+    from .models import FaceProfile
+
+    if profile_id is None and profile_name not in (None, "Stranger"):
+        profile_id = FaceProfile.objects.filter(name=profile_name).values_list('face_id', flat=True).first()
+
+    create_access_logs_task([{
+        'profile_id': str(profile_id) if profile_id else None,
+        'log_message': log_message,
+        'is_recognized': is_recognized,
+        'timestamp': timezone.now().isoformat(),
+    }])
+
+@app.task
+def create_access_logs_task(entries):
+    """
+    Celery task to write a batch of buffered AccessLog entries in one INSERT.
+
+    Args:
+        entries (list): Dicts with `profile_id`, `log_message`, `is_recognized`
+            and an ISO `timestamp`, as collected by AccessLogBuffer. Stream
+            visits also carry `camera_id`, `last_seen`, `frame_count`,
+            `best_score` and a base64 JPEG `snapshot`.
     """
     from .models import AccessLog, FaceProfile
-    
-    profile = None
-    if profile_name != "Stranger":
-        try:
-            profile = FaceProfile.objects.get(name=profile_name)
-        except FaceProfile.DoesNotExist:
-            profile = None
-
-    AccessLog.objects.create(
-        profile=profile,
-        log_message=log_message,
-        is_recognized=is_recognized,
-    )
-    print(f"Celery: Access Log created for {profile_name}.")
+
+    # A profile may have been deleted while its events sat in the buffer.
+    profile_ids = {entry['profile_id'] for entry in entries if entry['profile_id']}
+    existing = {
+        str(face_id) for face_id in
+        FaceProfile.objects.filter(face_id__in=profile_ids).values_list('face_id', flat=True)
+    }
+
+    logs = []
+    for entry in entries:
+        log = AccessLog(
+            profile_id=entry['profile_id'] if entry['profile_id'] in existing else None,
+            log_message=entry['log_message'],
+            is_recognized=entry['is_recognized'],
+            timestamp=datetime.fromisoformat(entry['timestamp']),
+            camera_id=entry.get('camera_id') or '',
+            last_seen=datetime.fromisoformat(entry['last_seen']) if entry.get('last_seen') else None,
+            frame_count=entry.get('frame_count', 1),
+            best_score=entry.get('best_score'),
+        )
+        if entry.get('snapshot'):
+            # bulk_create does not run FileField.save(), so store the file first.
+            log.snapshot_image = default_storage.save(
+                f"log_snapshots/{uuid.uuid4().hex}.jpg",
+                ContentFile(base64.b64decode(entry['snapshot'])),
+            )
+        logs.append(log)
+
+    AccessLog.objects.bulk_create(logs, batch_size=1000)
+    logger.info("%d access logs created.", len(entries), extra={'access_logs': len(entries)})
+
+@app.task
+def export_gallery_snapshot_task(force=False):
+    """
+    Celery task to write a fresh shared gallery snapshot when the gallery
+    has changed since the last one.
+
+    Args:
+        force (bool): Write a snapshot even if the current one is up to date.
+    """
+    version = export_gallery_snapshot(force=force)
+    return f"Snapshot: {'wrote v%d' % version if version is not None else 'up to date'}."
+
+@shared_task
+def rollup_access_logs_task():
+    """
+    Celery task to fold newly written AccessLog rows into AccessLogRollup.
+    This task should be scheduled (e.g., using Celery Beat) every minute.
+    """
+    from .rollups import update_access_log_rollup
+
+    groups = update_access_log_rollup()
+    return f"Rollup Success: Updated {groups} rollup groups."
 
 @shared_task 
 def cleanup_old_logs():
     """
-    Celery task to delete AccessLog entries older than 7 days.
+    Celery task to enforce AccessLog retention on the partitioned log table.
     This task should be scheduled (e.g., using Celery Beat) to run daily.
+
+    Creates the partitions for the coming FACE_ACCESS_LOG_PARTITION_PREMAKE_DAYS
+    days, then detaches and drops every partition older than
+    FACE_ACCESS_LOG_RETENTION_DAYS instead of deleting rows one by one.
     """
-    from .models import AccessLog
-    
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    
-    old_logs = AccessLog.objects.filter(timestamp__lt=seven_days_ago)
-    
-    deleted_count, _ = old_logs.delete()
-    
-    return f"Cleanup Success: Deleted {deleted_count} old logs (older than {seven_days_ago.strftime('%Y-%m-%d')})."
\ No newline at end of file
+    from .partitions import drop_partitions_before, ensure_partitions
+
+    now = timezone.now()
+    cutoff = now - timedelta(days=settings.FACE_ACCESS_LOG_RETENTION_DAYS)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        created = ensure_partitions(
+            cursor,
+            now.date(),
+            now.date() + timedelta(days=settings.FACE_ACCESS_LOG_PARTITION_PREMAKE_DAYS),
+            settings.FACE_ACCESS_LOG_PARTITION_DAYS,
+        )
+        dropped, deleted_count = drop_partitions_before(cursor, cutoff)
+
+    return (
+        f"Cleanup Success: Created {len(created)} partitions, dropped {len(dropped)} partitions "
+        f"and {deleted_count} stray logs (older than {cutoff.strftime('%Y-%m-%d')})."
+    )
@@ -1,3 +1,924 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import async_to_sync
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock
+import base64
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+import numpy as np
+import cv2
 
-# Create your tests here.
+from .ai_utils import ACTIVE_TIER_KEY, normalize_rows
+from .gallery import GALLERY_JOURNAL_KEY, GALLERY_VERSION_KEY, FaceGallery
+from .pagination import keyset_page
+from .protocol import KIND_FRAME, KIND_RESULT, ProtocolError, decode_message, encode_message
+from .search_index import ExactIndex, IVFFlatIndex
+from .tracking import FaceTracker
+
+
+class FakeRedis:
+    """
+    The few Redis calls the gallery and re-embedding runs make, over dicts.
+    Pipelines run their commands right away.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+        self.hashes = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        return str(value).encode() if value is not None else None
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def exists(self, key):
+        return int(key in self.values or key in self.hashes)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.hashes.pop(key, None)
+
+    def expire(self, key, seconds):
+        return self.exists(key)
+
+    def hgetall(self, key):
+        return {name.encode(): str(value).encode() for name, value in self.hashes.get(key, {}).items()}
+
+    def hset(self, key, name, value):
+        self.hashes.setdefault(key, {})[name] = value
+
+    def hincrby(self, key, name, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[name] = int(fields.get(name, 0)) + amount
+
+    def hincrbyfloat(self, key, name, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[name] = float(fields.get(name, 0)) + amount
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def lrange(self, key, start, end):
+        return [json.dumps(entry).encode() for entry in self.lists.get(key, [])]
+
+    def publish(self, delta):
+        # What publish_gallery_delta's Lua script does.
+        self.values[GALLERY_VERSION_KEY] = self.values.get(GALLERY_VERSION_KEY, 0) + 1
+        delta = dict(delta, version=self.values[GALLERY_VERSION_KEY])
+        self.lists.setdefault(GALLERY_JOURNAL_KEY, []).append(delta)
+        return delta
+
+
+@mock.patch('api.ai_utils.settings.FACE_MODEL_STUB', True)
+class GalleryDeltaTests(SimpleTestCase):
+    dim = 8
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('api.gallery.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.rng = np.random.default_rng(0)
+        self.gallery = FaceGallery()
+        self.gallery.load_rows(['a', 'b'], ['A', 'B'], [1, 1], [0.3, 0.3], self.vectors(2))
+
+    def vectors(self, count):
+        return normalize_rows(self.rng.normal(size=(count, self.dim)).astype(np.float32))
+
+    def upsert(self, face_id, vector=None):
+        vector = self.vectors(1)[0] if vector is None else vector
+        return self.redis.publish({
+            'op': 'add', 'face_id': face_id, 'name': face_id.upper(), 'library_id': 1,
+            'threshold': 0.3, 'embedding': vector.tolist(),
+        })
+
+    def delete(self, face_id):
+        return self.redis.publish({'op': 'delete', 'face_id': face_id, 'library_id': 1, 'name': '', 'threshold': None, 'embedding': None})
+
+    def test_applies_deltas_in_order(self):
+        vector = self.vectors(1)[0]
+        self.gallery.apply_delta(self.upsert('c', vector))
+        self.gallery.apply_delta(self.delete('a'))
+        self.assertEqual(self.gallery.version, 2)
+        self.assertEqual(sorted(self.gallery.ids), ['b', 'c'])
+        match, score = self.gallery.search(vector[None, :])[0][0]
+        self.assertEqual(match['face_id'], 'c')
+        self.assertAlmostEqual(score, 1.0, places=5)
+
+    def test_ignores_deltas_it_already_has(self):
+        delta = self.upsert('c')
+        self.gallery.apply_delta(delta)
+        self.gallery.apply_delta(delta)
+        self.assertEqual(len(self.gallery), 3)
+        self.assertEqual(self.gallery.version, 1)
+
+    def test_version_gap_replays_the_journal(self):
+        self.upsert('c')
+        self.delete('b')
+        self.gallery.apply_delta(self.upsert('d'))
+        self.assertEqual(self.gallery.version, 3)
+        self.assertEqual(sorted(self.gallery.ids), ['a', 'c', 'd'])
+
+    def test_gap_past_the_journal_reloads(self):
+        self.upsert('c')
+        self.upsert('d')
+        # The journal was trimmed: it no longer holds version 1.
+        self.redis.lists[GALLERY_JOURNAL_KEY].pop(0)
+        with mock.patch.object(FaceGallery, 'load') as load:
+            self.gallery.apply_delta(self.upsert('e'))
+        load.assert_called_once_with()
+
+    def test_ensure_loaded_catches_up(self):
+        self.upsert('c')
+        self.delete('a')
+        self.gallery.ensure_loaded()
+        self.assertEqual(self.gallery.version, 2)
+        self.assertEqual(sorted(self.gallery.ids), ['b', 'c'])
+
+
+class IVFFlatIndexTests(SimpleTestCase):
+    def test_recall_against_exact_search(self):
+        rng = np.random.default_rng(0)
+        dim, size = 32, 4000
+        centers = rng.normal(size=(size // 100, dim)).astype(np.float32)
+        matrix = normalize_rows(centers[rng.integers(0, len(centers), size)] + rng.normal(scale=0.6, size=(size, dim)).astype(np.float32))
+        ids = [str(i) for i in range(size)]
+        thresholds = np.zeros(size, dtype=np.float32)
+        picks = rng.choice(size, 200, replace=False)
+        queries = normalize_rows(matrix[picks] + rng.normal(scale=0.05, size=(len(picks), dim)).astype(np.float32))
+
+        exact = ExactIndex()
+        ivf = IVFFlatIndex(nlist=32, nprobe=8)
+        for index in (exact, ivf):
+            index.build(matrix, ids)
+        self.assertTrue(ivf.trained)
+
+        expected, _ = exact.search(matrix, thresholds, queries, top_k=1)
+        found, _ = ivf.search(matrix, thresholds, queries, top_k=1)
+        recall = float(np.mean(found[:, 0] == expected[:, 0]))
+        self.assertGreaterEqual(recall, 0.95)
+
+    def test_small_gallery_is_searched_exactly(self):
+        matrix = normalize_rows(np.random.default_rng(1).normal(size=(10, 8)).astype(np.float32))
+        ivf = IVFFlatIndex(nlist=32)
+        ivf.build(matrix, [str(i) for i in range(10)])
+        self.assertFalse(ivf.trained)
+        indices, _ = ivf.search(matrix, np.zeros(10, dtype=np.float32), matrix[3:4], top_k=1)
+        self.assertEqual(indices[0, 0], 3)
+
+
+class FaceTrackerTests(SimpleTestCase):
+    @staticmethod
+    def faces(*boxes):
+        return [SimpleNamespace(bbox=np.asarray(box, dtype=np.float32)) for box in boxes]
+
+    def test_moving_faces_keep_their_ids(self):
+        tracker = FaceTracker(iou_threshold=0.3)
+        first = tracker.update(self.faces([0, 0, 100, 100], [300, 0, 400, 100]))
+        # Both move a little and are detected in the other order.
+        second = tracker.update(self.faces([305, 5, 405, 105], [5, 5, 105, 105]))
+        self.assertEqual([track.track_id for track in first], [1, 2])
+        self.assertEqual([track.track_id for track in second], [2, 1])
+
+    def test_new_face_gets_a_new_id(self):
+        tracker = FaceTracker()
+        tracker.update(self.faces([0, 0, 100, 100]))
+        tracks = tracker.update(self.faces([0, 0, 100, 100], [500, 500, 600, 600]))
+        self.assertEqual([track.track_id for track in tracks], [1, 2])
+
+    def test_track_survives_missed_frames_then_expires(self):
+        tracker = FaceTracker(max_missed=2)
+        tracker.update(self.faces([0, 0, 100, 100]))
+        tracker.update([])
+        tracker.update([])
+        self.assertEqual(tracker.update(self.faces([0, 0, 100, 100]))[0].track_id, 1)
+        for _ in range(3):
+            tracker.update([])
+        self.assertEqual(tracker.tracks, [])
+        self.assertEqual(tracker.update(self.faces([0, 0, 100, 100]))[0].track_id, 2)
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_frame_round_trip(self):
+        message = encode_message(KIND_FRAME, 42, 'entrance', None, b'\xff\xd8jpeg')
+        kind, seq, camera_id, metadata, jpeg = decode_message(message)
+        self.assertEqual((kind, seq, camera_id, metadata), (KIND_FRAME, 42, 'entrance', {}))
+        self.assertIsInstance(jpeg, memoryview)
+        self.assertEqual(bytes(jpeg), b'\xff\xd8jpeg')
+
+    def test_result_round_trip_with_unicode(self):
+        metadata = {'status': 'processed', 'detections': [{'name': 'سارة', 'bbox': [1, 2, 3, 4]}]}
+        kind, seq, camera_id, decoded, jpeg = decode_message(encode_message(KIND_RESULT, 2**32 - 1, 'بوابة', metadata))
+        self.assertEqual((kind, seq, camera_id, decoded), (KIND_RESULT, 2**32 - 1, 'بوابة', metadata))
+        self.assertEqual(bytes(jpeg), b'')
+
+    def test_rejects_short_message(self):
+        with self.assertRaises(ProtocolError):
+            decode_message(b'\x01\x01')
+
+    def test_rejects_unknown_version(self):
+        message = bytearray(encode_message(KIND_FRAME, 1, 'cam'))
+        message[0] = 99
+        with self.assertRaises(ProtocolError):
+            decode_message(bytes(message))
+
+    def test_rejects_lengths_past_the_end(self):
+        message = encode_message(KIND_RESULT, 1, 'cam', {'status': 'processed'})
+        with self.assertRaises(ProtocolError):
+            decode_message(message[:-3])
+
+
+class KeysetPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import AccessLog
+
+        now = timezone.now()
+        # Pairs of logs share a timestamp, so the id breaks the ties.
+        AccessLog.objects.bulk_create(
+            AccessLog(timestamp=now - timedelta(minutes=i // 2), log_message=f"log {i}") for i in range(25)
+        )
+
+    def ordered_ids(self):
+        from .models import AccessLog
+
+        return list(AccessLog.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+
+    def test_walks_every_log_once_newest_first(self):
+        from .models import AccessLog
+
+        pages, cursor = [], None
+        while True:
+            items, cursor, _ = keyset_page(AccessLog.objects.all(), cursor, page_size=10)
+            pages.append([log.pk for log in items])
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual([pk for page in pages for pk in page], self.ordered_ids())
+
+    def test_previous_cursor_returns_the_page_before(self):
+        from .models import AccessLog
+
+        first, next_cursor, previous_cursor = keyset_page(AccessLog.objects.all(), page_size=10)
+        self.assertIsNone(previous_cursor)
+        second, _, previous_cursor = keyset_page(AccessLog.objects.all(), next_cursor, page_size=10)
+        back, _, newest = keyset_page(AccessLog.objects.all(), previous_cursor, page_size=10)
+        self.assertEqual([log.pk for log in back], [log.pk for log in first])
+        self.assertEqual([log.pk for log in second], self.ordered_ids()[10:20])
+        self.assertIsNone(newest)
+
+    def test_empty_queryset(self):
+        from .models import AccessLog
+
+        self.assertEqual(keyset_page(AccessLog.objects.none()), ([], None, None))
+
+
+class EnrollmentMappingTests(SimpleTestCase):
+    def test_reads_rows_with_image_and_name(self):
+        from .enrollment import read_mapping
+
+        data = '﻿image,name,description\na.jpg,Sara,Staff\nb.jpg,,No name\n,Omar,\nc.jpg,Omar,\n'.encode()
+        self.assertEqual(read_mapping(data), [
+            {'image': 'a.jpg', 'name': 'Sara', 'description': 'Staff'},
+            {'image': 'c.jpg', 'name': 'Omar', 'description': ''},
+        ])
+
+    def test_rejects_missing_columns(self):
+        from .enrollment import read_mapping
+
+        with self.assertRaises(ValueError):
+            read_mapping(b'file,person\na.jpg,Sara\n')
+
+    def test_zip_source_reads_by_relative_path(self):
+        from .enrollment import ImageSource
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('people/a.jpg', b'jpeg')
+        archive.seek(0)
+        source = ImageSource(archive=archive)
+        self.assertEqual(source.read('/people/a.jpg'), b'jpeg')
+        self.assertIsNone(source.read('people/b.jpg'))
+        source.close()
+
+    def test_directory_source_stays_inside_the_directory(self):
+        from .enrollment import ImageSource
+
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'images'))
+            with open(os.path.join(root, 'images', 'a.jpg'), 'wb') as f:
+                f.write(b'jpeg')
+            with open(os.path.join(root, 'secret.txt'), 'wb') as f:
+                f.write(b'secret')
+            source = ImageSource(directory=os.path.join(root, 'images'))
+            self.assertEqual(source.read('a.jpg'), b'jpeg')
+            self.assertIsNone(source.read('../secret.txt'))
+
+
+@override_settings(FACE_MODEL_STUB=True)
+@mock.patch('api.tasks.export_gallery_snapshot')
+@mock.patch('api.tasks.publish_gallery_delta')
+class EnrollmentTaskTests(TestCase):
+    def setUp(self):
+        from .models import EnrollmentJob, FaceLibrary, FaceProfile
+
+        self.library = FaceLibrary.objects.create(name='Staff')
+        self.job = EnrollmentJob.objects.create(
+            library=self.library, mapping='enrollment_uploads/map.csv', status=EnrollmentJob.STATUS_EMBEDDING, total=5,
+        )
+        # bulk_create, as prepare_enrollment does, so no per-profile task is queued.
+        self.profiles = FaceProfile.objects.bulk_create(
+            FaceProfile(library=self.library, name=f"P{i}", face_image=f"faces_images/{i}.jpg") for i in range(5)
+        )
+
+    @staticmethod
+    def embeddings(image_path):
+        # Images 3 and 4 have no face.
+        return None if image_path.endswith(('3.jpg', '4.jpg')) else [np.ones(8, dtype=np.float32)]
+
+    def test_chunks_update_the_counters(self, publish, export):
+        from .models import EnrollmentJob, FaceEmbedding
+        from .tasks import bulk_embed_chunk_task, finish_enrollment_task
+
+        ids = [str(profile.face_id) for profile in self.profiles]
+        with mock.patch('api.tasks.get_face_embedding', side_effect=self.embeddings):
+            results = [bulk_embed_chunk_task(self.job.pk, ids[:3]), bulk_embed_chunk_task(self.job.pk, ids[3:])]
+        self.assertEqual(results, [3, 0])
+
+        job = EnrollmentJob.objects.get(pk=self.job.pk)
+        self.assertEqual((job.processed, job.registered, job.failed), (5, 3, 2))
+        self.assertEqual(job.progress, 100.0)
+        self.assertEqual(FaceEmbedding.objects.filter(model_name='stub').count(), 3)
+
+        finish_enrollment_task(results, self.job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, EnrollmentJob.STATUS_DONE)
+        self.assertIsNotNone(job.finished_at)
+        publish.assert_called_once()
+        export.assert_called_once_with()
+
+    def test_failed_chunk_fails_the_job(self, publish, export):
+        from .models import EnrollmentJob
+        from .tasks import fail_enrollment_task
+
+        with self.assertLogs('api.tasks', 'ERROR'):
+            fail_enrollment_task(SimpleNamespace(id='task'), RuntimeError("model crashed"), None, self.job.pk)
+        job = EnrollmentJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.status, EnrollmentJob.STATUS_FAILED)
+        self.assertEqual(job.error, "model crashed")
+        self.assertIsNotNone(job.finished_at)
+        # Nothing was registered, so the galleries are left alone.
+        publish.assert_not_called()
+
+    def test_bad_mapping_fails_the_job(self, publish, export):
+        from .models import EnrollmentJob
+        from .tasks import prepare_enrollment_task
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'enrollment_uploads'))
+            with open(os.path.join(media_root, 'enrollment_uploads', 'map.csv'), 'wb') as f:
+                f.write(b'file,person\na.jpg,Sara\n')
+            with self.assertLogs('api.tasks', 'ERROR'):
+                prepare_enrollment_task(self.job.pk)
+        job = EnrollmentJob.objects.get(pk=self.job.pk)
+        self.assertEqual(job.status, EnrollmentJob.STATUS_FAILED)
+        self.assertIn("'image' and 'name'", job.error)
+
+
+class AccessLogBufferTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('api.tasks.create_access_logs_task.delay')
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('api.access_logs.atexit.register')
+        self.register = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def entry(i):
+        return {
+            'profile_id': None, 'log_message': f"Stranger {i}", 'is_recognized': False,
+            'timestamp': timezone.now().isoformat(), 'camera_id': 'gate',
+        }
+
+    def test_flushes_when_full(self):
+        from .access_logs import AccessLogBuffer
+
+        buffer = AccessLogBuffer(batch_size=3, flush_seconds=60)
+        entries = [self.entry(i) for i in range(4)]
+        for entry in entries:
+            buffer.add(entry)
+        # One task per full batch, with the entries as they were added.
+        self.delay.assert_called_once_with(entries[:3])
+        self.assertEqual(json.loads(json.dumps(self.delay.call_args.args[0])), entries[:3])
+
+    def test_flushes_after_the_interval(self):
+        from .access_logs import AccessLogBuffer
+
+        buffer = AccessLogBuffer(batch_size=100, flush_seconds=0.05)
+        entry = self.entry(0)
+        buffer.add(entry)
+        for _ in range(100):
+            if self.delay.called:
+                break
+            time.sleep(0.02)
+        self.delay.assert_called_once_with([entry])
+
+    def test_flushes_on_exit(self):
+        from .access_logs import AccessLogBuffer
+
+        buffer = AccessLogBuffer(batch_size=100, flush_seconds=60)
+        entries = [self.entry(0), self.entry(1)]
+        for entry in entries:
+            buffer.add(entry)
+        self.delay.assert_not_called()
+        self.register.assert_called_once_with(buffer.flush)
+        self.register.call_args.args[0]()
+        self.delay.assert_called_once_with(entries)
+
+    def test_empty_flush_sends_nothing(self):
+        from .access_logs import AccessLogBuffer
+
+        AccessLogBuffer().flush()
+        self.delay.assert_not_called()
+
+
+class AccessLogTaskTests(TestCase):
+    def test_writes_a_batch_in_one_insert(self):
+        from .models import AccessLog, FaceLibrary, FaceProfile
+        from .tasks import create_access_logs_task
+
+        library = FaceLibrary.objects.create(name='Staff')
+        profile = FaceProfile.objects.bulk_create([FaceProfile(library=library, name='Sara', face_image='faces_images/s.jpg')])[0]
+        now = timezone.now()
+        entries = [
+            {'profile_id': str(profile.pk), 'log_message': "Sara", 'is_recognized': True,
+             'timestamp': (now - timedelta(minutes=1)).isoformat(), 'camera_id': 'gate',
+             'last_seen': now.isoformat(), 'frame_count': 12, 'best_score': 0.8},
+            # Deleted while its event was buffered.
+            {'profile_id': str(uuid.uuid4()), 'log_message': "Gone", 'is_recognized': True, 'timestamp': now.isoformat()},
+        ]
+        with self.assertNumQueries(2):
+            create_access_logs_task(entries)
+
+        sara, gone = AccessLog.objects.order_by('timestamp')
+        self.assertEqual((sara.profile_id, sara.camera_id, sara.frame_count, sara.best_score), (profile.pk, 'gate', 12, 0.8))
+        self.assertEqual(sara.last_seen, now)
+        self.assertIsNone(gone.profile_id)
+        self.assertEqual(gone.frame_count, 1)
+
+
+class PresenceTrackerTests(SimpleTestCase):
+    start = timezone.now()
+
+    @staticmethod
+    def detection(track_id, face_id=None, score=None, bbox=(10, 10, 50, 50)):
+        return {
+            'track_id': track_id, 'face_id': face_id, 'name': face_id or "Stranger",
+            'is_recognized': face_id is not None, 'score': score, 'bbox': list(bbox),
+        }
+
+    def at(self, seconds):
+        return self.start + timedelta(seconds=seconds)
+
+    def test_visit_closes_after_the_absence_timeout(self):
+        from .presence import PresenceTracker
+
+        tracker = PresenceTracker('gate', absence_seconds=5, min_frames=3)
+        image = np.full((100, 100, 3), 128, dtype=np.uint8)
+        for second, score in enumerate([0.6, 0.8, 0.7]):
+            self.assertEqual(tracker.observe(image, [self.detection(1, 'sara', score)], {}, now=self.at(second)), [])
+        # Still within the timeout: the visit stays open.
+        self.assertEqual(tracker.observe(image, [], {}, now=self.at(6)), [])
+
+        (visit,) = tracker.observe(image, [], {}, now=self.at(8))
+        entry = visit.to_log_entry()
+        self.assertEqual((entry['profile_id'], entry['camera_id'], entry['frame_count']), ('sara', 'gate', 3))
+        self.assertEqual(entry['best_score'], 0.8)
+        self.assertEqual((entry['timestamp'], entry['last_seen']), (self.at(0).isoformat(), self.at(2).isoformat()))
+        self.assertTrue(entry['snapshot'])
+        self.assertEqual(tracker.profiles, {})
+
+    def test_returning_face_reopens_a_new_visit(self):
+        from .presence import PresenceTracker
+
+        tracker = PresenceTracker(absence_seconds=5, min_frames=1)
+        tracker.observe(None, [self.detection(1, 'sara')], {}, now=self.at(0))
+        closed = tracker.observe(None, [self.detection(2, 'sara')], {}, now=self.at(10))
+        self.assertEqual([visit.last_seen for visit in closed], [self.at(0)])
+        self.assertEqual([visit.first_seen for visit in tracker.close_all()], [self.at(10)])
+
+    def test_drops_visits_shorter_than_min_frames(self):
+        from .presence import PresenceTracker
+
+        tracker = PresenceTracker(absence_seconds=5, min_frames=3)
+        tracker.observe(None, [self.detection(1, 'sara'), self.detection(2)], {}, now=self.at(0))
+        tracker.observe(None, [self.detection(1, 'sara'), self.detection(2)], {}, now=self.at(1))
+        self.assertEqual(tracker.observe(None, [], {}, now=self.at(10)), [])
+        self.assertEqual((tracker.profiles, tracker.strangers), ({}, []))
+
+    def test_groups_strangers_by_embedding(self):
+        from .presence import PresenceTracker
+
+        rng = np.random.default_rng(0)
+        alice, bob = rng.normal(size=(2, 64)).astype(np.float32)
+        tracker = PresenceTracker(min_frames=1, stranger_similarity=0.45)
+        # Tracks 1 and 2 are the same stranger (a lost and restarted track),
+        # track 3 is someone else.
+        tracker.observe(None, [self.detection(1)], {1: alice}, now=self.at(0))
+        tracker.observe(None, [self.detection(2), self.detection(3)], {
+            2: alice + rng.normal(scale=0.2, size=64).astype(np.float32), 3: bob,
+        }, now=self.at(1))
+
+        visits = sorted(tracker.close_all(), key=lambda visit: visit.frame_count)
+        self.assertEqual([visit.frame_count for visit in visits], [1, 2])
+        self.assertTrue(all(not visit.is_recognized and visit.profile_id is None for visit in visits))
+        self.assertEqual(visits[1].to_log_entry()['log_message'], "New Stranger detected")
+
+
+class MotionGateTests(SimpleTestCase):
+    @staticmethod
+    def frame(square=None):
+        frame = np.full((240, 320, 3), 90, dtype=np.uint8)
+        if square is not None:
+            left, top = square
+            frame[top:top + 60, left:left + 60] = 250
+        return frame
+
+    def test_static_scene_is_gated(self):
+        from .motion import MotionGate
+
+        gate = MotionGate(force_every=5)
+        self.assertTrue(gate.should_detect(self.frame()))
+        self.assertEqual([gate.should_detect(self.frame()) for _ in range(5)], [False] * 4 + [True])
+
+    def test_motion_or_live_tracks_open_the_gate(self):
+        from .motion import MotionGate
+
+        gate = MotionGate(force_every=100)
+        gate.should_detect(self.frame())
+        self.assertFalse(gate.should_detect(self.frame()))
+        self.assertTrue(gate.should_detect(self.frame(square=(100, 80))))
+        self.assertTrue(gate.should_detect(self.frame(), has_tracks=True))
+
+    def test_motion_outside_the_rois_is_ignored(self):
+        from .motion import MotionGate
+
+        gate = MotionGate(rois=[(0.0, 0.0, 0.4, 1.0)], force_every=100)
+        gate.should_detect(self.frame())
+        self.assertFalse(gate.should_detect(self.frame(square=(240, 80))))
+        self.assertTrue(gate.should_detect(self.frame(square=(20, 80))))
+
+    def test_roi_boxes(self):
+        from .motion import roi_boxes
+
+        self.assertEqual(roi_boxes([], 320, 240), [(0, 0, 320, 240)])
+        self.assertEqual(roi_boxes([(0.25, 0.0, 0.75, 0.8)], 320, 240), [(80, 0, 240, 192)])
+        # Clamped to the frame; boxes left empty are dropped.
+        self.assertEqual(roi_boxes([(-0.1, -0.2, 1.5, 0.5), (1.2, 0.0, 1.4, 1.0)], 320, 240), [(0, 0, 320, 120)])
+        # Overlapping boxes are merged, through a chain of overlaps too;
+        # separate ones are kept.
+        self.assertEqual(
+            roi_boxes([(0.0, 0.0, 0.3, 0.5), (0.6, 0.0, 1.0, 0.5), (0.2, 0.4, 0.7, 0.6)], 100, 100),
+            [(0, 0, 100, 60)],
+        )
+        self.assertEqual(
+            roi_boxes([(0.0, 0.0, 0.3, 0.3), (0.5, 0.5, 1.0, 1.0), (0.1, 0.1, 0.2, 0.2)], 100, 100),
+            [(0, 0, 30, 30), (50, 50, 100, 100)],
+        )
+
+
+class PartitionBoundsTests(SimpleTestCase):
+    def test_daily_partitions_start_on_the_day(self):
+        from .partitions import partition_start
+
+        self.assertEqual(partition_start(date(2026, 10, 18), 1), date(2026, 10, 18))
+
+    def test_weekly_partitions_start_on_monday(self):
+        from .partitions import partition_start
+
+        monday = date(2026, 10, 12)
+        self.assertEqual(monday.weekday(), 0)
+        for offset in range(7):
+            self.assertEqual(partition_start(monday + timedelta(days=offset), 7), monday)
+        self.assertEqual(partition_start(monday + timedelta(days=7), 7), monday + timedelta(days=7))
+
+    def test_partition_name(self):
+        from .partitions import partition_name
+
+        self.assertEqual(partition_name(date(2026, 1, 5)), 'api_accesslog_p20260105')
+
+
+class PartitionRetentionTests(TestCase):
+    @staticmethod
+    def midnight(day):
+        return datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc)
+
+    def rows_in(self, cursor, table):
+        cursor.execute(f'SELECT COUNT(*) FROM "{table}"')
+        return cursor.fetchone()[0]
+
+    def test_creates_drops_and_moves_rows(self):
+        from django.db import connection
+        from .models import AccessLog
+        from .partitions import DEFAULT_PARTITION, drop_partitions_before, ensure_partitions, list_partitions, partition_name
+
+        with connection.cursor() as cursor:
+            first = list_partitions(cursor)[-1][2].date()
+            # Rows past the last partition, and expired ones, wait in DEFAULT.
+            AccessLog.objects.create(timestamp=self.midnight(first) + timedelta(days=1, hours=3), log_message="later")
+            AccessLog.objects.create(timestamp=self.midnight(date(2001, 1, 1)), log_message="expired")
+            self.assertEqual(self.rows_in(cursor, DEFAULT_PARTITION), 2)
+
+            created = ensure_partitions(cursor, first, first + timedelta(days=2))
+            self.assertEqual(created, [partition_name(first + timedelta(days=i)) for i in range(3)])
+            self.assertEqual(ensure_partitions(cursor, first, first + timedelta(days=2)), [])
+            self.assertEqual(self.rows_in(cursor, created[1]), 1)
+            self.assertEqual(self.rows_in(cursor, DEFAULT_PARTITION), 1)
+
+            dropped, deleted = drop_partitions_before(cursor, self.midnight(first + timedelta(days=1)))
+            self.assertIn(created[0], dropped)
+            self.assertEqual(deleted, 1)
+            self.assertEqual([name for name, _, _ in list_partitions(cursor)], created[1:])
+        self.assertEqual(list(AccessLog.objects.values_list('log_message', flat=True)), ["later"])
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        from .embedding_cache import EmbeddingCache
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = EmbeddingCache(self.directory)
+
+    def put(self, data, model_name='model-a'):
+        key = self.cache.key(data)
+        self.cache.put(key, model_name, np.ones((1, 8)), [[1, 2, 3, 4]], [0.9])
+        return key
+
+    def test_round_trip(self):
+        key = self.cache.key(b'image')
+        self.assertIsNone(self.cache.get(key, 'model-a'))
+        self.cache.put(key, 'model-a', np.ones((2, 8)), [[1, 2, 3, 4], [5, 6, 7, 8]], [0.9, 0.8])
+
+        embeddings, bboxes, det_scores = self.cache.get(key, 'model-a')
+        np.testing.assert_array_equal(embeddings, np.ones((2, 8), dtype=np.float32))
+        np.testing.assert_array_equal(bboxes[1], [5, 6, 7, 8])
+        np.testing.assert_allclose(det_scores, [0.9, 0.8])
+        # Keyed by model too, and by the exact bytes.
+        self.assertIsNone(self.cache.get(key, 'model-b'))
+        self.assertIsNone(self.cache.get(self.cache.key(b'image2'), 'model-a'))
+
+    def test_image_without_faces_is_a_hit(self):
+        key = self.cache.key(b'empty')
+        self.cache.put(key, 'model-a', np.zeros((0, 8)), np.zeros((0, 4)), [])
+        embeddings, _, _ = self.cache.get(key, 'model-a')
+        self.assertEqual(len(embeddings), 0)
+
+    def test_evicts_least_recently_used_and_keeps_fresh_tmp_files(self):
+        from .embedding_cache import TMP_GRACE_SECONDS, TMP_SUFFIX
+
+        now = time.time()
+        keys = [self.put(f'image {i}'.encode()) for i in range(3)]
+        paths = [self.cache.path(key, 'model-a') for key in keys]
+        for age, path in zip([300, 100, 200], paths):
+            os.utime(path, (now - age, now - age))
+        # Reading an entry makes it the most recently used.
+        self.cache.get(keys[0], 'model-a')
+
+        size = os.path.getsize(paths[0])
+        writing, abandoned = f"{paths[1]}.a{TMP_SUFFIX}", f"{paths[1]}.b{TMP_SUFFIX}"
+        for path, age in ((writing, 10), (abandoned, TMP_GRACE_SECONDS + 10)):
+            with open(path, 'wb') as f:
+                f.write(b'\0' * size)
+            os.utime(path, (now - age, now - age))
+
+        # Four files count (the fresh tmp file does not); evicting down to
+        # 90% of the limit removes the two least recently used.
+        self.cache.max_bytes = int(size * 2.3)
+        self.assertEqual(self.cache.evict(), 2)
+        self.assertEqual([os.path.exists(path) for path in paths], [True, True, False])
+        self.assertTrue(os.path.exists(writing))
+        self.assertFalse(os.path.exists(abandoned))
+
+    @override_settings(FACE_MODEL_STUB=True)
+    def test_cache_errors_fall_back_to_the_model(self):
+        from .ai_utils import get_face_embedding
+        from .stub_model import StubFaceApp
+
+        image = (np.random.default_rng(0).random((120, 160, 3)) * 255).astype(np.uint8)
+        with open(os.path.join(self.directory, 'face.jpg'), 'wb') as f:
+            f.write(cv2.imencode('.jpg', image)[1].tobytes())
+
+        broken = mock.Mock(key=self.cache.key)
+        broken.get.side_effect = OSError("disk full")
+        broken.put.side_effect = OSError("disk full")
+        with override_settings(MEDIA_ROOT=self.directory), \
+                mock.patch('api.ai_utils.get_app', return_value=StubFaceApp(dim=16)):
+            with mock.patch('api.ai_utils.get_embedding_cache', return_value=None):
+                expected = get_face_embedding('face.jpg')
+            with mock.patch('api.ai_utils.get_embedding_cache', return_value=broken), \
+                    self.assertLogs('api.ai_utils', 'ERROR'):
+                embeddings = get_face_embedding('face.jpg')
+        self.assertEqual(len(expected), 1)
+        self.assertEqual(embeddings, expected)
+        broken.put.assert_called_once()
+
+
+@mock.patch('api.tasks.reembed_stale_profiles_task.apply_async')
+@mock.patch('api.reembedding.export_gallery_snapshot')
+@mock.patch('api.reembedding.publish_gallery_delta')
+@mock.patch('api.reembedding.use_model_tier')
+class ReembedRunTests(TestCase):
+    def setUp(self):
+        from .models import FaceLibrary
+        from .stub_model import StubFaceApp
+
+        self.redis = FakeRedis()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        os.makedirs(os.path.join(self.media_root, 'faces_images'))
+        for patcher in (
+            mock.patch('api.reembedding.get_redis', return_value=self.redis),
+            mock.patch('api.reembedding.get_embedding_cache', return_value=None),
+            mock.patch('api.reembedding.load_face_app', return_value=StubFaceApp(dim=16)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.library = FaceLibrary.objects.create(name='Staff')
+        self.rng = np.random.default_rng(0)
+
+    def enroll(self, *numbers):
+        from .models import FaceProfile
+
+        profiles = []
+        for number in numbers:
+            name = f"faces_images/{number}.jpg"
+            image = (self.rng.random((120, 160, 3)) * 255).astype(np.uint8)
+            cv2.imwrite(os.path.join(self.media_root, name), image)
+            profiles.append(FaceProfile(
+                face_id=uuid.UUID(int=number), library=self.library, name=f"P{number}",
+                face_image=name, is_registered=True,
+            ))
+        return FaceProfile.objects.bulk_create(profiles)
+
+    def embedded(self):
+        from .models import FaceEmbedding
+
+        return sorted(
+            FaceEmbedding.objects.filter(model_name='buffalo_s-int8').values_list('profile__face_id', flat=True)
+        )
+
+    def test_resumes_from_the_checkpoint_and_sweeps_late_enrollments(self, use_model_tier, publish, export, stale):
+        from .reembedding import ReembedRun
+
+        self.enroll(10, 20, 30, 40, 50)
+        run = ReembedRun('cpu', chunk_size=2)
+        self.assertTrue(run.start())
+        self.assertFalse(ReembedRun('cpu').start())
+        self.assertEqual(run.run_chunk()['embedded'], 2)
+        self.assertEqual(run.checkpoint()['last_face_id'], str(uuid.UUID(int=20)))
+
+        # Another worker picks the run up after the checkpoint; a profile
+        # enrolled meanwhile sorts below it.
+        self.enroll(15)
+        resumed = ReembedRun('cpu', chunk_size=2)
+        while resumed.run_chunk() is not None:
+            pass
+        checkpoint = resumed.checkpoint()
+        self.assertEqual((checkpoint['processed'], checkpoint['embedded'], checkpoint['swept']), (5, 6, 1))
+        self.assertEqual(self.embedded(), [uuid.UUID(int=n) for n in (10, 15, 20, 30, 40, 50)])
+        # Only the old model's gallery is served so far.
+        publish.assert_not_called()
+        self.assertIsNone(self.redis.get(ACTIVE_TIER_KEY))
+
+    def test_finish_switches_the_tier(self, use_model_tier, publish, export, stale):
+        from .reembedding import ReembedRun
+
+        self.enroll(1, 2)
+        run = ReembedRun('cpu')
+        run.start()
+        while run.run_chunk() is not None:
+            pass
+        run.finish()
+        self.assertTrue(run.checkpoint()['finished'])
+        self.assertFalse(run.is_running())
+        self.assertEqual(self.redis.get(ACTIVE_TIER_KEY), b'cpu')
+        use_model_tier.assert_called_once_with('cpu')
+        self.assertEqual(publish.call_args.args[0]['model_tier'], 'cpu')
+        export.assert_called_once_with()
+        stale.assert_called_once()
+
+        # A finished run starts over on the next start().
+        self.assertTrue(run.start())
+        self.assertFalse(run.checkpoint()['finished'])
+
+    def test_finish_without_switch_keeps_the_tier(self, use_model_tier, publish, export, stale):
+        from .reembedding import ReembedRun
+
+        self.enroll(1)
+        run = ReembedRun('cpu')
+        run.start()
+        while run.run_chunk() is not None:
+            pass
+        run.finish(switch=False)
+        self.assertTrue(run.checkpoint()['finished'])
+        self.assertIsNone(self.redis.get(ACTIVE_TIER_KEY))
+        use_model_tier.assert_not_called()
+        publish.assert_not_called()
+
+
+@mock.patch.object(FaceGallery, 'ensure_loaded')
+class GalleryShardsTests(SimpleTestCase):
+    def setUp(self):
+        from .gallery import GalleryShards
+
+        self.now = 1000.0
+        patcher = mock.patch('api.gallery.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.shards = GalleryShards(idle_seconds=60)
+
+    def test_shards_are_shared_and_counted(self, ensure_loaded):
+        first = self.shards.acquire([1, 2])
+        second = self.shards.acquire([2])
+        self.assertEqual([shard.library_id for shard in first], [1, 2])
+        self.assertIs(second[0], first[1])
+        self.assertEqual(ensure_loaded.call_count, 3)
+        self.assertEqual({library_id: stats['users'] for library_id, stats in self.shards.stats().items()}, {1: 1, 2: 2})
+
+        self.shards.release([2])
+        self.now += 600
+        # Library 2 still has a user, so nothing is evicted.
+        self.assertEqual({library_id: stats['users'] for library_id, stats in self.shards.stats().items()}, {1: 1, 2: 1})
+
+    def test_idle_shards_are_evicted(self, ensure_loaded):
+        (shard,) = self.shards.acquire([1])
+        self.shards.release([1])
+        self.now += 30
+        # Reused while it has been idle for less than idle_seconds.
+        self.assertIs(self.shards.acquire([1])[0], shard)
+        self.shards.release([1])
+
+        self.now += 61
+        self.assertEqual(self.shards.loaded(), [])
+        self.assertEqual(self.shards.stats(), {})
+        self.assertIsNot(self.shards.acquire([1])[0], shard)
+
+
+class CameraResultTests(SimpleTestCase):
+    event = {
+        'type': 'camera_result', 'camera_id': 'entrance', 'library_ids': [1], 'seq': 7,
+        'metadata': {'status': 'processed', 'source': 'ingest', 'detections': []}, 'jpeg': b'\xff\xd8jpeg',
+    }
+
+    def consumer(self, binary_results, watch=('entrance',)):
+        from .consumers import StreamConsumer
+
+        consumer = StreamConsumer()
+        consumer.watch = set(watch)
+        consumer.binary_results = binary_results
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def test_binary_watchers_get_result_messages(self):
+        consumer = self.consumer(binary_results=True)
+        async_to_sync(consumer.camera_result)(self.event)
+        kind, seq, camera_id, metadata, jpeg = decode_message(consumer.send.call_args.kwargs['bytes_data'])
+        self.assertEqual((kind, seq, camera_id, metadata['source']), (KIND_RESULT, 7, 'entrance', 'ingest'))
+        self.assertEqual(bytes(jpeg), b'\xff\xd8jpeg')
+
+    def test_json_watchers_get_text_frames(self):
+        consumer = self.consumer(binary_results=False)
+        async_to_sync(consumer.camera_result)(self.event)
+        message = json.loads(consumer.send.call_args.kwargs['text_data'])
+        self.assertEqual((message['seq'], message['camera_id'], message['status']), (7, 'entrance', 'processed'))
+        self.assertEqual(base64.b64decode(message['frame']), b'\xff\xd8jpeg')
+
+    def test_unwatched_cameras_are_ignored(self):
+        consumer = self.consumer(binary_results=True, watch=('lobby',))
+        async_to_sync(consumer.camera_result)(self.event)
+        consumer.send.assert_not_called()
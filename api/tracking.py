@@ -0,0 +1,106 @@
+import itertools
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Pairwise intersection-over-union of two (N, 4) and (M, 4) arrays of
+    [left, top, right, bottom] boxes.
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)[:, None, :]
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)[None, :, :]
+
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+class Track:
+
+    def __init__(self, track_id, face):
+        self.track_id = track_id
+        self.face = face
+        self.bbox = face.bbox
+        self.missed = 0
+        self.candidates = []
+        self.recognized_at = None
+        self.embedding = None
+
+    @property
+    def best_match(self):
+        return self.candidates[0] if self.candidates else (None, None)
+
+
+class FaceTracker:
+    """
+    Greedy IoU tracker kept per stream connection.
+
+    Each detection is attached to the overlapping track from the previous
+    frames, so an identity found once is reused until the track needs a
+    refresh: every `recognize_every` frames for confident matches, and
+    every `retry_every` frames for strangers and weak matches.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=10, recognize_every=15,
+                 retry_every=4, confident_score=0.6):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.recognize_every = recognize_every
+        self.retry_every = retry_every
+        self.confident_score = confident_score
+        self.tracks = []
+        self.frame_index = 0
+        self._ids = itertools.count(1)
+
+    def update(self, faces):
+        """
+        Associates this frame's detections with the live tracks and returns
+        the tracks seen in this frame, in detection order.
+        """
+        self.frame_index += 1
+        assigned = [None] * len(faces)
+
+        used = set()
+        if self.tracks and faces:
+            overlaps = iou_matrix([t.bbox for t in self.tracks], [f.bbox for f in faces])
+            for flat in np.argsort(-overlaps, axis=None):
+                t, f = np.unravel_index(flat, overlaps.shape)
+                if overlaps[t, f] < self.iou_threshold:
+                    break
+                if t in used or assigned[f] is not None:
+                    continue
+                assigned[f] = self.tracks[t]
+                used.add(t)
+
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.missed += 1
+
+        for i, face in enumerate(faces):
+            track = assigned[i]
+            if track is None:
+                track = Track(next(self._ids), face)
+                self.tracks.append(track)
+                assigned[i] = track
+            track.face = face
+            track.bbox = face.bbox
+            track.missed = 0
+
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        return assigned
+
+    def needs_recognition(self, track):
+        if track.recognized_at is None:
+            return True
+
+        _, score = track.best_match
+        interval = self.recognize_every if score is not None and score >= self.confident_score else self.retry_every
+        return self.frame_index - track.recognized_at >= interval
+
+    def set_candidates(self, track, candidates):
+        track.candidates = candidates
+        track.recognized_at = self.frame_index
+        track.embedding = track.face.embedding
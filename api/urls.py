@@ -4,18 +4,22 @@ from .views import (
     FaceLibraryViewSet,
     FaceProfileViewSet,
     AccessLogViewSet,
+    EnrollmentJobViewSet,
     LiveStreamView,
     AccessLogView,
+    InferenceStatsView,
     )
 
 router = DefaultRouter()
 router.register(r'libraries', FaceLibraryViewSet)
 router.register(r'profiles', FaceProfileViewSet)
 router.register(r'logs', AccessLogViewSet)
+router.register(r'enrollments', EnrollmentJobViewSet)
 
 urlpatterns = [
     path('', LiveStreamView.as_view(), name='live_stream'),
     path('logsv/', AccessLogView.as_view(), name='access_logs'),
+    path('api/inference/stats/', InferenceStatsView.as_view(), name='inference_stats'),
     path('api/', include(router.urls)),
 
 ]
\ No newline at end of file
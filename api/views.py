@@ -1,14 +1,27 @@
+from django.http import HttpResponse
 from django.shortcuts import render
 from django.views import View
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.core.paginator import Paginator
 from django.utils import timezone
 
-from rest_framework import viewsets
+from django.db import transaction
 
-from .models import FaceLibrary, FaceProfile, AccessLog
-from .serializers import FaceLibrarySerializer, FaceProfileSerializer, AccessLogSerializer
+from rest_framework import mixins, viewsets
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import FaceLibrary, FaceProfile, AccessLog, EnrollmentJob
+from .serializers import FaceLibrarySerializer, FaceProfileSerializer, AccessLogSerializer, EnrollmentJobSerializer
+from .tasks import prepare_enrollment_task
+from .ai_utils import get_model_info
+from .gallery import get_gallery_shards
+from .metrics import render_metrics
+from .inference import get_inference_service
+from .motion import gate_stats
+from .pagination import AccessLogCursorPagination, keyset_page
+from .rollups import visits_on
 
 class FaceLibraryViewSet(viewsets.ModelViewSet):
     queryset = FaceLibrary.objects.all()
@@ -19,8 +32,36 @@ class FaceProfileViewSet(viewsets.ModelViewSet):
     serializer_class = FaceProfileSerializer
     
 class AccessLogViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = AccessLog.objects.all().order_by('-timestamp')
+    queryset = AccessLog.objects.select_related('profile').order_by('-timestamp', '-id')
     serializer_class = AccessLogSerializer
+    pagination_class = AccessLogCursorPagination
+
+class EnrollmentJobViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    POST a ZIP of images plus a CSV mapping to bulk-enroll a library;
+    GET a job to follow its progress.
+    """
+    queryset = EnrollmentJob.objects.all().order_by('-created_at')
+    serializer_class = EnrollmentJobSerializer
+    parser_classes = [MultiPartParser]
+
+    def perform_create(self, serializer):
+        job = serializer.save()
+        transaction.on_commit(lambda: prepare_enrollment_task.delay(job.pk))
+
+class InferenceStatsView(APIView):
+    """
+    Recent micro-batch timings of this process's inference service, the
+    load time and memory cost of its model, per-camera motion-gate skip
+    rates and the library gallery shards it holds.
+    """
+    def get(self, request):
+        return Response({
+            **get_inference_service().stats(),
+            'model': get_model_info(),
+            'motion_gate': gate_stats.snapshot(),
+            'gallery_shards': get_gallery_shards().stats(),
+        })
 
 @method_decorator(login_required(login_url='/login/'), name='dispatch')
 class LiveStreamView(View):
@@ -30,18 +71,26 @@ class LiveStreamView(View):
 class AccessLogView(View):
     def get(self, request):
         
-        today_start = timezone.localdate()
-        today_logs_count = AccessLog.objects.filter(
-            timestamp__gte=today_start
-        ).count()
+        today_logs_count = visits_on(timezone.localdate())
         
-        log_list = AccessLog.objects.all().order_by('-timestamp')
-        paginator = Paginator(log_list, 100) 
-        page_number = request.GET.get('page')
-        page_obj = paginator.get_page(page_number)
+        log_list = AccessLog.objects.select_related('profile__library')
+        try:
+            logs, next_cursor, previous_cursor = keyset_page(log_list, request.GET.get('cursor'), 100)
+        except ValueError:
+            logs, next_cursor, previous_cursor = keyset_page(log_list, None, 100)
         context = {
-            'logs': page_obj,
+            'logs': logs,
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
             'today_visitors_count': today_logs_count,
         }
 
         return render(request, 'api/logs.html', context)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint (see api/metrics.py).
+    """
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
@@ -1,5 +1,7 @@
 import os
+import time
 from celery import Celery
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_ready
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'face_ai.settings')
 
@@ -8,3 +10,41 @@ app = Celery('face_ai')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+
+@worker_ready.connect
+def reembed_after_model_change(sender, **kwargs):
+    # A changed FACE_MODEL_TIER starts a re-embedding run towards it, and
+    # profiles left with only another tier's embedding are re-embedded.
+    from api.tasks import sync_model_tier_task
+    sync_model_tier_task.delay()
+
+
+# Task latency for /metrics: queue wait from the publish time stamped into
+# the message headers, and run time from prerun to postrun.
+_task_started = {}
+
+
+@before_task_publish.connect
+def stamp_publish_time(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, task=None, **kwargs):
+    from api.metrics import CELERY_QUEUE_SECONDS
+
+    _task_started[task_id] = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at:
+        CELERY_QUEUE_SECONDS.labels(task.name).observe(max(0.0, time.time() - published_at))
+
+
+@task_postrun.connect
+def record_task_run_time(task_id=None, task=None, state=None, **kwargs):
+    from api.metrics import CELERY_TASK_SECONDS
+
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
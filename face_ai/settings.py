@@ -135,6 +135,176 @@ CHANNEL_LAYERS = {
 }
 
 
+# Model tiers: the InsightFace pack, detector input size and whether the
+# recognition model runs INT8-quantized. 'cpu' is for GPU-less sites.
+# Embeddings are stored and matched per EMBEDDING_MODEL tag. The tier every
+# process serves is kept in Redis; when FACE_MODEL_TIER names another one,
+# the first Celery worker to start re-embeds every profile with it in the
+# background (like `manage.py reembed_profiles <tier>`) and all processes
+# keep serving the previous tier until the new one is complete.
+FACE_MODEL_TIERS = {
+    'accurate': {'PACK': 'buffalo_l', 'DET_SIZE': (640, 640), 'QUANTIZED': False, 'EMBEDDING_MODEL': 'buffalo_l'},
+    'cpu': {'PACK': 'buffalo_s', 'DET_SIZE': (320, 320), 'QUANTIZED': True, 'EMBEDDING_MODEL': 'buffalo_s-int8'},
+}
+FACE_MODEL_TIER = os.environ.get('FACE_MODEL_TIER', 'accurate')
+
+# InsightFace is loaded lazily, on the first inference in a process. Only
+# these modules of the pack are loaded (landmarks and gender/age are not
+# used), on the first available provider, with the tier's detector size.
+FACE_MODEL_MODULES = ['detection', 'recognition']
+FACE_MODEL_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+FACE_MODEL_CTX_ID = 0
+# Load tests: FACE_MODEL_STUB=True replaces InsightFace with the weight-free
+# api.stub_model, which finds FACE_MODEL_STUB_FACES faces in every frame.
+FACE_MODEL_STUB = os.environ.get('FACE_MODEL_STUB', 'False') == 'True'
+FACE_MODEL_STUB_FACES = int(os.environ.get('FACE_MODEL_STUB_FACES', '1'))
+# How often processes check Redis for a tier switch.
+FACE_MODEL_TIER_REFRESH_SECONDS = 10
+
+# Streaming re-embedding (reembed_profiles): profiles per keyset chunk and
+# threads reading and decoding their images.
+FACE_REEMBED_CHUNK_SIZE = 256
+FACE_REEMBED_DECODE_THREADS = 8
+
+# Number of gallery deltas kept in Redis so a worker that missed an event
+# can catch up without reloading every profile.
+FACE_GALLERY_JOURNAL_SIZE = 1000
+
+# Motion gate: frames are shrunk to FACE_MOTION_WIDTH pixels and compared
+# with a running background; the detector is skipped unless more than
+# FACE_MOTION_MIN_AREA of the ROI pixels changed by over
+# FACE_MOTION_PIXEL_THRESHOLD gray levels, a face is being tracked, or
+# FACE_MOTION_FORCE_EVERY frames were skipped in a row.
+FACE_MOTION_GATE = True
+FACE_MOTION_WIDTH = 160
+FACE_MOTION_PIXEL_THRESHOLD = 25
+FACE_MOTION_MIN_AREA = 0.002
+FACE_MOTION_FORCE_EVERY = 30
+
+# Detection regions per camera id, as (left, top, right, bottom) fractions
+# of the frame, e.g. {'entrance': [(0.25, 0.0, 0.75, 0.8)]}. Regions are
+# clamped to the frame and overlapping ones merged. Cameras not listed are
+# searched over the whole frame.
+FACE_CAMERA_ROIS = {}
+
+# Content-addressed cache of enrollment embeddings (SHA-256 of the image
+# plus the model tag), evicted least-recently-used beyond the size limit.
+# Set the directory to None to disable it.
+FACE_EMBEDDING_CACHE_DIR = MEDIA_ROOT / 'cache' / 'embeddings'
+FACE_EMBEDDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Shared, memory-mapped gallery snapshot (see api/gallery_snapshot.py).
+# Workers start from it instead of reading every embedding from Postgres.
+# Set to None to always load from the database.
+FACE_GALLERY_SNAPSHOT_DIR = MEDIA_ROOT / 'gallery' / 'snapshots'
+
+# Stream connections bound to libraries (ws/ai/stream/?libraries=1,2) are
+# matched against per-library gallery shards, loaded on first use and
+# evicted once no connection has used them for this many seconds.
+FACE_GALLERY_SHARD_IDLE_SECONDS = 60
+
+# Candidates returned per detected face; the best one above its library's
+# match_threshold names the face.
+FACE_MATCH_TOP_K = 3
+
+# Gallery search backend. ExactIndex scores every row; for galleries of
+# 100k+ identities switch to the approximate IVF index, e.g.:
+#   'BACKEND': 'api.search_index.IVFFlatIndex',
+#   'NLIST': 1024, 'NPROBE': 16,
+#   'PATH': MEDIA_ROOT / 'gallery' / 'ivf_index.npz',
+# and pick NPROBE with `manage.py benchmark_search_index`. One file is kept
+# per embedding model and gallery shard, named after PATH.
+FACE_SEARCH_INDEX = {
+    'BACKEND': 'api.search_index.ExactIndex',
+}
+
+# Cross-frame tracking: a tracked face keeps its identity and is only
+# re-embedded every RECOGNIZE_EVERY frames, or every RETRY_EVERY frames
+# while it is a stranger or scored below CONFIDENT_SCORE.
+FACE_TRACK_IOU_THRESHOLD = 0.3
+FACE_TRACK_MAX_MISSED = 10
+FACE_TRACK_RECOGNIZE_EVERY = 15
+FACE_TRACK_RETRY_EVERY = 4
+FACE_TRACK_CONFIDENT_SCORE = 0.6
+
+# Default response mode of ws/ai/stream/ when the client does not pass
+# ?mode=: 'annotated' returns the drawn JPEG, 'metadata' only detections.
+FACE_STREAM_DEFAULT_MODE = 'annotated'
+
+# Frames a stream client may have in flight. Frames that arrive while
+# another is still waiting are dropped (latest frame wins) and the client
+# is told to fall back to a single credit.
+FACE_STREAM_MAX_CREDITS = 2
+
+# Shared inference service: frames from every connected camera are
+# micro-batched (up to MAX_BATCH frames, waiting at most MAX_WAIT_MS) and
+# run on WORKERS dedicated threads. Batch timings: /api/inference/stats/.
+FACE_INFERENCE_MAX_BATCH = 8
+FACE_INFERENCE_MAX_WAIT_MS = 10
+FACE_INFERENCE_WORKERS = 1
+
+# Server-side ingestion (manage.py ingest_cameras): camera id -> RTSP URL
+# or video file, frames sampled per second and, optionally, the libraries
+# its faces are matched against, e.g.
+#   'entrance': {'SOURCE': 'rtsp://10.0.0.5/stream1', 'FPS': 5, 'LIBRARIES': [1]},
+# Viewers open the page with ?watch=entrance (or ?watch=all). With
+# PUBLISH_JPEG each result carries the annotated frame, scaled down to
+# JPEG_WIDTH pixels; without it only the detections are published.
+FACE_INGEST_CAMERAS = {}
+FACE_INGEST_DEFAULT_FPS = 5
+FACE_INGEST_PUBLISH_JPEG = True
+FACE_INGEST_JPEG_WIDTH = 640
+
+# Profiles per Celery task in a bulk enrollment.
+FACE_ENROLLMENT_CHUNK_SIZE = 100
+
+# Stream access logs are buffered per process and written as one batch
+# task once this many are queued or the oldest is this many seconds old.
+FACE_ACCESS_LOG_BATCH_SIZE = 200
+FACE_ACCESS_LOG_FLUSH_SECONDS = 2.0
+
+# Presence sessions: a visit ends once its face has been absent this long;
+# visits seen in fewer frames are ignored. Strangers whose embeddings are
+# this similar are counted as the same visitor.
+FACE_PRESENCE_ABSENCE_SECONDS = 5.0
+FACE_PRESENCE_MIN_FRAMES = 3
+FACE_PRESENCE_STRANGER_SIMILARITY = 0.45
+
+# api_accesslog is range-partitioned on timestamp (see api/partitions.py):
+# one partition per this many UTC days (7 for weekly), created this many
+# days ahead by cleanup_old_logs, which also drops partitions past retention.
+FACE_ACCESS_LOG_PARTITION_DAYS = 1
+FACE_ACCESS_LOG_PARTITION_PREMAKE_DAYS = 7
+FACE_ACCESS_LOG_RETENTION_DAYS = 7
+# rollup_access_logs_task only folds in logs whose id was already taken
+# this long ago, so inserts still committing are never skipped.
+FACE_ACCESS_LOG_ROLLUP_LAG_SECONDS = 30
+
+
+# Logs of the api and face_ai packages: one JSON object per line by
+# default (FACE_LOG_FORMAT=plain for a human-readable console).
+FACE_LOG_FORMAT = os.environ.get('FACE_LOG_FORMAT', 'json')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'api.structured_logging.JsonFormatter'},
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': FACE_LOG_FORMAT},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('FACE_LOG_LEVEL', 'INFO'), 'propagate': False},
+        'face_ai': {'handlers': ['console'], 'level': os.environ.get('FACE_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+# /metrics (Prometheus) is served without authentication: keep it off the
+# public interface, e.g. by only proxying it to the Prometheus server.
+# See api/metrics.py for running it over several processes.
+
+
 CELERY_BROKER_URL = f"redis://{REDIS_HOST}:6379/0"
 CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:6379/0"
 
@@ -168,5 +338,15 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(days=1),
         'args': (),
     },
+    'export-gallery-snapshot-every-5-minutes': {
+        'task': 'api.tasks.export_gallery_snapshot_task',
+        'schedule': timedelta(minutes=5),
+        'args': (),
+    },
+    'rollup-access-logs-every-minute': {
+        'task': 'api.tasks.rollup_access_logs_task',
+        'schedule': timedelta(minutes=1),
+        'args': (),
+    },
 }
 